@@ -0,0 +1,270 @@
+"""
+Per-request performance instrumentation.
+
+InstrumentationMiddleware counts and times every SQL query a request runs (through a
+database execute wrapper), adds the time spent authenticating and serializing (see
+timer()), and reports them three ways: a Server-Timing header, one structured log
+line on the `backend.requests` logger, and per-endpoint histograms served in the
+Prometheus text format by metrics_view. A SQL shape repeated more than
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times in one request is logged as an N+1.
+
+Metrics are kept per process; scrape every server process.
+"""
+import json
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+
+
+logger = logging.getLogger('backend.requests')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Placeholder lists of any length, so `IN (%s, %s)` and `IN (%s)` are one shape
+_PLACEHOLDERS = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))*\)')
+_NUMBERS = re.compile(r'\b\d+\b')
+
+
+def sql_shape(sql):
+    """The query with its placeholder lists and literal numbers collapsed, what N+1 detection counts"""
+    return _NUMBERS.sub('N', _PLACEHOLDERS.sub('(...)', sql))
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.timings = defaultdict(float)
+        self.active = set()
+
+    def repeated_queries(self):
+        threshold = settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+
+_current = ContextVar('request_metrics', default=None)
+
+
+@contextmanager
+def timer(name):
+    """Add the time spent in the block to the current request's `name` timing; nested blocks count once"""
+    metrics = _current.get()
+    if metrics is None or name in metrics.active:
+        yield
+        return
+    metrics.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] += time.perf_counter() - started
+        metrics.active.discard(name)
+
+
+class TimedRepresentationMixin:
+    """Serializer mixin timing to_representation as the request's 'serialize' timing"""
+
+    def to_representation(self, instance):
+        with timer('serialize'):
+            return super().to_representation(instance)
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+        metrics.shapes[sql_shape(sql)] += 1
+
+
+def _install(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+# Every connection, in whichever thread it is opened, reports to the request that is current there
+connection_created.connect(_install)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Per-endpoint request histograms and counters, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+            self.db_durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+            self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+            self.responses = Counter()
+            self.n_plus_one = Counter()
+
+    def observe(self, endpoint, method, status, duration, metrics, n_plus_one):
+        key = (endpoint, method)
+        with self.lock:
+            self.durations[key].observe(duration)
+            self.db_durations[key].observe(metrics.db_time)
+            self.queries[key].observe(metrics.queries)
+            self.responses[(endpoint, method, str(status))] += 1
+            if n_plus_one:
+                self.n_plus_one[key] += 1
+
+    def _histogram(self, name, help_text, histograms):
+        lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (endpoint, method), histogram in sorted(histograms.items()):
+            labels = f'endpoint="{endpoint}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+        return lines
+
+    def render(self):
+        with self.lock:
+            lines = [
+                *self._histogram(
+                    'http_request_duration_seconds', 'Time to produce the response.', self.durations,
+                ),
+                *self._histogram(
+                    'http_request_db_duration_seconds', 'Time spent in SQL queries per request.', self.db_durations,
+                ),
+                *self._histogram('http_request_db_queries', 'SQL queries per request.', self.queries),
+                '# HELP http_responses_total Responses by status code.',
+                '# TYPE http_responses_total counter',
+                *(
+                    f'http_responses_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}'
+                    for (endpoint, method, status), count in sorted(self.responses.items())
+                ),
+                '# HELP http_request_n_plus_one_total Requests that repeated one SQL shape past the N+1 threshold.',
+                '# TYPE http_request_n_plus_one_total counter',
+                *(
+                    f'http_request_n_plus_one_total{{endpoint="{endpoint}",method="{method}"}} {count}'
+                    for (endpoint, method), count in sorted(self.n_plus_one.items())
+                ),
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _server_timing(metrics, duration):
+    entries = [f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"']
+    entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in sorted(metrics.timings.items())]
+    entries.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class InstrumentationMiddleware:
+    """
+    Measure each request and report it (see the module docstring). Queries run while a
+    streaming response is consumed, after the view returned, are not included.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.report(request, response, metrics)
+        return response
+
+    def report(self, request, response, metrics):
+        duration = time.perf_counter() - metrics.started
+        match = request.resolver_match
+        # Route names, not paths, keep the metric labels few
+        endpoint = match.view_name if match else 'unmatched'
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = _server_timing(metrics, duration)
+        repeated = metrics.repeated_queries()
+        registry.observe(endpoint, request.method, response.status_code, duration, metrics, bool(repeated))
+
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'queries': metrics.queries,
+            'db_ms': round(metrics.db_time * 1000, 2),
+            **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in sorted(metrics.timings.items())},
+        }
+        if repeated:
+            line['n_plus_one'] = [{'sql': shape[:500], 'count': count} for shape, count in repeated]
+            logger.warning(json.dumps(line))
+        else:
+            logger.info(json.dumps(line))
+
+
+def metrics_view(request):
+    """
+    The process's request metrics for Prometheus. Scrapers send METRICS_TOKEN as a
+    bearer token; without one set the endpoint is only open with DEBUG on.
+    """
+    if settings.METRICS_TOKEN:
+        header = request.headers.get('Authorization', '')
+        if not constant_time_compare(header, f'Bearer {settings.METRICS_TOKEN}'):
+            return JsonResponse({'error': 'A valid metrics token is required'}, status=401)
+    elif not settings.DEBUG:
+        return JsonResponse({'error': 'Metrics are disabled until METRICS_TOKEN is set'}, status=403)
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,185 @@
+"""
+Read replica routing.
+
+ReplicaRouter sends the reads of GET/HEAD/OPTIONS requests to one of the replicas in
+DATABASE_REPLICA_ALIASES; everything else, and all writes, use the primary. To keep
+read-your-writes, a request's reads move to the primary once it wrote, and a user who
+wrote is pinned to the primary for DATABASE_REPLICA_PIN_SECONDS, longer than the
+replication lag. A replica that cannot be connected to is skipped for
+DATABASE_REPLICA_RETRY_SECONDS and its reads go to the primary.
+"""
+import asyncio
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils.connection import ConnectionDoesNotExist
+from django.utils.functional import LazyObject
+
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Alias -> time.monotonic() until which the replica is skipped
+_down_until = {}
+
+
+def pin_cache_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+def _cache():
+    return caches[settings.DATABASE_REPLICA_PIN_CACHE_ALIAS]
+
+
+def pin_to_primary(user_id):
+    """Route the user's reads to the primary for DATABASE_REPLICA_PIN_SECONDS"""
+    _cache().set(pin_cache_key(user_id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await _cache().aset(pin_cache_key(user_id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _is_primary(connection):
+    # Test mirrors (TEST MIRROR) point at the primary's test database, where another
+    # connection would not see a test's uncommitted rows
+    primary = connections[DEFAULT_DB_ALIAS].settings_dict
+    return all(connection.settings_dict.get(key) == primary.get(key) for key in ('ENGINE', 'NAME', 'HOST', 'PORT'))
+
+
+def _available(alias):
+    if _down_until.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connection = connections[alias]
+        if _is_primary(connection):
+            return False
+        if _in_event_loop():
+            # Connections cannot be opened here; the thread running the query will
+            return True
+        # A no-op on an open connection
+        connection.ensure_connection()
+    except (ConnectionDoesNotExist, DatabaseError) as e:
+        _down_until[alias] = time.monotonic() + settings.DATABASE_REPLICA_RETRY_SECONDS
+        logger.warning("Replica %s is unavailable, reading from the primary: %s", alias, e)
+        return False
+    return True
+
+
+class RequestRouting:
+    def __init__(self, request):
+        self.request = request
+        self.wrote = False
+        self.pinned = None
+        self.replica = None
+
+    def user_id(self):
+        # Only a user authentication already set; resolving the session's lazy user would query
+        user = vars(self.request).get('user')
+        if user is None or isinstance(user, LazyObject) or not user.is_authenticated:
+            return None
+        return user.pk
+
+    def read_alias(self):
+        if self.wrote or self.request.method not in SAFE_METHODS:
+            return DEFAULT_DB_ALIAS
+        if self.pinned is None:
+            user_id = self.user_id()
+            # Until authentication ran it is unknown; its own lookups use the primary (see user.auth)
+            if user_id is None:
+                return self._replica()
+            self.pinned = bool(_cache().get(pin_cache_key(user_id)))
+        return DEFAULT_DB_ALIAS if self.pinned else self._replica()
+
+    def _replica(self):
+        # One replica per request, so its reads see one consistent snapshot
+        if self.replica is None or not _available(self.replica):
+            available = [alias for alias in settings.DATABASE_REPLICA_ALIASES if _available(alias)]
+            self.replica = random.choice(available) if available else None
+        return self.replica or DEFAULT_DB_ALIAS
+
+
+_current = ContextVar('request_routing', default=None)
+
+
+class ReplicaRouter:
+    """Database router for the primary and its read replicas, see the module docstring"""
+
+    def db_for_read(self, model, **hints):
+        routing = _current.get()
+        if routing is None or not settings.DATABASE_REPLICA_ALIASES:
+            return DEFAULT_DB_ALIAS
+        return routing.read_alias()
+
+    def db_for_write(self, model, **hints):
+        routing = _current.get()
+        if routing is not None:
+            routing.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db not in settings.DATABASE_REPLICA_ALIASES
+
+
+class ReplicaMiddleware:
+    """Gives the router the current request, and pins users who wrote to the primary"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        routing = RequestRouting(request)
+        token = _current.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        user_id = self.writer(routing)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        routing = RequestRouting(request)
+        token = _current.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        user_id = self.writer(routing)
+        if user_id is not None:
+            await apin_to_primary(user_id)
+        return response
+
+    def writer(self, routing):
+        """The user to pin after the request, when it may have written"""
+        if settings.DATABASE_REPLICA_ALIASES and (routing.wrote or routing.request.method not in SAFE_METHODS):
+            return routing.user_id()
+        return None
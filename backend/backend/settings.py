@@ -71,7 +71,7 @@ ACCOUNT_EMAIL_VERIFICATION = None
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.auth.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -125,6 +125,9 @@ EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
 DEFAULT_FROM_EMAIL = "no-reply@example.com"
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    'backend.instrumentation.InstrumentationMiddleware',
+    'backend.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -170,6 +173,115 @@ DATABASES = {
     }
 }
 
+# Read replicas of the primary, comma-separated: hosts for PostgreSQL, database files for
+# SQLite (copy the primary to stand in for one locally: sqlite3 project_db '.backup replica_db').
+# Reads of GET/HEAD/OPTIONS requests go to them, see backend.replicas.
+DATABASE_REPLICA_ALIASES = []
+for n, replica in enumerate(filter(None, os.getenv('DATABASE_REPLICAS', '').split(',')), start=1):
+    location = 'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+    DATABASES[f'replica{n}'] = {**DATABASES['default'], location: replica.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICA_ALIASES.append(f'replica{n}')
+DATABASE_ROUTERS = ['backend.replicas.ReplicaRouter']
+# Seconds a user's reads stay on the primary after a write, longer than the replication lag.
+# Pins are kept in this cache, which must be shared (REDIS_URL) by more than one process.
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DATABASE_REPLICA_PIN_SECONDS', '5'))
+DATABASE_REPLICA_PIN_CACHE_ALIAS = 'default'
+# Seconds an unreachable replica is skipped before it is tried again
+DATABASE_REPLICA_RETRY_SECONDS = 30
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+if os.getenv('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+
+# Live invoice feed (billing.consumers). The in-memory layer only reaches sockets in
+# the same process; set REDIS_URL when running more than one server process.
+CHANNEL_LAYERS = {
+    'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+}
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS['default'] = {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [os.getenv('REDIS_URL')]},
+    }
+# Seconds a feed socket collects changes before notifying, so a burst of edits is one refetch
+INVOICE_FEED_COALESCE = 0.5
+
+# Serialized invoice payloads, keyed by invoice id and updated_at
+BILLING_CACHE_ALIAS = 'default'
+BILLING_CACHE_TIMEOUT = 60 * 60
+
+# Uploaded files (avatars)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', str(BASE_DIR / 'media'))
+# Prefix for absolute media URLs handed to the frontend
+WEBSITE_URL = os.getenv('WEBSITE_URL', 'http://localhost:8000')
+
+# Avatars are validated in the request, then resized and stripped of metadata by
+# background threads (user.avatars); 0 workers processes them inline
+AVATAR_WORKERS = int(os.getenv('AVATAR_WORKERS', '2'))
+AVATAR_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+AVATAR_MAX_PIXELS = 40_000_000
+AVATAR_MAX_DIMENSION = 512
+AVATAR_THUMBNAIL_SIZES = (64, 128, 256)
+# Seconds after which an upload still marked pending counts as lost (its worker died)
+AVATAR_PENDING_TIMEOUT = 10 * 60
+
+# Slim users behind access tokens (user.auth.get_principal). Writes through the ORM
+# invalidate them; with the local-memory cache other processes may lag by the timeout.
+AUTH_PRINCIPAL_CACHE_ALIAS = 'default'
+AUTH_PRINCIPAL_CACHE_TIMEOUT = 60
+
+# Serve invoice detail, invoice audit log and user detail from the async views;
+# only pays off under ASGI (daphne), under WSGI each request gets its own event loop
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'true').lower() == 'true'
+
+
+# Numbers for invoices created without one. invoice_number is unique across companies,
+# so the format must include {company} or otherwise keep sequences apart. A block size
+# above 1 reserves numbers per process in blocks, trading gaps for no shared hot row.
+INVOICE_NUMBER_FORMAT = os.getenv('INVOICE_NUMBER_FORMAT', 'INV-{company}-{year}-{seq:06}')
+INVOICE_NUMBER_BLOCK_SIZE = int(os.getenv('INVOICE_NUMBER_BLOCK_SIZE', '1'))
+
+
+# Rendered invoice PDFs/HTML, stored by a hash of their content
+INVOICE_RENDER_DIR = os.getenv('INVOICE_RENDER_DIR', str(BASE_DIR / 'var' / 'renders'))
+# Render worker processes; 0 renders inline in the request
+INVOICE_RENDER_WORKERS = int(os.getenv('INVOICE_RENDER_WORKERS', '2'))
+# Seconds a request waits for a render before answering 202
+INVOICE_RENDER_WAIT = 5.0
+
+
+# Audit log events are spooled to disk and bulk inserted by a background thread
+AUDIT_LOG_ASYNC = os.getenv('AUDIT_LOG_ASYNC', 'true').lower() == 'true'
+AUDIT_LOG_BATCH_SIZE = 500
+AUDIT_LOG_FLUSH_INTERVAL = 1.0
+AUDIT_LOG_SPOOL_DIR = os.getenv('AUDIT_LOG_SPOOL_DIR', str(BASE_DIR / 'var' / 'audit-spool'))
+# Rows older than this are moved to InvoiceAuditLogArchive by archive_audit_log
+AUDIT_LOG_RETENTION_DAYS = 365
+
+# Per-request query counts and timings (backend.instrumentation): a Server-Timing header,
+# a log line per request on the `backend.requests` logger, and per-endpoint histograms
+# at /metrics/, which scrapers authenticate to with METRICS_TOKEN; unset, it is only
+# served with DEBUG on
+INSTRUMENTATION_SERVER_TIMING = os.getenv('INSTRUMENTATION_SERVER_TIMING', 'true').lower() == 'true'
+# One SQL shape run more often than this in a request is logged as an N+1
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = 10
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Seconds between in-process overdue sweeps; 0 leaves it to the mark_overdue command (cron)
+OVERDUE_SWEEP_INTERVAL = int(os.getenv('OVERDUE_SWEEP_INTERVAL', '0'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -0,0 +1,183 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from billing.models import Invoice, ReceivableRollup, RevenueRollup
+
+
+# Invoices that still count towards receivables
+OPEN_STATUSES = ('sent', 'partially_paid', 'overdue')
+
+# (name, fewest, most) days past due; 'current' is not yet due
+AGING_BUCKETS = [
+    ('current', None, -1),
+    ('0_30', 0, 30),
+    ('31_60', 31, 60),
+    ('61_90', 61, 90),
+    ('90_plus', 91, None),
+]
+
+REVENUE_GROUPS = ('period', 'company', 'status')
+
+AMOUNT_FIELDS = ('total_amount', 'amount_paid', 'balance_due')
+
+
+def _revenue_rows(invoices):
+    return (
+        invoices.annotate(period=TruncMonth('issue_date')).order_by()
+        .values('company_id', 'period', 'status')
+        .annotate(
+            invoice_count=Count('id'),
+            total_amount=Sum('total_amount'),
+            amount_paid=Sum('amount_paid'),
+            balance_due=Sum('balance_due'),
+        )
+    )
+
+
+def _receivable_rows(invoices):
+    return (
+        invoices.filter(status__in=OPEN_STATUSES).order_by()
+        .values('company_id', 'due_date')
+        .annotate(invoice_count=Count('id'), balance_due=Sum('balance_due'))
+    )
+
+
+def _add(deltas, key, sign, values):
+    current = deltas.get(key, (0,) * len(values))
+    deltas[key] = tuple(total + sign * value for total, value in zip(current, values))
+
+
+def refresh_rollups(before, after):
+    """
+    Apply a write to the rollup rows it touches.
+
+    `before` and `after` are Invoice.objects.rollup_rows() of the written invoices
+    before and after the write (empty for creates and deletes). The old values are
+    subtracted and the new ones added, and only the net difference reaches the rollup
+    rows, as UPDATE ... SET x = x + delta per changed row. Nothing is re-aggregated
+    and no company-wide lock is taken, so writers only meet on the rollup rows they
+    share; rebuild_rollups recomputes everything from scratch.
+    """
+    revenue, receivables = {}, {}
+    for sign, rows in ((-1, before), (1, after)):
+        for row in rows:
+            _add(revenue, (row['company_id'], row['issue_date'].replace(day=1), row['status']), sign,
+                 (1, row['total_amount'], row['amount_paid'], row['balance_due']))
+            if row['status'] in OPEN_STATUSES:
+                _add(receivables, (row['company_id'], row['due_date']), sign, (1, row['balance_due']))
+
+    with transaction.atomic():
+        _apply_deltas(RevenueRollup, ('company_id', 'period', 'status'), ('invoice_count',) + AMOUNT_FIELDS, revenue)
+        _apply_deltas(ReceivableRollup, ('company_id', 'due_date'), ('invoice_count', 'balance_due'), receivables)
+
+
+def _apply_deltas(model, key_fields, value_fields, deltas):
+    """Add each {key: values} delta to its rollup row, creating and deleting rows as invoices come and go"""
+    emptied = Q()
+    # Sorted, so concurrent writers lock shared rows in the same order
+    for key, values in sorted(deltas.items()):
+        if not any(values):
+            continue
+        lookup = dict(zip(key_fields, key))
+        changes = dict(zip(value_fields, values))
+        increments = {field: F(field) + delta for field, delta in changes.items() if delta}
+        if model.objects.filter(**lookup).update(**increments):
+            if changes['invoice_count'] < 0:
+                emptied |= Q(**lookup, invoice_count=0)
+            continue
+        if changes['invoice_count'] <= 0:
+            # Nothing to take from: the row went missing, which rebuild_rollups repairs
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(**lookup, **changes)
+        except IntegrityError:
+            # Another writer created the row meanwhile
+            model.objects.filter(**lookup).update(**increments)
+    if emptied:
+        model.objects.filter(emptied).delete()
+
+
+def compute_rollups():
+    """Rollup rows aggregated from scratch: (revenue rows, receivable rows)"""
+    return list(_revenue_rows(Invoice.objects.all())), list(_receivable_rows(Invoice.objects.all()))
+
+
+def rebuild_rollups(batch_size=1000):
+    """Replace every rollup row with a full aggregation, returning the row counts"""
+    with transaction.atomic():
+        revenue, receivables = compute_rollups()
+        RevenueRollup.objects.all().delete()
+        ReceivableRollup.objects.all().delete()
+        RevenueRollup.objects.bulk_create((RevenueRollup(**row) for row in revenue), batch_size=batch_size)
+        ReceivableRollup.objects.bulk_create((ReceivableRollup(**row) for row in receivables), batch_size=batch_size)
+    return len(revenue), len(receivables)
+
+
+
+def _money(value):
+    # Some backends drop trailing zeros from SUM over decimals
+    return Decimal(value).quantize(Decimal('0.01'))
+
+
+def revenue_report(rollups, group_by):
+    """Sum revenue rollup rows per `group_by` fields (see REVENUE_GROUPS)"""
+    fields = [{'company': 'company_id'}.get(field, field) for field in group_by]
+    if 'company' in group_by:
+        fields.append('company__name')
+    sums = {f'{field}_sum': Sum(field) for field in ('invoice_count',) + AMOUNT_FIELDS}
+    rows = rollups.values(*fields).annotate(**sums).order_by(*fields)
+    renames = {'company_id': 'company', 'company__name': 'company_name'}
+    results = []
+    for row in rows:
+        result = {renames.get(field, field): row[field] for field in fields}
+        result['invoice_count'] = row['invoice_count_sum']
+        result.update({field: _money(row[f'{field}_sum']) for field in AMOUNT_FIELDS})
+        results.append(result)
+    return results
+
+
+def _aging_filter(as_of, fewest, most):
+    condition = Q()
+    if fewest is not None:
+        condition &= Q(due_date__lte=as_of - timedelta(days=fewest))
+    if most is not None:
+        condition &= Q(due_date__gte=as_of - timedelta(days=most))
+    return condition
+
+
+def receivables_report(rollups, as_of, by_company=False):
+    """Outstanding balance of open invoices, split into AGING_BUCKETS as of the given date"""
+    aggregates = {
+        'total_count': Coalesce(Sum('invoice_count'), 0),
+        'total_balance': Coalesce(Sum('balance_due'), Decimal('0.00')),
+    }
+    for name, fewest, most in AGING_BUCKETS:
+        condition = _aging_filter(as_of, fewest, most)
+        aggregates[f'{name}_count'] = Coalesce(Sum('invoice_count', filter=condition), 0)
+        aggregates[f'{name}_balance'] = Coalesce(Sum('balance_due', filter=condition), Decimal('0.00'))
+
+    if by_company:
+        rows = list(
+            rollups.values('company_id', 'company__name').annotate(**aggregates).order_by('company__name', 'company_id')
+        )
+    else:
+        rows = [rollups.aggregate(**aggregates)]
+
+    results = []
+    for row in rows:
+        result = {}
+        if by_company:
+            result = {'company': row['company_id'], 'company_name': row['company__name']}
+        result['invoice_count'] = row['total_count']
+        result['balance_due'] = _money(row['total_balance'])
+        result['aging'] = {
+            name: {'invoice_count': row[f'{name}_count'], 'balance_due': _money(row[f'{name}_balance'])}
+            for name, _, _ in AGING_BUCKETS
+        }
+        results.append(result)
+    return results
@@ -1,30 +1,263 @@
-from django.http import JsonResponse
+import codecs
+from concurrent.futures import TimeoutError as RenderTimeout
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.shortcuts import get_object_or_404
-from decimal import Decimal
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.db import IntegrityError, transaction
+from django.views.decorators.http import require_GET
+
+from billing.analytics import REVENUE_GROUPS, receivables_report, revenue_report
+from billing.audit import (
+    aaudit_history, audit_current_values, audit_event, audit_history, flush_audit_events, reconstruct_values,
+    record_audit_events,
+)
+from billing.cache import (
+    acached_invoice_response, cached_invoice_response, if_match_satisfied, invoice_etag, invoice_version,
+    precondition_failed,
+)
+from billing.export import EXPORT_FORMATS, export_queryset, iter_export
+from billing.filters import (
+    ARCHIVE_ORDERING, AUDIT_LOG_ORDERING, filter_audit_logs, filter_invoices, filter_receivable_rollups,
+    filter_revenue_rollups, invoice_ordering, parse_as_of, parse_audit_log_filters, parse_revenue_group_by,
+)
+from billing.importer import IMPORT_FORMATS, import_invoices, read_records
+from billing.items import sync_invoice_items
+from billing.models import (
+    Invoice, InvoiceAuditLog, InvoiceAuditLogArchive, Payment, ReceivableRollup, RevenueRollup,
+)
+from billing.numbering import allocate_invoice_numbers
+from billing.pagination import (
+    apaginate_keyset, decode_offset_cursor, encode_offset_cursor, paginate_keyset, parse_limit,
+)
+from billing.reconciliation import read_statement, reconcile_statement, settle_invoices
+from billing.rendering import RENDER_FORMATS, render_context, render_digest, rendered_path, submit_render
+from billing.search import search_invoices, search_terms
+from billing.serializers import (
+    InvoiceSerializer, InvoiceListSerializer, InvoiceAuditLogSerializer, InvoiceCreateSerializer, InvoiceUpdateSerializer,
+    PaymentSerializer,
+)
+from user.auth import CachedJWTAuthentication, async_api_view
+
+
+@api_view(['GET', 'POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def invoice_list(request):
+    """List invoices with filters and keyset (cursor) pagination, or create one"""
+    if request.method == 'POST':
+        return invoice_create(request)
+
+    include_items = request.GET.get('include') == 'items'
+    try:
+        ordering = invoice_ordering(request.GET)
+        limit = parse_limit(request.GET.get('limit'))
+        queryset = Invoice.objects.owned_by(request.user)
+        queryset = queryset.for_detail() if include_items else queryset.for_list()
+        queryset = filter_invoices(queryset, request.GET)
+        invoices, next_cursor = paginate_keyset(queryset, ordering, request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    serializer_class = InvoiceSerializer if include_items else InvoiceListSerializer
+    return JsonResponse({
+        'results': serializer_class(invoices, many=True).data,
+        'next_cursor': next_cursor,
+    })
+
+
+def invoice_create(request):
+    """Create a draft invoice, numbered from the company's sequence unless a number is given"""
+    serializer = InvoiceCreateSerializer(data=request.data, context={'owner': request.user})
+    if not serializer.is_valid():
+        return JsonResponse({'error': serializer.errors}, status=400)
+
+    data = serializer.validated_data
+    actor = request.user.name or request.user.email
+    try:
+        # The number is taken in the same transaction as the insert, so a failure returns it
+        with transaction.atomic():
+            invoice_number = data.get('invoice_number') or allocate_invoice_numbers(
+                data['company'].pk, issue_date=data.get('issue_date')
+            )[0]
+            invoice = serializer.save(invoice_number=invoice_number, created_by=request.user, owner=request.user)
+
+            item_events = []
+            if 'items' in request.data:
+                item_events = sync_invoice_items(invoice, request.data['items'])
+            events = [audit_event(invoice.pk, request.user, 'created', {}, f"Invoice created by {actor}")]
+            for action, item_changes in item_events:
+                events.append(audit_event(
+                    invoice.pk, request.user, action, item_changes,
+                    f"{dict(InvoiceAuditLog.ACTION_CHOICES)[action]} by {actor}"
+                ))
+            record_audit_events(events)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except IntegrityError:
+        return JsonResponse({'error': f'Invoice number {invoice_number} already exists'}, status=409)
+
+    invoice = Invoice.objects.for_detail().get(pk=invoice.pk)
+    response = JsonResponse(InvoiceSerializer(invoice).data, status=201)
+    response['ETag'] = invoice_etag(invoice.pk, invoice.updated_at)
+    return response
 
-from billing.models import Invoice, InvoiceItem, InvoiceAuditLog
-from billing.serializers import InvoiceSerializer, InvoiceAuditLogSerializer
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def invoice_export(request):
+    """Stream invoices with items and payment totals as CSV or NDJSON"""
+    export_format = request.GET.get('output', 'csv')
+    try:
+        queryset = filter_invoices(export_queryset(Invoice.objects.owned_by(request.user)), request.GET)
+        rows = iter_export(export_format, queryset)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = StreamingHttpResponse(rows, content_type=EXPORT_FORMATS[export_format])
+    response['Content-Disposition'] = f'attachment; filename="invoices.{export_format}"'
+    return response
+
+
+# Enough rows for an autocomplete dropdown
+SEARCH_PAGE_SIZE = 10
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def invoice_search(request):
+    """Ranked search over invoice numbers, companies, item descriptions and payment references"""
+    query = request.GET.get('q', '')
+    if not search_terms(query):
+        return JsonResponse({'error': 'q must contain a word to search for'}, status=400)
+    try:
+        limit = parse_limit(request.GET.get('limit'), default=SEARCH_PAGE_SIZE)
+        offset = decode_offset_cursor(request.GET.get('cursor'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    ids, corrected = search_invoices(request.user, query, limit + 1, offset)
+    invoices = Invoice.objects.owned_by(request.user).for_list().in_bulk(ids[:limit])
+    return JsonResponse({
+        'results': InvoiceListSerializer([invoices[pk] for pk in ids[:limit] if pk in invoices], many=True).data,
+        'next_cursor': encode_offset_cursor(offset + limit) if len(ids) > limit else None,
+        'corrected': corrected,
+    })
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def invoice_import(request):
+    """Bulk import invoices with items and payments from an uploaded CSV or NDJSON file"""
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'A file upload is required'}, status=400)
+
+    import_format = request.GET.get('input') or upload.name.rsplit('.', 1)[-1].lower()
+    if import_format not in IMPORT_FORMATS:
+        return JsonResponse({'error': f"input must be one of: {', '.join(IMPORT_FORMATS)}"}, status=400)
+
+    # Decode line by line so the upload is never held in memory as one string
+    records = read_records(import_format, codecs.iterdecode(upload, 'utf-8-sig'))
+    try:
+        result = import_invoices(records, user=request.user)
+    except UnicodeDecodeError:
+        return JsonResponse({'error': 'File must be UTF-8 encoded'}, status=400)
+    return JsonResponse(result.as_dict())
+
+
+@api_view(['POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def payment_reconcile(request):
+    """Match an uploaded bank statement CSV to invoices by reference and record the payments"""
+    upload = request.FILES.get('file')
+    if upload is None:
+        return JsonResponse({'error': 'A file upload is required'}, status=400)
+
+    lines = read_statement(codecs.iterdecode(upload, 'utf-8-sig'))
+    try:
+        result = reconcile_statement(lines, user=request.user)
+    except UnicodeDecodeError:
+        return JsonResponse({'error': 'File must be UTF-8 encoded'}, status=400)
+    return JsonResponse(result.as_dict())
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def revenue_analytics(request):
+    """Invoice amounts grouped by issue month, company and/or status, read from the revenue rollup"""
+    try:
+        group_by = parse_revenue_group_by(request.GET, REVENUE_GROUPS)
+        rollups = filter_revenue_rollups(RevenueRollup.objects.filter(company__owner=request.user), request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({'results': revenue_report(rollups, group_by)})
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def receivables_analytics(request):
+    """Outstanding balances in aging buckets, overall or per company, read from the receivables rollup"""
+    try:
+        as_of = parse_as_of(request.GET)
+        rollups = filter_receivable_rollups(ReceivableRollup.objects.filter(company__owner=request.user), request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    by_company = request.GET.get('group_by') == 'company'
+    return JsonResponse({'as_of': as_of, 'results': receivables_report(rollups, as_of, by_company)})
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def invoice_detail(request, invoice_id):
     """Get invoice details"""
-    invoice = get_object_or_404(Invoice, id=invoice_id)
-    serializer = InvoiceSerializer(invoice)
-    return JsonResponse(serializer.data, safe=False)
+    def build():
+        invoice = get_object_or_404(Invoice.objects.owned_by(request.user).for_detail(), id=invoice_id)
+        return InvoiceSerializer(invoice).data
+
+    return cached_invoice_response(request, 'detail', invoice_id, build)
 
 
-@api_view(['PUT'])
-@authentication_classes([JWTAuthentication])
+@require_GET
+@async_api_view()
+async def invoice_detail_async(request, invoice_id):
+    """invoice_detail on the async ORM, so a waiting request does not hold a worker thread"""
+    async def build():
+        invoice = await aget_object_or_404(Invoice.objects.owned_by(request.user).for_detail(), id=invoice_id)
+        return InvoiceSerializer(invoice).data
+
+    return await acached_invoice_response(request, 'detail', invoice_id, build)
+
+
+@api_view(['PUT', 'PATCH'])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def invoice_update(request, invoice_id):
-    """Update invoice - only allowed for draft status"""
-    invoice = get_object_or_404(Invoice, id=invoice_id)
+    """
+    Update invoice - only allowed for draft status.
+
+    Both methods are partial: only supplied fields are validated and applied, and
+    only the ones that differ are written. A request that changes nothing writes
+    nothing, so updated_at, the ETag and cached payloads stay as they were.
+    """
+    # Reject stale writes on a one-column lookup, before loading anything else
+    if 'HTTP_IF_MATCH' in request.META:
+        version = invoice_version(invoice_id, request.user)
+        if not if_match_satisfied(request, invoice_id, version):
+            return precondition_failed(invoice_id, version)
+    
+    invoice = get_object_or_404(Invoice.objects.owned_by(request.user), id=invoice_id)
     
     # Check if invoice can be edited
     if not invoice.can_edit():
@@ -32,91 +265,210 @@ def invoice_update(request, invoice_id):
             'error': 'Only draft invoices can be edited'
         }, status=403)
     
-    # Store old values for audit log
-    old_values = {
-        'invoice_number': invoice.invoice_number,
-        'issue_date': str(invoice.issue_date),
-        'due_date': str(invoice.due_date),
-        'status': invoice.status,
-    }
+    serializer = InvoiceUpdateSerializer(invoice, data=request.data, partial=True)
+    if not serializer.is_valid():
+        return JsonResponse({'error': serializer.errors}, status=400)
     
     # Track changes
-    changes = {}
-    
-    # Update invoice fields
-    if 'invoice_number' in request.data and request.data['invoice_number'] != invoice.invoice_number:
-        changes['invoice_number'] = {
-            'old': invoice.invoice_number,
-            'new': request.data['invoice_number']
-        }
-        invoice.invoice_number = request.data['invoice_number']
-    
-    if 'issue_date' in request.data and request.data['issue_date'] != str(invoice.issue_date):
-        changes['issue_date'] = {
-            'old': str(invoice.issue_date),
-            'new': request.data['issue_date']
-        }
-        invoice.issue_date = request.data['issue_date']
-    
-    if 'due_date' in request.data and request.data['due_date'] != str(invoice.due_date):
-        changes['due_date'] = {
-            'old': str(invoice.due_date),
-            'new': request.data['due_date']
-        }
-        invoice.due_date = request.data['due_date']
-    
-    invoice.save()
-    
-    # Update invoice items if provided
-    if 'items' in request.data:
-        # Store old items for audit
-        old_items = list(invoice.items.values('id', 'description', 'quantity', 'unit_price'))
-        
-        # Clear existing items and create new ones
-        invoice.items.all().delete()
-        
-        for item_data in request.data['items']:
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                description=item_data['description'],
-                quantity=item_data['quantity'],
-                unit_price=Decimal(str(item_data['unit_price']))
-            )
-        
-        changes['items'] = {
-            'old': old_items,
-            'new': list(request.data['items'])
-        }
-    
-    # Create audit log entry
-    new_values = {
-        'invoice_number': invoice.invoice_number,
-        'issue_date': str(invoice.issue_date),
-        'due_date': str(invoice.due_date),
-        'status': invoice.status,
+    changes = {
+        field: {'old': str(getattr(invoice, field)), 'new': str(value)}
+        for field, value in serializer.validated_data.items()
+        if getattr(invoice, field) != value
     }
     
-    if changes:
-        InvoiceAuditLog.objects.create(
-            invoice=invoice,
-            user=request.user,
-            action='updated',
-            old_values=old_values,
-            new_values=new_values,
-            changes=changes,
-            description=f"Invoice updated by {request.user.name or request.user.email}"
-        )
+    if changes or 'items' in request.data:
+        actor = request.user.name or request.user.email
+        try:
+            # Fields and items land together or not at all; audit events are spooled only on commit
+            with transaction.atomic():
+                # Re-check under a row lock so a concurrent save between load and write still loses
+                version = Invoice.objects.select_for_update().filter(pk=invoice.pk).values_list('updated_at', flat=True).get()
+                if not if_match_satisfied(request, invoice_id, version):
+                    return precondition_failed(invoice_id, version)
+                
+                if changes:
+                    for field in changes:
+                        setattr(invoice, field, serializer.validated_data[field])
+                    invoice.save(update_fields=[*changes, 'updated_at'])
+                
+                # Update invoice items if provided
+                item_events = []
+                if 'items' in request.data:
+                    item_events = sync_invoice_items(invoice, request.data['items'])
+                
+                # Only the diff is kept; full before/after views are rebuilt on read
+                events = []
+                if changes:
+                    events.append(audit_event(invoice.pk, request.user, 'updated', changes, f"Invoice updated by {actor}"))
+                for action, item_changes in item_events:
+                    events.append(audit_event(
+                        invoice.pk, request.user, action, item_changes,
+                        f"{dict(InvoiceAuditLog.ACTION_CHOICES)[action]} by {actor}"
+                    ))
+                record_audit_events(events)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
     
+    invoice = Invoice.objects.for_detail().get(pk=invoice.pk)
     serializer = InvoiceSerializer(invoice)
-    return JsonResponse(serializer.data, safe=False)
+    response = JsonResponse(serializer.data, safe=False)
+    response['ETag'] = invoice_etag(invoice.pk, invoice.updated_at)
+    return response
 
 
 @api_view(['GET'])
-@authentication_classes([JWTAuthentication])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def invoice_audit_log(request, invoice_id):
-    """Get audit log for an invoice"""
-    invoice = get_object_or_404(Invoice, id=invoice_id)
-    logs = invoice.audit_logs.all()
-    serializer = InvoiceAuditLogSerializer(logs, many=True)
-    return JsonResponse(serializer.data, safe=False)
+    """Get audit log for an invoice, newest first with cursor pagination"""
+    if request.GET.get('archived') == 'true':
+        return invoice_archived_audit_log(request, invoice_id)
+
+    def build():
+        flush_audit_events(own_only=True)
+        invoice = get_object_or_404(Invoice.objects.owned_by(request.user), id=invoice_id)
+        logs, next_cursor = paginate_keyset(
+            _audit_log_queryset(invoice, request), AUDIT_LOG_ORDERING, request.GET.get('cursor'),
+            parse_limit(request.GET.get('limit')),
+        )
+        history = None if _first_audit_page(request) else audit_history(invoice, logs)
+        return _audit_log_payload(invoice, logs, history, next_cursor)
+
+    try:
+        return cached_invoice_response(
+            request, 'audit-log', invoice_id, build, variant=request.GET.urlencode()
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+@require_GET
+@async_api_view()
+async def invoice_audit_log_async(request, invoice_id):
+    """invoice_audit_log on the async ORM"""
+    if request.GET.get('archived') == 'true':
+        return await sync_to_async(invoice_archived_audit_log)(request, invoice_id)
+
+    async def build():
+        await sync_to_async(flush_audit_events)(own_only=True)
+        invoice = await aget_object_or_404(Invoice.objects.owned_by(request.user), id=invoice_id)
+        logs, next_cursor = await apaginate_keyset(
+            _audit_log_queryset(invoice, request), AUDIT_LOG_ORDERING, request.GET.get('cursor'),
+            parse_limit(request.GET.get('limit')),
+        )
+        history = None if _first_audit_page(request) else await aaudit_history(invoice, logs)
+        return _audit_log_payload(invoice, logs, history, next_cursor)
+
+    try:
+        return await acached_invoice_response(
+            request, 'audit-log', invoice_id, build, variant=request.GET.urlencode()
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+def _audit_log_queryset(invoice, request):
+    return filter_audit_logs(InvoiceAuditLog.objects.for_serializer().filter(invoice=invoice), request.GET)
+
+
+def _first_audit_page(request):
+    # The unfiltered first page already holds every change newer than its rows
+    return not any(request.GET.get(param) for param in ('cursor', 'action', 'user'))
+
+
+def _audit_log_payload(invoice, logs, history, next_cursor):
+    values = reconstruct_values(audit_current_values(invoice), logs, history)
+    return {
+        'results': InvoiceAuditLogSerializer(logs, many=True, context={'values': values}).data,
+        'next_cursor': next_cursor,
+    }
+
+
+def invoice_archived_audit_log(request, invoice_id):
+    """Audit rows past retention, read on demand from their compressed monthly chunks"""
+    invoice = get_object_or_404(Invoice.objects.owned_by(request.user), id=invoice_id)
+    try:
+        actions, user_id = parse_audit_log_filters(request.GET)
+        chunks, next_cursor = paginate_keyset(
+            InvoiceAuditLogArchive.objects.filter(invoice=invoice), ARCHIVE_ORDERING,
+            request.GET.get('cursor'), parse_limit(request.GET.get('limit'), default=3, maximum=24),
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    results = [
+        row for chunk in chunks for row in chunk.rows()
+        if (not actions or row['action'] in actions) and (not user_id or row['user_id'] == str(user_id))
+    ]
+    return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+
+@api_view(['GET', 'POST'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def invoice_payments(request, invoice_id):
+    """List an invoice's payments, or record a new one and settle the invoice"""
+    invoice = get_object_or_404(Invoice.objects.owned_by(request.user), id=invoice_id)
+
+    if request.method == 'GET':
+        payments = Payment.objects.filter(invoice=invoice).order_by('-paid_at', '-id')
+        return JsonResponse({'results': PaymentSerializer(payments, many=True).data})
+
+    if invoice.status in ('draft', 'cancelled'):
+        return JsonResponse({'error': f'Cannot record payments on a {invoice.status} invoice'}, status=400)
+
+    serializer = PaymentSerializer(data=request.data)
+    if not serializer.is_valid():
+        return JsonResponse({'error': serializer.errors}, status=400)
+
+    with transaction.atomic():
+        payment = serializer.save(invoice=invoice)
+        settle_invoices([invoice.pk], user=request.user)
+
+    invoice.refresh_from_db(fields=['status', 'amount_paid', 'balance_due', 'updated_at'])
+    response = JsonResponse({
+        'payment': PaymentSerializer(payment).data,
+        'status': invoice.status,
+        'amount_paid': str(invoice.amount_paid),
+        'balance_due': str(invoice.balance_due),
+    }, status=201)
+    response['ETag'] = invoice_etag(invoice.pk, invoice.updated_at)
+    return response
+
+
+@api_view(['GET'])
+@authentication_classes([CachedJWTAuthentication])
+@permission_classes([IsAuthenticated])
+def invoice_document(request, invoice_id):
+    """The invoice as PDF or HTML, rendered once per distinct content by the render workers"""
+    output = request.GET.get('output', 'pdf')
+    if output not in RENDER_FORMATS:
+        return JsonResponse({'error': f"output must be one of: {', '.join(RENDER_FORMATS)}"}, status=400)
+
+    invoice = get_object_or_404(
+        Invoice.objects.owned_by(request.user).for_detail().select_related('created_by'), id=invoice_id
+    )
+    context = render_context(invoice)
+    digest = render_digest(context)
+    etag = f'"{digest}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
+
+    path = rendered_path(digest, output)
+    if not path.exists():
+        try:
+            submit_render(context, output).result(timeout=settings.INVOICE_RENDER_WAIT)
+        except RenderTimeout:
+            response = JsonResponse({'status': 'rendering'}, status=202)
+            response['Retry-After'] = '1'
+            return response
+
+    response = FileResponse(
+        open(path, 'rb'), content_type=RENDER_FORMATS[output],
+        as_attachment=request.GET.get('download') == 'true', filename=f'{invoice.invoice_number}.{output}',
+    )
+    response['ETag'] = etag
+    # Private, and revalidated every time: the same URL serves new content after an edit
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
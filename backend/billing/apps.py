@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class BillingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'billing'
+
+    def ready(self):
+        if settings.OVERDUE_SWEEP_INTERVAL:
+            from billing.overdue import OverdueScheduler
+            OverdueScheduler(settings.OVERDUE_SWEEP_INTERVAL).start()
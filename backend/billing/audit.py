@@ -0,0 +1,380 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import uuid
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from billing.feed import publish_audit_events
+from billing.models import Invoice, InvoiceAuditLog, InvoiceAuditLogArchive
+
+
+logger = logging.getLogger(__name__)
+
+# Invoice fields whose history can be rebuilt from `changes` diffs, and the actions that change them
+TRACKED_FIELDS = ('invoice_number', 'issue_date', 'due_date', 'status')
+TRACKED_ACTIONS = ('created', 'updated', 'status_changed')
+
+
+def audit_event(invoice_id, user, action, changes, description=''):
+    """Build an audit event for record_audit_events, stamped with the time of the change"""
+    return {
+        'event_id': str(uuid.uuid4()),
+        'invoice_id': invoice_id,
+        'user_id': str(user.pk) if user is not None else None,
+        'action': action,
+        'changes': changes,
+        'description': description,
+        'timestamp': timezone.now(),
+    }
+
+
+def _to_log(event):
+    timestamp = event['timestamp']
+    if isinstance(timestamp, str):
+        timestamp = parse_datetime(timestamp)
+    return InvoiceAuditLog(
+        event_id=event['event_id'],
+        invoice_id=event['invoice_id'],
+        user_id=event['user_id'],
+        action=event['action'],
+        changes=event['changes'],
+        description=event['description'],
+        timestamp=timestamp,
+    )
+
+
+def write_audit_events(events):
+    """Insert events now; replays are no-ops thanks to the unique event_id"""
+    invoice_ids = {event['invoice_id'] for event in events}
+    # Only the primary can tell a deleted invoice from one a lagging replica has yet to see
+    existing = set(Invoice.objects.using(DEFAULT_DB_ALIAS).filter(pk__in=invoice_ids).values_list('pk', flat=True))
+    logs = [_to_log(event) for event in events if event['invoice_id'] in existing]
+    InvoiceAuditLog.objects.bulk_create(logs, batch_size=settings.AUDIT_LOG_BATCH_SIZE, ignore_conflicts=True)
+    # Only now can subscribers that refetch the audit log see the rows
+    publish_audit_events([event for event in events if event['invoice_id'] in existing])
+    return len(logs)
+
+
+def record_audit_events(events):
+    """
+    Record audit events for the current transaction.
+
+    With AUDIT_LOG_ASYNC the events are spooled once the transaction commits and
+    inserted in batches by a background thread, so the request never waits on the
+    insert; otherwise they are written immediately.
+    """
+    if not events:
+        return
+    if not settings.AUDIT_LOG_ASYNC:
+        write_audit_events(events)
+        return
+    transaction.on_commit(lambda: get_writer().submit(events))
+
+
+class AuditLogWriter:
+    """
+    Per-process audit buffer backed by an append-only spool on disk.
+
+    Events are appended to a segment file as they arrive, so a crash loses nothing:
+    segments left behind by dead processes are picked up by the next flush in any
+    process, or by the flush_audit_log command. A background thread rotates the
+    current segment every AUDIT_LOG_FLUSH_INTERVAL seconds (or sooner once
+    AUDIT_LOG_BATCH_SIZE events are waiting) and bulk inserts it.
+    """
+
+    def __init__(self, spool_dir, batch_size, flush_interval, autostart=True):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.autostart = autostart
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._segment = None
+        self._segment_path = None
+        self._pending = 0
+        self._thread = None
+
+    def submit(self, events):
+        lines = ''.join(json.dumps(event, cls=DjangoJSONEncoder) + '\n' for event in events)
+        with self._lock:
+            if self._segment is None:
+                self.spool_dir.mkdir(parents=True, exist_ok=True)
+                self._segment_path = self.spool_dir / f'{os.getpid()}-{uuid.uuid4().hex}.log'
+                self._segment = open(self._segment_path, 'a')
+            self._segment.write(lines)
+            self._segment.flush()
+            self._pending += len(events)
+            if self._thread is None and self.autostart:
+                self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+                self._thread.start()
+            if self._pending >= self.batch_size:
+                self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # The segment stays on disk and is retried on the next flush
+                logger.exception("Audit log flush failed")
+            finally:
+                close_old_connections()
+
+    def _rotate(self):
+        with self._lock:
+            if self._segment is None:
+                return
+            self._segment.close()
+            os.rename(self._segment_path, self._segment_path.with_suffix('.ready'))
+            self._segment = self._segment_path = None
+            self._pending = 0
+
+    def flush(self, own_only=False):
+        """
+        Close the current segment and ingest every segment that is ready or orphaned,
+        or with `own_only` just this process's.
+        """
+        with self._flush_lock:
+            self._rotate()
+            return ingest_spool(self.spool_dir, pid=os.getpid() if own_only else None)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _claimable(path):
+    """Segments are ready, or still being written/ingested by a process that died"""
+    stem, _, state = path.name.partition('.')
+    try:
+        if state == 'ready':
+            return True
+        if state == 'log':
+            return not _pid_alive(int(stem.split('-', 1)[0]))
+        if state.startswith('ingesting-'):
+            return not _pid_alive(int(state.split('-', 1)[1]))
+    except ValueError:
+        pass
+    return False
+
+
+def _read_segment(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # A torn final line from a crash mid-write
+                logger.warning("Skipping unreadable audit event in %s", path)
+    return events
+
+
+def ingest_spool(spool_dir, pid=None):
+    """
+    Claim and insert every ingestible segment in the spool, or only those written by
+    process `pid`, returning the row count
+    """
+    spool_dir = Path(spool_dir)
+    if not spool_dir.exists():
+        return 0
+    inserted = 0
+    for path in sorted(spool_dir.iterdir()):
+        if pid is not None and not path.name.startswith(f'{pid}-'):
+            continue
+        if not _claimable(path):
+            continue
+        claimed = path.with_name(f"{path.name.partition('.')[0]}.ingesting-{os.getpid()}")
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue  # Another process got there first
+        try:
+            events = _read_segment(claimed)
+            for start in range(0, len(events), settings.AUDIT_LOG_BATCH_SIZE):
+                inserted += write_audit_events(events[start:start + settings.AUDIT_LOG_BATCH_SIZE])
+        except Exception:
+            # Hand the segment back so the next flush retries it
+            os.rename(claimed, claimed.with_name(f"{claimed.name.partition('.')[0]}.ready"))
+            raise
+        os.remove(claimed)
+    return inserted
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.spool_dir != Path(settings.AUDIT_LOG_SPOOL_DIR):
+            _writer = AuditLogWriter(
+                settings.AUDIT_LOG_SPOOL_DIR, settings.AUDIT_LOG_BATCH_SIZE, settings.AUDIT_LOG_FLUSH_INTERVAL,
+            )
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def flush_audit_events(own_only=False):
+    """
+    Insert the audit events still waiting in the spool.
+
+    reconstruct_values works back from an invoice's current values, which already
+    include changes whose events are spooled; reading the rows without them would
+    attribute those changes to the newest flushed rows. Events another live process
+    has yet to rotate out of its segment stay pending, for up to
+    AUDIT_LOG_FLUSH_INTERVAL. Requests pass `own_only`, so reading one invoice's
+    log does not ingest the whole shared spool; other processes' rotated segments
+    are left to their own writers.
+    """
+    if settings.AUDIT_LOG_ASYNC:
+        get_writer().flush(own_only=own_only)
+
+
+def audit_current_values(invoice):
+    """The invoice's TRACKED_FIELDS in the string form audit diffs use"""
+    return {field: str(getattr(invoice, field)) for field in TRACKED_FIELDS}
+
+
+def _history_queryset(invoice, logs):
+    oldest = logs[-1]
+    return (
+        InvoiceAuditLog.objects.filter(invoice=invoice, action__in=TRACKED_ACTIONS)
+        .filter(Q(timestamp__gt=oldest.timestamp) | Q(timestamp=oldest.timestamp, id__gte=oldest.id))
+        .values_list('id', 'timestamp', 'changes')
+    )
+
+
+def audit_history(invoice, logs):
+    """
+    (id, timestamp, changes) of every tracked-field change from the oldest of `logs`
+    up to now, which is what reconstruct_values needs to rebuild a filtered or later page.
+    """
+    if not logs:
+        return []
+    return list(_history_queryset(invoice, logs))
+
+
+async def aaudit_history(invoice, logs):
+    if not logs:
+        return []
+    return [row async for row in _history_queryset(invoice, logs)]
+
+
+def reconstruct_values(current, logs, history=None):
+    """
+    Rebuild full before/after values of TRACKED_FIELDS for each log.
+
+    `current` holds the invoice's present field values and `logs` are ordered newest
+    first. When `logs` is not the unfiltered newest page, `history` (see audit_history)
+    supplies the changes in between. Rows that stored full snapshots keep them.
+    Returns {log id: (old_values, new_values)}.
+    """
+    def revert(state, changes):
+        before = dict(state)
+        for field, change in (changes or {}).items():
+            if field in TRACKED_FIELDS and isinstance(change, dict) and 'old' in change:
+                before[field] = change['old']
+        return before
+
+    entries = {log.id: (log.timestamp, log.changes) for log in logs}
+    for log_id, timestamp, changes in history or ():
+        entries.setdefault(log_id, (timestamp, changes))
+
+    state = {field: current.get(field) for field in TRACKED_FIELDS}
+    rebuilt = {}
+    for log_id, (_, changes) in sorted(entries.items(), key=lambda entry: (entry[1][0], entry[0]), reverse=True):
+        before = revert(state, changes)
+        rebuilt[log_id] = (before, state)
+        state = before
+
+    return {
+        log.id: (log.old_values or rebuilt[log.id][0], log.new_values or rebuilt[log.id][1])
+        for log in logs
+    }
+
+
+def _archive_values(logs):
+    """reconstruct_values for a batch of rows across invoices: {log id: (old_values, new_values)}"""
+    by_invoice = {}
+    for log in logs:
+        by_invoice.setdefault(log.invoice_id, []).append(log)
+    invoices = Invoice.objects.filter(pk__in=by_invoice).only(*TRACKED_FIELDS).in_bulk()
+    # Every live change from the batch's oldest row on, what each invoice's rows are rebuilt through
+    history = {}
+    for invoice_id, *row in (
+        InvoiceAuditLog.objects.filter(invoice_id__in=by_invoice, action__in=TRACKED_ACTIONS,
+                                       timestamp__gte=logs[0].timestamp)
+        .values_list('invoice_id', 'id', 'timestamp', 'changes')
+    ):
+        history.setdefault(invoice_id, []).append(row)
+
+    values = {}
+    for invoice_id, invoice_logs in by_invoice.items():
+        values.update(reconstruct_values(
+            audit_current_values(invoices[invoice_id]), invoice_logs[::-1], history.get(invoice_id),
+        ))
+    return values
+
+
+def archive_audit_logs(cutoff, batch_size=5000):
+    """
+    Move audit rows older than `cutoff` into InvoiceAuditLogArchive, oldest first.
+
+    Each batch is grouped into one compressed chunk per invoice and month and
+    swapped in for the live rows in its own transaction, so locks stay short and an
+    interrupted run can simply be restarted. Rows are archived with their full
+    before/after values, which cannot be rebuilt once they leave the live table.
+    Yields the number of rows per batch.
+    """
+    from billing.serializers import InvoiceAuditLogSerializer
+
+    flush_audit_events()
+    while True:
+        with transaction.atomic():
+            logs = list(
+                InvoiceAuditLog.objects.for_serializer().filter(timestamp__lt=cutoff)
+                .order_by('timestamp', 'id')[:batch_size]
+            )
+            if not logs:
+                return
+
+            chunks = {}
+            rows = InvoiceAuditLogSerializer(logs, many=True, context={'values': _archive_values(logs)}).data
+            for log, row in zip(logs, rows):
+                row = dict(row, user_id=str(log.user_id) if log.user_id else None)
+                period = log.timestamp.date().replace(day=1)
+                chunks.setdefault((log.invoice_id, period), []).append(row)
+
+            InvoiceAuditLogArchive.objects.bulk_create([
+                InvoiceAuditLogArchive(
+                    invoice_id=invoice_id,
+                    period=period,
+                    row_count=len(chunk),
+                    # Newest first, matching the live endpoint
+                    data=zlib.compress(json.dumps(chunk[::-1], cls=DjangoJSONEncoder).encode()),
+                )
+                for (invoice_id, period), chunk in chunks.items()
+            ])
+            InvoiceAuditLog.objects.filter(id__in=[log.id for log in logs]).delete()
+        yield len(logs)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+
+from billing.models import Invoice, InvoiceAuditLog
+
+
+def _cache():
+    return caches[settings.BILLING_CACHE_ALIAS]
+
+
+def _invoices(invoice_id, owner):
+    return Invoice.objects.owned_by(owner).filter(pk=invoice_id)
+
+
+def invoice_version(invoice_id, owner):
+    """
+    Return the owner's invoice's updated_at, which doubles as its cache version stamp.
+
+    Every write to an invoice, its items or payments moves updated_at (saves, and
+    refresh_totals/refresh_payments), so payloads cached under an older stamp are
+    never read again. Invoices of other tenants raise Http404 like missing ones, so
+    neither the cache nor a 304 reveals that they exist.
+    """
+    versions = list(_invoices(invoice_id, owner).values_list('updated_at', flat=True))
+    if not versions:
+        raise Http404("No Invoice matches the given query.")
+    return versions[0]
+
+
+def _audit_log_versions(invoice_id, owner):
+    logs = InvoiceAuditLog.objects.filter(invoice=OuterRef('pk'))
+    last_log = logs.order_by('-id').values('id')[:1]
+    # Archiving removes the oldest rows first
+    first_log = logs.order_by('timestamp', 'id').values('id')[:1]
+    return _invoices(invoice_id, owner).annotate(
+        last_log=Subquery(last_log), first_log=Subquery(first_log),
+    ).values_list('updated_at', 'last_log', 'first_log')
+
+
+def audit_log_version(invoice_id, owner):
+    """
+    Return (updated_at, id of the newest audit row, id of the oldest) in one query.
+
+    Audit rows are flushed in the background, so they cannot move updated_at without
+    breaking If-Match on edits; the newest row id versions the audit log instead, and
+    the oldest one notices rows moved to the archive.
+    """
+    versions = list(_audit_log_versions(invoice_id, owner))
+    if not versions:
+        raise Http404("No Invoice matches the given query.")
+    return versions[0]
+
+
+async def ainvoice_version(invoice_id, owner):
+    versions = [version async for version in _invoices(invoice_id, owner).values_list('updated_at', flat=True)]
+    if not versions:
+        raise Http404("No Invoice matches the given query.")
+    return versions[0]
+
+
+async def aaudit_log_version(invoice_id, owner):
+    versions = [versions async for versions in _audit_log_versions(invoice_id, owner)]
+    if not versions:
+        raise Http404("No Invoice matches the given query.")
+    return versions[0]
+
+
+def _stamp(version):
+    return f'{version.timestamp():.6f}' if version is not None else 'none'
+
+
+def invoice_etag(invoice_id, version):
+    """The detail ETag, which is also what If-Match on edits is compared against"""
+    return f'"detail-{invoice_id}-{_stamp(version)}"'
+
+
+def if_match_satisfied(request, invoice_id, version):
+    """Check an If-Match header against the invoice's detail ETag; no header always passes"""
+    header = request.META.get('HTTP_IF_MATCH')
+    if not header:
+        return True
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    return version is not None and invoice_etag(invoice_id, version) in etags
+
+
+def precondition_failed(invoice_id, version):
+    response = JsonResponse({
+        'error': 'Invoice has been modified since it was loaded'
+    }, status=412)
+    if version is not None:
+        response['ETag'] = invoice_etag(invoice_id, version)
+    return response
+
+
+def _payload_versioning(kind, invoice_id, versions, variant):
+    """(ETag, Last-Modified timestamp or None, cache key) for a payload at the given versions"""
+    if kind == 'audit-log':
+        version, last_log, first_log = versions
+        stamp = f'{_stamp(version)}-{last_log or 0}-{first_log or 0}'
+        # A newer audit row does not move updated_at, so only the ETag can validate
+        last_modified = None
+    else:
+        version = versions
+        stamp = _stamp(version)
+        last_modified = version.timestamp() if version is not None else None
+
+    etag = f'"{kind}-{invoice_id}-{stamp}"'
+    key = f'billing:invoice:{invoice_id}:{kind}:{stamp}'
+    if variant:
+        etag = f'"{kind}-{invoice_id}-{stamp}-{hashlib.md5(variant.encode()).hexdigest()[:12]}"'
+        key = f'{key}:{hashlib.md5(variant.encode()).hexdigest()}'
+    return etag, last_modified, key
+
+
+def _payload_response(content, etag, last_modified):
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def cached_invoice_response(request, kind, invoice_id, build, variant=''):
+    """
+    Serve a serialized invoice payload through the cache with ETag/Last-Modified.
+
+    `kind` is 'detail' or 'audit-log' and `variant` distinguishes payloads of the same
+    kind (e.g. pages). `build` returns the JSON-serializable payload and is only called
+    on a cache miss. A matching If-None-Match/If-Modified-Since short-circuits to 304
+    before any lookup. The version lookup is scoped to request.user's invoices.
+    """
+    if kind == 'audit-log':
+        versions = audit_log_version(invoice_id, request.user)
+    else:
+        versions = invoice_version(invoice_id, request.user)
+    etag, last_modified, key = _payload_versioning(kind, invoice_id, versions, variant)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    cache = _cache()
+    content = cache.get(key)
+    if content is None:
+        content = json.dumps(build(), cls=DjangoJSONEncoder).encode()
+        cache.set(key, content, settings.BILLING_CACHE_TIMEOUT)
+    return _payload_response(content, etag, last_modified)
+
+
+async def acached_invoice_response(request, kind, invoice_id, build, variant=''):
+    """cached_invoice_response for async views, where `build` is a coroutine function"""
+    if kind == 'audit-log':
+        versions = await aaudit_log_version(invoice_id, request.user)
+    else:
+        versions = await ainvoice_version(invoice_id, request.user)
+    etag, last_modified, key = _payload_versioning(kind, invoice_id, versions, variant)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    cache = _cache()
+    content = await cache.aget(key)
+    if content is None:
+        content = json.dumps(await build(), cls=DjangoJSONEncoder).encode()
+        await cache.aset(key, content, settings.BILLING_CACHE_TIMEOUT)
+    return _payload_response(content, etag, last_modified)
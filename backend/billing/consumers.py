@@ -0,0 +1,78 @@
+import asyncio
+
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from billing.feed import invoice_group
+from billing.models import Invoice
+from user.auth import aauthenticate_token
+
+
+# Close codes in the application range, mirroring the HTTP statuses
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+
+
+class InvoiceFeedConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Pushes change notifications for one invoice to an open edit screen.
+
+    Browsers cannot set headers on a WebSocket, so the access token is passed as the
+    subprotocols ['bearer', <token>]. Changes arriving within INVOICE_FEED_COALESCE
+    seconds of each other are sent as a single 'invoice.changed' message, after which
+    the client refetches the invoice and its audit log (with If-None-Match).
+    """
+
+    async def connect(self):
+        self.invoice_id = self.scope['url_route']['kwargs']['invoice_id']
+        self.group = None
+        self.pending = []
+        self.flush_task = None
+
+        subprotocols = self.scope.get('subprotocols') or []
+        user = None
+        if len(subprotocols) == 2 and subprotocols[0] == 'bearer':
+            try:
+                user = await aauthenticate_token(subprotocols[1])
+            except (AuthenticationFailed, InvalidToken):
+                pass
+        # Accepting first lets the client see why it was closed
+        await self.accept(subprotocol='bearer' if subprotocols else None)
+        if user is None:
+            await self.close(code=CLOSE_UNAUTHORIZED)
+            return
+        if not await Invoice.objects.owned_by(user).filter(pk=self.invoice_id).aexists():
+            await self.close(code=CLOSE_NOT_FOUND)
+            return
+
+        self.scope['user'] = user
+        self.group = invoice_group(self.invoice_id)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.send_json({'type': 'subscribed', 'invoice': self.invoice_id})
+
+    async def disconnect(self, code):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        if self.group is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        # The feed is one-way; answer pings so clients can detect dead connections
+        if content.get('type') == 'ping':
+            await self.send_json({'type': 'pong'})
+
+    async def invoice_changed(self, message):
+        self.pending.extend(message['actions'])
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(settings.INVOICE_FEED_COALESCE)
+        actions, self.pending, self.flush_task = self.pending, [], None
+        await self.send_json({
+            'type': 'invoice.changed',
+            'invoice': self.invoice_id,
+            'actions': sorted(set(actions)),
+            'events': len(actions),
+        })
@@ -0,0 +1,97 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from billing.models import Invoice, InvoiceItem
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+EXPORT_CHUNK_SIZE = 2000
+
+INVOICE_COLUMNS = [
+    'invoice_id', 'invoice_number', 'company_id', 'company_name', 'status',
+    'issue_date', 'due_date', 'subtotal_amount', 'total_amount', 'amount_paid', 'balance_due',
+]
+ITEM_COLUMNS = ['item_id', 'item_description', 'item_quantity', 'item_unit_price', 'item_total']
+CSV_COLUMNS = INVOICE_COLUMNS + ITEM_COLUMNS
+
+
+def export_queryset(queryset=None):
+    """Invoices with company and ordered items, ready to be streamed by id"""
+    if queryset is None:
+        queryset = Invoice.objects.all()
+    return (
+        queryset.select_related('company')
+        .prefetch_related(Prefetch('items', queryset=InvoiceItem.objects.order_by('id')))
+        .order_by('id')
+    )
+
+
+def _invoice_values(invoice):
+    return {
+        'invoice_id': invoice.id,
+        'invoice_number': invoice.invoice_number,
+        'company_id': invoice.company_id,
+        'company_name': invoice.company.name,
+        'status': invoice.status,
+        'issue_date': invoice.issue_date,
+        'due_date': invoice.due_date,
+        'subtotal_amount': invoice.subtotal_amount,
+        'total_amount': invoice.total_amount,
+        'amount_paid': invoice.amount_paid,
+        'balance_due': invoice.balance_due,
+    }
+
+
+def _item_values(item):
+    return {
+        'id': item.id,
+        'description': item.description,
+        'quantity': item.quantity,
+        'unit_price': item.unit_price,
+        'total': item.total,
+    }
+
+
+class _Echo:
+    """File-like object whose write() hands the line back instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """One CSV row per item, invoice columns repeated; invoices without items get one row"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for invoice in queryset.iterator(chunk_size=chunk_size):
+        values = _invoice_values(invoice)
+        head = [values[column] for column in INVOICE_COLUMNS]
+        items = invoice.items.all()
+        if not items:
+            yield writer.writerow(head + [''] * len(ITEM_COLUMNS))
+        for item in items:
+            item_values = {f'item_{key}': value for key, value in _item_values(item).items()}
+            yield writer.writerow(head + [item_values[column] for column in ITEM_COLUMNS])
+
+
+def iter_ndjson(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """One JSON document per invoice with its items nested"""
+    for invoice in queryset.iterator(chunk_size=chunk_size):
+        values = _invoice_values(invoice)
+        values['items'] = [_item_values(item) for item in invoice.items.all()]
+        yield json.dumps(values, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_export(export_format, queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    if export_format == 'csv':
+        return iter_csv(queryset, chunk_size)
+    if export_format == 'ndjson':
+        return iter_ndjson(queryset, chunk_size)
+    raise ValueError(f"output must be one of: {', '.join(EXPORT_FORMATS)}")
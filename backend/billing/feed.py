@@ -0,0 +1,46 @@
+import logging
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+def invoice_group(invoice_id):
+    """Channel layer group of the sockets following one invoice"""
+    return f'invoice-{invoice_id}'
+
+
+async def _send(layer, messages):
+    for group, message in messages:
+        await layer.group_send(group, message)
+
+
+def publish_audit_events(events):
+    """
+    Tell live feed subscribers about audit events once they are stored.
+
+    Sends one 'invoice.changed' message per invoice, listing the actions, after the
+    current transaction commits. Feed failures are logged and never fail the write.
+    """
+    layer = get_channel_layer()
+    if layer is None or not events:
+        return
+    actions = defaultdict(list)
+    for event in events:
+        actions[event['invoice_id']].append(event['action'])
+    messages = [
+        (invoice_group(invoice_id), {'type': 'invoice.changed', 'invoice': invoice_id, 'actions': invoice_actions})
+        for invoice_id, invoice_actions in actions.items()
+    ]
+
+    def send():
+        try:
+            async_to_sync(_send)(layer, messages)
+        except Exception:
+            logger.exception("Could not publish %d invoice change messages", len(messages))
+
+    transaction.on_commit(send)
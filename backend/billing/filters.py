@@ -0,0 +1,161 @@
+import uuid
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from billing.models import Invoice, InvoiceAuditLog
+
+
+INVOICE_ORDERINGS = {
+    'issue_date': ['issue_date', 'id'],
+    '-issue_date': ['-issue_date', '-id'],
+    'id': ['id'],
+    '-id': ['-id'],
+}
+
+
+def _parse_date_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    return parsed
+
+
+def _parse_int_param(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+
+def _parse_statuses(params):
+    status = params.get('status')
+    if not status:
+        return None
+    statuses = [s for s in status.split(',') if s]
+    valid = {choice for choice, _ in Invoice.STATUS_CHOICES}
+    unknown = set(statuses) - valid
+    if unknown:
+        raise ValueError(f"Unknown status: {', '.join(sorted(unknown))}")
+    return statuses
+
+
+def filter_invoices(queryset, params):
+    """Apply the invoice list filters from query params, raising ValueError on bad input"""
+    company = _parse_int_param(params, 'company')
+    if company is not None:
+        queryset = queryset.filter(company_id=company)
+
+    statuses = _parse_statuses(params)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+
+    created_by = params.get('created_by')
+    if created_by:
+        try:
+            queryset = queryset.filter(created_by_id=uuid.UUID(created_by))
+        except ValueError:
+            raise ValueError("created_by must be a user id")
+
+    date_filters = {
+        'issue_date_from': 'issue_date__gte',
+        'issue_date_to': 'issue_date__lte',
+        'due_date_from': 'due_date__gte',
+        'due_date_to': 'due_date__lte',
+    }
+    for param, lookup in date_filters.items():
+        value = _parse_date_param(params, param)
+        if value is not None:
+            queryset = queryset.filter(**{lookup: value})
+
+    return queryset
+
+
+def invoice_ordering(params):
+    ordering = params.get('ordering') or '-issue_date'
+    if ordering not in INVOICE_ORDERINGS:
+        raise ValueError(f"ordering must be one of: {', '.join(INVOICE_ORDERINGS)}")
+    return INVOICE_ORDERINGS[ordering]
+
+
+AUDIT_LOG_ORDERING = ['-timestamp', '-id']
+
+ARCHIVE_ORDERING = ['-period', '-id']
+
+
+def parse_audit_log_filters(params):
+    """Return (actions, user id) from query params, either None when absent"""
+    actions = None
+    action = params.get('action')
+    if action:
+        actions = [a for a in action.split(',') if a]
+        valid = {choice for choice, _ in InvoiceAuditLog.ACTION_CHOICES}
+        unknown = set(actions) - valid
+        if unknown:
+            raise ValueError(f"Unknown action: {', '.join(sorted(unknown))}")
+
+    user_id = None
+    user = params.get('user')
+    if user:
+        try:
+            user_id = uuid.UUID(user)
+        except ValueError:
+            raise ValueError("user must be a user id")
+    return actions, user_id
+
+
+def filter_audit_logs(queryset, params):
+    actions, user_id = parse_audit_log_filters(params)
+    if actions:
+        queryset = queryset.filter(action__in=actions)
+    if user_id:
+        queryset = queryset.filter(user_id=user_id)
+    return queryset
+
+
+def parse_revenue_group_by(params, allowed, default='period'):
+    group_by = [field for field in (params.get('group_by') or default).split(',') if field]
+    unknown = set(group_by) - set(allowed)
+    if unknown:
+        raise ValueError(f"group_by must be a comma separated list of: {', '.join(allowed)}")
+    return group_by
+
+
+def filter_revenue_rollups(queryset, params):
+    """Apply company, status and issue month filters to RevenueRollup rows"""
+    company = _parse_int_param(params, 'company')
+    if company is not None:
+        queryset = queryset.filter(company_id=company)
+
+    statuses = _parse_statuses(params)
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+
+    # Periods are whole months, so any date selects the month it falls in
+    period_from = _parse_date_param(params, 'issue_date_from')
+    if period_from is not None:
+        queryset = queryset.filter(period__gte=period_from.replace(day=1))
+    period_to = _parse_date_param(params, 'issue_date_to')
+    if period_to is not None:
+        queryset = queryset.filter(period__lte=period_to.replace(day=1))
+    return queryset
+
+
+def filter_receivable_rollups(queryset, params):
+    company = _parse_int_param(params, 'company')
+    if company is not None:
+        queryset = queryset.filter(company_id=company)
+    return queryset
+
+
+def parse_as_of(params):
+    return _parse_date_param(params, 'as_of') or timezone.localdate()
@@ -0,0 +1,336 @@
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from billing.items import clean_quantity
+from billing.models import Company, Invoice, InvoiceAuditLog, InvoiceItem, Payment, default_due_date
+from billing.search import refresh_search_documents
+
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+IMPORT_BATCH_SIZE = 1000
+
+# Errors beyond this are counted but not listed
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, invoice_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'invoice_number': invoice_number, 'error': message})
+
+    def as_dict(self):
+        return {'created': self.created, 'error_count': self.error_count, 'errors': self.errors}
+
+
+def read_ndjson(lines):
+    """Yield (line number, record) for one JSON invoice document per line"""
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, ValueError(f"Invalid JSON: {e}")
+            continue
+        yield line_no, record
+
+
+def read_csv(lines):
+    """
+    Yield (line number, record) from CSV rows grouped by consecutive invoice_number.
+
+    Each row repeats the invoice columns and may carry one item (item_* columns)
+    and/or one payment (payment_* columns), the same shape export_invoices writes.
+    """
+    reader = csv.DictReader(lines)
+    record = None
+    record_line = None
+    for row in reader:
+        line_no = reader.line_num
+        if record is None or row.get('invoice_number') != record['invoice_number']:
+            if record is not None:
+                yield record_line, record
+            record_line = line_no
+            record = {
+                'invoice_number': row.get('invoice_number'),
+                'company': {
+                    'name': row.get('company_name'),
+                    'tax_id': row.get('company_tax_id') or None,
+                    'address': row.get('company_address') or None,
+                },
+                'status': row.get('status') or None,
+                'issue_date': row.get('issue_date') or None,
+                'due_date': row.get('due_date') or None,
+                'items': [],
+                'payments': [],
+            }
+        if row.get('item_description'):
+            record['items'].append({
+                'description': row['item_description'],
+                'quantity': row.get('item_quantity') or 1,
+                'unit_price': row.get('item_unit_price'),
+            })
+        if row.get('payment_amount'):
+            record['payments'].append({
+                'amount': row['payment_amount'],
+                'paid_at': row.get('payment_paid_at') or None,
+                'reference': row.get('payment_reference') or None,
+            })
+    if record is not None:
+        yield record_line, record
+
+
+def _decimal(value, name, field):
+    """A finite number that fits the model field's digits and decimal places"""
+    try:
+        number = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"{name} must be a number")
+    if not number.is_finite():
+        raise ValueError(f"{name} must be a finite number")
+    if abs(number) >= 10 ** (field.max_digits - field.decimal_places):
+        raise ValueError(f"{name} must be less than {10 ** (field.max_digits - field.decimal_places)}")
+    cents = Decimal(1).scaleb(-field.decimal_places)
+    if number != number.quantize(cents):
+        raise ValueError(f"{name} must have at most {field.decimal_places} decimal places")
+    return number.quantize(cents)
+
+
+def _text(value, name, field):
+    value = str(value or '').strip()
+    if field.max_length and len(value) > field.max_length:
+        raise ValueError(f"{name} is longer than {field.max_length} characters")
+    return value
+
+
+def _date(value, name, default):
+    if value in (None, ''):
+        return default
+    parsed = parse_date(str(value))
+    if parsed is None:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    return parsed
+
+
+def _objects(value, name):
+    if value in (None, ''):
+        return []
+    if not isinstance(value, list) or not all(isinstance(entry, dict) for entry in value):
+        raise ValueError(f"{name} must be a list of objects")
+    return value
+
+
+def _clean_record(record):
+    """Validate one raw record into plain values, raising ValueError on the first problem"""
+    if isinstance(record, Exception):
+        raise record
+    if not isinstance(record, dict):
+        raise ValueError("Record must be an object")
+
+    invoice_number = _text(record.get('invoice_number'), 'invoice_number', Invoice._meta.get_field('invoice_number'))
+    if not invoice_number:
+        raise ValueError("invoice_number is required")
+
+    company = record.get('company') or {}
+    if not isinstance(company, dict):
+        raise ValueError("company must be an object")
+    company_name = _text(company.get('name'), 'company name', Company._meta.get_field('name'))
+    if not company_name:
+        raise ValueError("company name is required")
+    tax_id = _text(company.get('tax_id'), 'company tax_id', Company._meta.get_field('tax_id')) or None
+
+    status = record.get('status') or 'draft'
+    if status not in dict(Invoice.STATUS_CHOICES):
+        raise ValueError(f"Unknown status: {status}")
+
+    items = []
+    for item in _objects(record.get('items'), 'items'):
+        description = _text(item.get('description'), 'Item description', InvoiceItem._meta.get_field('description'))
+        if not description:
+            raise ValueError("Item description is required")
+        quantity = clean_quantity(item.get('quantity', 1))
+        unit_price = _decimal(item.get('unit_price'), 'Item unit_price', InvoiceItem._meta.get_field('unit_price'))
+        items.append((description, quantity, unit_price))
+
+    payments = []
+    for payment in _objects(record.get('payments'), 'payments'):
+        paid_at = timezone.now()
+        if payment.get('paid_at'):
+            paid_at = parse_datetime(str(payment['paid_at']))
+            if paid_at is None:
+                raise ValueError("Payment paid_at must be an ISO 8601 datetime")
+            if timezone.is_naive(paid_at):
+                paid_at = timezone.make_aware(paid_at)
+        amount = _decimal(payment.get('amount'), 'Payment amount', Payment._meta.get_field('amount'))
+        reference = _text(payment.get('reference'), 'Payment reference', Payment._meta.get_field('reference')) or None
+        payments.append((amount, paid_at, reference))
+
+    total = sum((quantity * unit_price for _, quantity, unit_price in items), Decimal('0.00'))
+    _decimal(total, 'Invoice total', Invoice._meta.get_field('total_amount'))
+    paid = sum((amount for amount, _, _ in payments), Decimal('0.00'))
+    _decimal(paid, 'Invoice amount paid', Invoice._meta.get_field('amount_paid'))
+
+    return {
+        'invoice_number': invoice_number,
+        'company_key': (tax_id, company_name),
+        'company_address': company.get('address'),
+        'status': status,
+        'issue_date': _date(record.get('issue_date'), 'issue_date', timezone.now().date()),
+        'due_date': _date(record.get('due_date'), 'due_date', default_due_date().date()),
+        'items': items,
+        'payments': payments,
+    }
+
+
+def _company_key(tax_id, name):
+    return ('tax_id', tax_id) if tax_id else ('name', name)
+
+
+def _resolve_companies(keys, addresses, owner):
+    """Map (tax_id, name) keys to the owner's companies with one lookup, creating the missing ones in bulk"""
+    tax_ids = {tax_id for tax_id, _ in keys if tax_id}
+    names = {name for tax_id, name in keys if not tax_id}
+    companies = {}
+    lookup = Q(tax_id__in=tax_ids) | Q(tax_id__isnull=True, name__in=names)
+    for company in Company.objects.owned_by(owner).filter(lookup).order_by('id'):
+        companies.setdefault(_company_key(company.tax_id, company.name), company)
+
+    missing = {}
+    for tax_id, name in keys:
+        key = _company_key(tax_id, name)
+        if key not in companies and key not in missing:
+            missing[key] = Company(owner=owner, name=name, tax_id=tax_id, address=addresses.get((tax_id, name)))
+    if missing:
+        Company.objects.bulk_create(missing.values())
+        companies.update(missing)
+
+    return {(tax_id, name): companies[_company_key(tax_id, name)] for tax_id, name in keys}
+
+
+def _write_batch(rows, user):
+    companies = _resolve_companies({row['company_key'] for _, row in rows}, {
+        row['company_key']: row['company_address'] for _, row in rows
+    }, user)
+
+    invoices = []
+    for _, row in rows:
+        amount = sum((quantity * unit_price for _, quantity, unit_price in row['items']), Decimal('0.00'))
+        paid = sum((payment_amount for payment_amount, _, _ in row['payments']), Decimal('0.00'))
+        invoices.append(Invoice(
+            owner=user,
+            company=companies[row['company_key']],
+            invoice_number=row['invoice_number'],
+            issue_date=row['issue_date'],
+            due_date=row['due_date'],
+            status=row['status'],
+            created_by=user,
+            subtotal_amount=amount,
+            total_amount=amount,
+            item_count=len(row['items']),
+            amount_paid=paid,
+            balance_due=amount - paid,
+        ))
+    Invoice.objects.bulk_create(invoices)
+
+    items, payments, audit_logs = [], [], []
+    for invoice, (_, row) in zip(invoices, rows):
+        items.extend(
+            InvoiceItem(invoice_id=invoice.id, description=description, quantity=quantity, unit_price=unit_price)
+            for description, quantity, unit_price in row['items']
+        )
+        payments.extend(
+            Payment(invoice_id=invoice.id, amount=amount, paid_at=paid_at, reference=reference)
+            for amount, paid_at, reference in row['payments']
+        )
+        audit_logs.append(InvoiceAuditLog(invoice=invoice, user=user, action='created', description="Imported"))
+    InvoiceItem.objects.bulk_create(items)
+    Payment.objects.bulk_create(payments)
+    InvoiceAuditLog.objects.bulk_create(audit_logs)
+    # Items and payments are bulk written, so the documents indexed with the invoices lack them
+    refresh_search_documents([invoice.id for invoice in invoices])
+
+
+def _import_batch(batch, user, seen_numbers, result):
+    rows = []
+    for line_no, record in batch:
+        number = record.get('invoice_number') if isinstance(record, dict) else None
+        try:
+            row = _clean_record(record)
+        except ValueError as e:
+            result.add_error(line_no, number, str(e))
+            continue
+        if row['invoice_number'] in seen_numbers:
+            result.add_error(line_no, row['invoice_number'], "Duplicate invoice_number in file")
+            continue
+        seen_numbers.add(row['invoice_number'])
+        rows.append((line_no, row))
+
+    # Invoice numbers are unique across tenants, but whether another tenant uses one is not the importer's business
+    existing = dict(Invoice.objects.filter(
+        invoice_number__in=[row['invoice_number'] for _, row in rows]
+    ).values_list('invoice_number', 'owner_id'))
+    if existing:
+        owner_id = user.pk if user is not None else None
+        for line_no, row in rows:
+            if row['invoice_number'] not in existing:
+                continue
+            if existing[row['invoice_number']] == owner_id:
+                result.add_error(line_no, row['invoice_number'], "Invoice number already exists")
+            else:
+                result.add_error(line_no, row['invoice_number'], "Invoice number is not available")
+        rows = [(line_no, row) for line_no, row in rows if row['invoice_number'] not in existing]
+    if not rows:
+        return
+
+    try:
+        with transaction.atomic():
+            _write_batch(rows, user)
+    except (IntegrityError, DataError) as e:
+        # Lost a race with a concurrent writer, or a value the rows were not checked for; the
+        # batch was rolled back as a unit
+        for line_no, row in rows:
+            result.add_error(line_no, row['invoice_number'], f"Batch rolled back: {e}")
+        return
+    result.created += len(rows)
+
+
+def import_invoices(records, user=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Import (line number, record) pairs in batches, each written in its own transaction.
+
+    Invalid records are reported per line without stopping the import. Companies are
+    matched among the user's by tax_id (or by name when there is none) and created
+    when missing; the user owns the imported invoices.
+    """
+    result = ImportResult()
+    seen_numbers = set()
+    batch = []
+    for entry in records:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            _import_batch(batch, user, seen_numbers, result)
+            batch = []
+    if batch:
+        _import_batch(batch, user, seen_numbers, result)
+    return result
+
+
+def read_records(import_format, lines):
+    if import_format == 'csv':
+        return read_csv(lines)
+    if import_format == 'ndjson':
+        return read_ndjson(lines)
+    raise ValueError(f"input must be one of: {', '.join(IMPORT_FORMATS)}")
@@ -0,0 +1,107 @@
+from decimal import Decimal, InvalidOperation
+
+from billing.models import InvoiceItem
+
+
+def _item_values(item):
+    return {
+        'description': item.description,
+        'quantity': item.quantity,
+        'unit_price': str(item.unit_price),
+    }
+
+
+def clean_quantity(value):
+    """A whole, non-negative item quantity; fractions are rejected rather than truncated"""
+    try:
+        quantity = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError("Item quantity must be a whole number")
+    if not quantity.is_finite() or quantity != quantity.to_integral_value():
+        raise ValueError("Item quantity must be a whole number")
+    if quantity < 0:
+        raise ValueError("Item quantity must not be negative")
+    return int(quantity)
+
+
+def _clean_item_data(data):
+    if not isinstance(data, dict):
+        raise ValueError("Each item must be an object")
+    try:
+        description = data['description']
+        quantity = clean_quantity(data['quantity'])
+        unit_price = Decimal(str(data['unit_price']))
+    except KeyError as e:
+        raise ValueError(f"Item is missing {e.args[0]}")
+    except InvalidOperation:
+        raise ValueError("Item unit_price must be a number")
+
+    description_field = InvoiceItem._meta.get_field('description')
+    if not isinstance(description, str):
+        raise ValueError("Item description must be a string")
+    if len(description) > description_field.max_length:
+        raise ValueError(f"Item description is longer than {description_field.max_length} characters")
+    price_field = InvoiceItem._meta.get_field('unit_price')
+    if not unit_price.is_finite() or abs(unit_price) >= 10 ** (price_field.max_digits - price_field.decimal_places):
+        raise ValueError("Item unit_price is out of range")
+    # Stored rounded to the column's scale, it would never compare equal to what was sent
+    cents = Decimal(1).scaleb(-price_field.decimal_places)
+    if unit_price != unit_price.quantize(cents):
+        raise ValueError(f"Item unit_price must have at most {price_field.decimal_places} decimal places")
+    return description, quantity, unit_price.quantize(cents)
+
+
+def sync_invoice_items(invoice, items_data):
+    """
+    Apply a full item list to an invoice by diffing it against the stored items.
+
+    Entries carrying the id of an existing item update it in place, entries without
+    an id are inserted and stored items missing from the list are deleted, each with
+    one bulk query. Must run inside a transaction. Returns audit events as
+    (action, changes) pairs.
+    """
+    if not isinstance(items_data, list):
+        raise ValueError("items must be a list")
+    existing = {item.id: item for item in invoice.items.all()}
+    to_create, to_update, kept_ids = [], [], set()
+    events = []
+
+    for data in items_data:
+        description, quantity, unit_price = _clean_item_data(data)
+        item_id = data.get('id')
+
+        if item_id in (None, ''):
+            item = InvoiceItem(invoice=invoice, description=description, quantity=quantity, unit_price=unit_price)
+            to_create.append(item)
+            continue
+
+        try:
+            item = existing[int(item_id)]
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Item {item_id} does not belong to this invoice")
+        if item.id in kept_ids:
+            raise ValueError(f"Item {item_id} is listed more than once")
+        kept_ids.add(item.id)
+
+        if (item.description, item.quantity, item.unit_price) == (description, quantity, unit_price):
+            continue
+        old = _item_values(item)
+        item.description, item.quantity, item.unit_price = description, quantity, unit_price
+        to_update.append(item)
+        events.append(('item_updated', {'id': item.id, 'old': old, 'new': _item_values(item)}))
+
+    removed_ids = [item_id for item_id in existing if item_id not in kept_ids]
+    for item_id in removed_ids:
+        events.append(('item_removed', {'id': item_id, 'old': _item_values(existing[item_id])}))
+
+    if removed_ids:
+        InvoiceItem.objects.filter(id__in=removed_ids).delete()
+    if to_update:
+        InvoiceItem.objects.bulk_update(to_update, ['description', 'quantity', 'unit_price'])
+    if to_create:
+        InvoiceItem.objects.bulk_create(to_create)
+        events.extend(('item_added', {'id': item.id, 'new': _item_values(item)}) for item in to_create)
+    if events:
+        invoice.refresh_totals()
+
+    return events
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies, duration=None):
+    """Request count, throughput and p50/p95/p99 in ms of latencies in seconds"""
+    summary = {'requests': len(latencies)}
+    if not latencies:
+        return summary
+    summary['rps'] = round(len(latencies) / (duration or sum(latencies)), 1)
+    for name, fraction in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        summary[name] = round(percentile(latencies, fraction) * 1000, 2)
+    return summary
+
+
+@contextmanager
+def running_server(**environ):
+    """A daphne serving the project on a free port, with `environ` added to its environment; yields the port"""
+    database = settings.DATABASES['default']
+    if database['ENGINE'].endswith('sqlite3') and 'memory' in str(database['NAME']):
+        raise RuntimeError("The server needs a database it can share; set DATABASE_NAME to a file")
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(port), 'backend.asgi:application'],
+        cwd=settings.BASE_DIR, env={**os.environ, **environ}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError(f"daphne did not start on port {port}")
+        yield port
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def get(port, path, token):
+    """GET `path` on a fresh connection; returns the status code once the body is read"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n'
+            f'Connection: close\r\n\r\n'.encode()
+        )
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def load(port, paths, token, concurrency, duration):
+    """Keep `concurrency` clients busy for `duration` seconds; returns (latencies, errors)"""
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+
+    async def client(n):
+        i = n
+        while time.perf_counter() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status = await get(port, path, token)
+            except OSError as e:
+                errors.append(repr(e))
+                continue
+            if status != 200:
+                errors.append(f'{path}: HTTP {status}')
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return latencies, errors
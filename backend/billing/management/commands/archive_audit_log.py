@@ -0,0 +1,23 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from billing.audit import archive_audit_logs
+
+
+class Command(BaseCommand):
+    help = "Move audit log rows past retention into compressed per-invoice monthly archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=settings.AUDIT_LOG_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        archived = 0
+        for count in archive_audit_logs(cutoff, options['batch_size']):
+            archived += count
+            self.stdout.write(f"Archived {archived} audit rows")
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} audit rows older than {cutoff:%Y-%m-%d}"))
@@ -0,0 +1,81 @@
+import asyncio
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from billing.loadtest import load, percentile, running_server
+from billing.models import Company, Invoice, InvoiceAuditLog, InvoiceItem
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = "Load-test the sync and async invoice/user read views under daphne and compare throughput and latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=50)
+        parser.add_argument('--items', type=int, default=20, help="Per invoice")
+        parser.add_argument('--logs', type=int, default=50, help="Audit rows per invoice")
+        parser.add_argument('--concurrency', type=int, default=64)
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per run")
+
+    def handle(self, *args, **options):
+        database = settings.DATABASES['default']
+        if database['ENGINE'].endswith('sqlite3') and 'memory' in str(database['NAME']):
+            raise CommandError("The servers need a database they can share; set DATABASE_NAME to a file")
+
+        run = time.strftime('%Y%m%d%H%M%S')
+        # Kept between runs, deleting users cascades into tables not every deployment has
+        user = User.objects.filter(email='read-benchmark@example.com').first() or User.objects.create_user(
+            name='Read benchmark', email='read-benchmark@example.com',
+        )
+        company = Company.objects.create(name=f'Read benchmark {run}')
+        invoices = [
+            Invoice.objects.create(company=company, invoice_number=f'READ-{run}-{n}', created_by=user)
+            for n in range(options['invoices'])
+        ]
+        InvoiceItem.objects.bulk_create(
+            InvoiceItem(invoice=invoice, description=f'Item {n}', quantity=1, unit_price=Decimal('10.00'))
+            for invoice in invoices for n in range(options['items'])
+        )
+        Invoice.objects.filter(company=company).refresh_totals()
+        InvoiceAuditLog.objects.bulk_create(
+            InvoiceAuditLog(invoice=invoice, user=user, action='updated')
+            for invoice in invoices for _ in range(options['logs'])
+        )
+        token = str(AccessToken.for_user(user))
+        paths = [
+            path for invoice in invoices
+            for path in (f'/api/invoices/{invoice.pk}/', f'/api/invoices/{invoice.pk}/audit-log/', f'/api/auth/{user.pk}/')
+        ]
+
+        try:
+            self.stdout.write(
+                f"{options['invoices']} invoices x {options['items']} items / {options['logs']} audit rows, "
+                f"{options['concurrency']} clients, {options['duration']:.0f} s per run"
+            )
+            for mode in ('sync', 'async'):
+                self.stdout.write(f"{mode:5}  " + self.run_server(mode, paths, token, options))
+        finally:
+            Invoice.objects.filter(company=company).delete()
+            company.delete()
+
+    def run_server(self, mode, paths, token, options):
+        environ = {'ASYNC_READ_VIEWS': 'true' if mode == 'async' else 'false', 'AUDIT_LOG_ASYNC': 'false'}
+        try:
+            with running_server(**environ) as port:
+                # Warm up, then measure
+                asyncio.run(load(port, paths, token, options['concurrency'], 1.0))
+                latencies, errors = asyncio.run(load(port, paths, token, options['concurrency'], options['duration']))
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        if errors:
+            raise CommandError(f"{mode}: {len(errors)} failed requests, first: {errors[0]}")
+        return (
+            f"{len(latencies) / options['duration']:8,.0f} req/s   "
+            f"p50 {percentile(latencies, 0.5) * 1000:7.1f} ms   "
+            f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms"
+        )
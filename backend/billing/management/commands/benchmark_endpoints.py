@@ -0,0 +1,269 @@
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from billing import urls as billing_urls
+from billing.loadtest import load, running_server, summarize
+from billing.models import Invoice
+from billing.synthetic import SYNTHETIC_PASSWORD, generate, synthetic_email, synthetic_prefix
+from user import urls as user_urls
+from user.models import User
+
+
+# A regression is a median growing by more than --threshold or any growth in query counts;
+# the tails are shown too, but need far more requests than a quick run makes to be stable
+COMPARED_LATENCIES = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+class Fixture:
+    """The tenant and rows the scenarios request, picked from the seed's synthetic data"""
+
+    def __init__(self, seed):
+        self.owner = User.objects.get(email=synthetic_email(seed, 0))
+        invoices = Invoice.objects.owned_by(self.owner).filter(invoice_number__startswith=synthetic_prefix(seed))
+        self.invoices = list(invoices.order_by('-item_count', 'pk').values_list('pk', flat=True)[:20])
+        self.draft = invoices.filter(status='draft').order_by('pk').values_list('pk', flat=True).first()
+        self.sent = list(invoices.filter(status='sent').order_by('pk').values_list('pk', 'invoice_number')[:50])
+        self.company = invoices.values_list('company_id', flat=True).first()
+        if not (self.invoices and self.draft and self.sent):
+            raise CommandError(f"Seed {seed}'s first tenant needs draft and sent invoices; generate a larger --scale")
+        self.refresh = str(RefreshToken.for_user(self.owner))
+        self.access = str(RefreshToken(self.refresh).access_token)
+
+    def import_file(self):
+        records = [
+            {
+                'invoice_number': f'BENCH-IMPORT-{n}', 'company': {'name': 'Benchmark Import Ltd', 'tax_id': 'BENCH1'},
+                'status': 'sent', 'items': [{'description': f'Line {i}', 'quantity': 2, 'unit_price': '12.50'} for i in range(5)],
+            }
+            for n in range(20)
+        ]
+        content = '\n'.join(json.dumps(record) for record in records).encode()
+        return {'file': SimpleUploadedFile('invoices.ndjson', content, 'application/x-ndjson')}
+
+    def statement_file(self):
+        lines = ['reference,amount,paid_at'] + [f'{number},10.00,2024-01-15' for _, number in self.sent]
+        return {'file': SimpleUploadedFile('statement.csv', '\n'.join(lines).encode(), 'text/csv')}
+
+
+def scenarios(fixture):
+    """
+    One request per URL name of billing.urls and user.urls: (method, paths, data, format, statuses).
+
+    Writes run in a transaction that is rolled back, so every repetition sees the same rows.
+    """
+    invoice = fixture.invoices[0]
+    return {
+        'invoice_list': (
+            'GET', ['/api/invoices/?limit=25', '/api/invoices/?status=sent&limit=25', f'/api/invoices/?company={fixture.company}&limit=25'],
+            None, None, {200},
+        ),
+        'invoice_export': ('GET', ['/api/invoices/export/?status=sent'], None, None, {200}),
+        'invoice_search': ('GET', ['/api/invoices/search/?q=consult', '/api/invoices/search/?q=websit'], None, None, {200}),
+        'invoice_import': ('POST', ['/api/invoices/import/?input=ndjson'], fixture.import_file, 'multipart', {200}),
+        'payment_reconcile': ('POST', ['/api/invoices/reconcile/'], fixture.statement_file, 'multipart', {200}),
+        'revenue_analytics': (
+            'GET', ['/api/invoices/analytics/revenue/?group_by=period', '/api/invoices/analytics/revenue/?group_by=company,status'],
+            None, None, {200},
+        ),
+        'receivables_analytics': (
+            'GET', ['/api/invoices/analytics/receivables/', '/api/invoices/analytics/receivables/?group_by=company'],
+            None, None, {200},
+        ),
+        'invoice_detail': ('GET', [f'/api/invoices/{pk}/' for pk in fixture.invoices], None, None, {200}),
+        'invoice_update': (
+            'PATCH', [f'/api/invoices/{fixture.draft}/edit/'],
+            lambda: {'due_date': str(timezone.localdate()), 'items': [{'description': 'Benchmark', 'quantity': 1, 'unit_price': '5.00'}]},
+            'json', {200},
+        ),
+        'invoice_audit_log': ('GET', [f'/api/invoices/{pk}/audit-log/' for pk in fixture.invoices], None, None, {200}),
+        'invoice_payments': ('GET', [f'/api/invoices/{pk}/payments/' for pk in fixture.invoices], None, None, {200}),
+        'invoice_document': ('GET', [f'/api/invoices/{invoice}/document/?output=html'], None, None, {200}),
+        'rest_register': (
+            'POST', ['/api/auth/register/'],
+            lambda: {'name': 'Benchmark', 'email': 'register-benchmark@example.com', 'password1': 'plover-Harbor-71', 'password2': 'plover-Harbor-71'},
+            'json', {201},
+        ),
+        'rest_login': (
+            'POST', ['/api/auth/login/'], lambda: {'email': fixture.owner.email, 'password': SYNTHETIC_PASSWORD}, 'json', {200},
+        ),
+        'rest_logout': ('POST', ['/api/auth/logout/'], lambda: {'refresh': fixture.refresh}, 'json', {200}),
+        'edit_account': ('PATCH', ['/api/auth/edit/'], lambda: {'description': 'Benchmarked'}, 'json', {200}),
+        'host_detail': ('GET', [f'/api/auth/{fixture.owner.pk}/'], None, None, {200}),
+        'token_refresh': ('POST', ['/api/auth/token/refresh/'], lambda: {'refresh': fixture.refresh}, 'json', {200}),
+    }
+
+
+def url_names():
+    return [
+        pattern.name for module in (billing_urls, user_urls) for pattern in module.urlpatterns
+        if isinstance(pattern, URLPattern)
+    ]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every billing and user endpoint against synthetic data (see generate_data): latency "
+        "percentiles and query counts through the test client, throughput of the reads under daphne; "
+        "results are saved as JSON and can be compared with an earlier run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Synthetic data to use, generated if missing")
+        parser.add_argument('--scale', type=float, default=1.0, help="When the data has to be generated")
+        parser.add_argument('--requests', type=int, default=50, help="Per endpoint through the test client")
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds per endpoint under daphne")
+        parser.add_argument('--no-http', action='store_true', help="Skip the daphne load test")
+        parser.add_argument('--output', help="Result JSON, by default var/benchmarks/<time>.json")
+        parser.add_argument('--compare', help="A previous result JSON to compare against")
+        parser.add_argument('--threshold', type=float, default=0.25, help="Median latency growth reported as a regression")
+
+    def handle(self, *args, **options):
+        if not Invoice.objects.filter(invoice_number__startswith=synthetic_prefix(options['seed'])).exists():
+            self.stdout.write(f"Generating seed {options['seed']} at scale {options['scale']}")
+            generate(options['scale'], options['seed'])
+        fixture = Fixture(options['seed'])
+        plan = scenarios(fixture)
+        missing = [name for name in url_names() if name not in plan]
+        if missing:
+            raise CommandError(f"No benchmark scenario for: {', '.join(missing)}")
+
+        results = {
+            'meta': {
+                'started_at': timezone.now().isoformat(),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'seed': options['seed'],
+                'invoices': Invoice.objects.owned_by(fixture.owner).count(),
+                'async_read_views': settings.ASYNC_READ_VIEWS,
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+            },
+            'client': {},
+            'http': {},
+        }
+
+        self.stdout.write(f"{'test client':<22} {'queries':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, scenario in plan.items():
+            results['client'][name] = summary = self.run_client(name, scenario, fixture, options['requests'])
+            self.stdout.write(
+                f"{name:<22} {summary['queries']:>8} {summary['rps']:>8,.0f} "
+                f"{summary['p50_ms']:>8.1f} {summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f}"
+            )
+
+        if not options['no_http']:
+            self.stdout.write(f"\n{'daphne':<22} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+            try:
+                with running_server(AUDIT_LOG_ASYNC='false') as port:
+                    for name, (method, paths, *_) in plan.items():
+                        if method != 'GET':
+                            continue
+                        results['http'][name] = summary = self.run_http(name, port, paths, fixture, options)
+                        self.stdout.write(
+                            f"{name:<22} {summary['requests']:>8} {summary['rps']:>8,.0f} "
+                            f"{summary['p50_ms']:>8.1f} {summary['p95_ms']:>8.1f} {summary['p99_ms']:>8.1f}"
+                        )
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+        output = Path(options['output'] or settings.BASE_DIR / 'var' / 'benchmarks' / f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"\nSaved {output}"))
+
+        if options['compare']:
+            regressions = self.compare(json.loads(Path(options['compare']).read_text()), results, options['threshold'])
+            if regressions:
+                raise CommandError(f"{regressions} regressions against {options['compare']}")
+
+    def run_client(self, name, scenario, fixture, requests):
+        method, paths, data, data_format, statuses = scenario
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {fixture.access}')
+        send = getattr(client, method.lower())
+        latencies, queries = [], []
+        # The first round warms caches and rendered documents and is not measured
+        for n in range(-len(paths), requests):
+            path = paths[n % len(paths)]
+            payload = data() if data else None
+            with transaction.atomic() if payload is not None else nullcontext():
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = send(path, payload, format=data_format) if payload is not None else send(path)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    latencies.append(time.perf_counter() - started)
+                if payload is not None:
+                    transaction.set_rollback(True)
+            if response.status_code not in statuses:
+                content = b'' if response.streaming else response.content[:300]
+                raise CommandError(f"{name}: {method} {path} answered {response.status_code} {content!r}")
+            if n < 0:
+                latencies.pop()
+                continue
+            queries.append(len(captured))
+        summary = summarize(latencies)
+        summary.update(method=method, queries=int(statistics.median(queries)), max_queries=max(queries))
+        return summary
+
+    def run_http(self, name, port, paths, fixture, options):
+        # Warm up, then measure
+        asyncio.run(load(port, paths, fixture.access, options['concurrency'], 0.5))
+        latencies, errors = asyncio.run(load(port, paths, fixture.access, options['concurrency'], options['duration']))
+        if errors:
+            raise CommandError(f"{name}: {len(errors)} failed requests, first: {errors[0]}")
+        return summarize(latencies, options['duration'])
+
+    def compare(self, baseline, results, threshold):
+        """Print the change of every measurement against `baseline`; returns how many regressed"""
+        regressions = 0
+        self.stdout.write(f"\nCompared with {baseline['meta'].get('commit')} ({baseline['meta'].get('started_at')})")
+        for section in ('client', 'http'):
+            for name, current in results[section].items():
+                before = baseline.get(section, {}).get(name)
+                if before is None:
+                    continue
+                changes, worse = [], False
+                for key in COMPARED_LATENCIES:
+                    if before.get(key):
+                        change = current[key] / before[key] - 1
+                        worse |= key == 'p50_ms' and change > threshold
+                        changes.append(f"{key[:3]} {change:+.0%}")
+                if 'queries' in before:
+                    worse |= current['queries'] > before['queries']
+                    changes.append(f"queries {before['queries']} -> {current['queries']}")
+                if before.get('rps'):
+                    changes.append(f"req/s {current['rps'] / before['rps'] - 1:+.0%}")
+                regressions += worse
+                line = f"{section:<7} {name:<22} {'   '.join(changes)}"
+                self.stdout.write(self.style.ERROR(line + '   REGRESSION') if worse else line)
+        return regressions
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from billing.importer import IMPORT_BATCH_SIZE, import_invoices, read_records
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic NDJSON file and time a bulk import of it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=100_000)
+        parser.add_argument('--items-per-invoice', type=int, default=10)
+        parser.add_argument('--payments-per-invoice', type=int, default=1)
+        parser.add_argument('--companies', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--keep', action='store_true', help="Commit the imported rows instead of rolling back")
+
+    def handle(self, *args, **options):
+        fd, path = tempfile.mkstemp(suffix='.ndjson')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                self._generate(f, options)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+
+            with transaction.atomic():
+                started = time.perf_counter()
+                with open(path) as f:
+                    result = import_invoices(read_records('ndjson', f), batch_size=options['batch_size'])
+                elapsed = time.perf_counter() - started
+                if not options['keep']:
+                    transaction.set_rollback(True)
+        finally:
+            os.remove(path)
+
+        items = result.created * options['items_per_invoice']
+        self.stdout.write(f"database:        {connection.vendor}")
+        self.stdout.write(f"file:            {size_mb:.1f} MB")
+        self.stdout.write(f"invoices:        {result.created} ({result.error_count} errors)")
+        self.stdout.write(f"items:           {items}")
+        self.stdout.write(f"elapsed:         {elapsed:.1f} s")
+        self.stdout.write(f"invoices/s:      {result.created / elapsed:,.0f}")
+        self.stdout.write(f"items/s:         {items / elapsed:,.0f}")
+
+    def _generate(self, f, options):
+        run = time.strftime('%Y%m%d%H%M%S')
+        for n in range(options['invoices']):
+            company = n % options['companies']
+            record = {
+                'invoice_number': f'IMP-{run}-{n:07d}',
+                'company': {'name': f'Company {company}', 'tax_id': f'BENCH{company:05d}'},
+                'status': 'sent',
+                'issue_date': '2025-01-15',
+                'due_date': '2025-02-15',
+                'items': [
+                    {'description': f'Line {i}', 'quantity': i % 5 + 1, 'unit_price': f'{(i * 7) % 100 + 1}.50'}
+                    for i in range(options['items_per_invoice'])
+                ],
+                'payments': [
+                    {'amount': '10.00', 'paid_at': '2025-01-20T10:00:00Z', 'reference': f'PAY-{run}-{n}-{p}'}
+                    for p in range(options['payments_per_invoice'])
+                ],
+            }
+            f.write(json.dumps(record) + '\n')
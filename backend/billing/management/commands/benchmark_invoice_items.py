@@ -0,0 +1,68 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from billing.models import Company, Invoice, InvoiceItem
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = "Measure query count and latency of invoice item updates at several invoice sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'items':>6} {'scenario':<10} {'queries':>8} {'p50 ms':>9} {'max ms':>9}")
+        # Everything is rolled back, so this is safe to point at a dev database
+        with transaction.atomic():
+            user = User.objects.create_user(email='benchmark-items@example.com', password=None)
+            company = Company.objects.create(name='Benchmark Co')
+            client = APIClient()
+            client.force_authenticate(user)
+
+            for size in options['sizes']:
+                for scenario in ('unchanged', 'churn'):
+                    queries, timings = self._run(client, company, size, scenario, options['repeat'])
+                    self.stdout.write(
+                        f"{size:>6} {scenario:<10} {queries:>8} "
+                        f"{statistics.median(timings):>9.1f} {max(timings):>9.1f}"
+                    )
+
+            transaction.set_rollback(True)
+
+    def _run(self, client, company, size, scenario, repeat):
+        timings = []
+        queries = 0
+        for run in range(repeat):
+            invoice = Invoice.objects.create(company=company, invoice_number=f'BENCH-{size}-{scenario}-{run}')
+            InvoiceItem.objects.bulk_create([
+                InvoiceItem(invoice=invoice, description=f'Item {n}', quantity=1, unit_price=Decimal('10.00'))
+                for n in range(size)
+            ])
+            items = [
+                {'id': item.id, 'description': item.description, 'quantity': item.quantity, 'unit_price': str(item.unit_price)}
+                for item in invoice.items.order_by('id')
+            ]
+            if scenario == 'churn':
+                # Update, remove and add roughly a tenth of the lines each
+                step = max(size // 10, 1)
+                for item in items[::step]:
+                    item['quantity'] = 2
+                del items[1::step]
+                items.extend({'description': f'New {n}', 'quantity': 1, 'unit_price': '5.00'} for n in range(step))
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.put(f'/api/invoices/{invoice.id}/edit/', {'items': items}, format='json')
+                timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise RuntimeError(f"Update failed with {response.status_code}: {response.content[:200]}")
+            queries = len(captured)
+        return queries, timings
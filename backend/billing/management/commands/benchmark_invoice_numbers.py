@@ -0,0 +1,73 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test.utils import override_settings
+
+from billing.models import Company, Invoice, InvoiceSequence
+from billing.numbering import allocate_invoice_numbers
+
+
+class Command(BaseCommand):
+    help = "Allocate invoice numbers from concurrent workers and report throughput and gaps"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--allocations', type=int, default=500, help="Per worker")
+        parser.add_argument('--companies', type=int, default=1, help="Workers spread across this many sequences")
+        parser.add_argument('--block-size', type=int, default=settings.INVOICE_NUMBER_BLOCK_SIZE)
+        parser.add_argument('--create', action='store_true', help="Insert an invoice with each number")
+
+    def handle(self, *args, **options):
+        run = time.strftime('%Y%m%d%H%M%S')
+        companies = [
+            Company.objects.create(name=f'Numbering benchmark {run} {n}').pk for n in range(options['companies'])
+        ]
+        numbers, errors = [], []
+        lock = threading.Lock()
+
+        def work(worker):
+            company_id = companies[worker % len(companies)]
+            allocated = []
+            try:
+                for _ in range(options['allocations']):
+                    with transaction.atomic():
+                        number = allocate_invoice_numbers(company_id)[0]
+                        if options['create']:
+                            Invoice.objects.create(company_id=company_id, invoice_number=number)
+                    allocated.append(number)
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+            with lock:
+                numbers.extend(allocated)
+
+        with override_settings(INVOICE_NUMBER_BLOCK_SIZE=options['block_size']):
+            threads = [threading.Thread(target=work, args=(n,)) for n in range(options['workers'])]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+        try:
+            if errors:
+                raise CommandError(f"{len(errors)} workers failed, first error: {errors[0]}")
+            if len(set(numbers)) != len(numbers):
+                raise CommandError(f"{len(numbers) - len(set(numbers))} numbers were handed out twice")
+
+            issued = InvoiceSequence.objects.filter(company_id__in=companies).values_list('next_value', flat=True)
+            gaps = sum(next_value - 1 for next_value in issued) - len(numbers)
+            self.stdout.write(f"database:        {connection.vendor}")
+            self.stdout.write(f"workers:         {options['workers']} on {len(companies)} sequences")
+            self.stdout.write(f"block size:      {options['block_size']}")
+            self.stdout.write(f"numbers:         {len(numbers)} unique, {gaps} skipped")
+            self.stdout.write(f"elapsed:         {elapsed:.2f} s")
+            self.stdout.write(f"numbers/s:       {len(numbers) / elapsed:,.0f}")
+        finally:
+            Invoice.objects.filter(company_id__in=companies).delete()
+            Company.objects.filter(pk__in=companies).delete()
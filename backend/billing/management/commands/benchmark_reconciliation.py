@@ -0,0 +1,66 @@
+import csv
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from billing.models import Company, Invoice
+from billing.reconciliation import RECONCILE_BATCH_SIZE, read_statement, reconcile_statement
+
+
+class Command(BaseCommand):
+    help = "Generate invoices and a synthetic bank statement, and time reconciling it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=100_000)
+        parser.add_argument('--payments-per-invoice', type=int, default=2)
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE)
+        parser.add_argument('--keep', action='store_true', help="Commit the generated rows instead of rolling back")
+
+    def handle(self, *args, **options):
+        per_invoice = options['payments_per_invoice']
+        invoice_count = -(-options['payments'] // per_invoice)
+        run = time.strftime('%Y%m%d%H%M%S')
+
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with transaction.atomic():
+                company = Company.objects.create(name=f'Reconciliation benchmark {run}')
+                # Each invoice is due 100.00; payments of 50.00 split it across the statement
+                invoices = Invoice.objects.bulk_create(
+                    Invoice(
+                        company=company, invoice_number=f'REC-{run}-{n:07d}', status='sent',
+                        subtotal_amount=Decimal('100.00'), total_amount=Decimal('100.00'),
+                        balance_due=Decimal('100.00'),
+                    )
+                    for n in range(invoice_count)
+                )
+                with os.fdopen(fd, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['reference', 'amount', 'paid_at'])
+                    started_at = datetime(2025, 3, 1, tzinfo=timezone.utc)
+                    for n in range(options['payments']):
+                        paid_at = started_at + timedelta(seconds=n)
+                        writer.writerow([invoices[n % invoice_count].invoice_number, '50.00', paid_at.isoformat()])
+
+                started = time.perf_counter()
+                with open(path, newline='') as f:
+                    result = reconcile_statement(read_statement(f), batch_size=options['batch_size'])
+                elapsed = time.perf_counter() - started
+
+                paid = Invoice.objects.filter(company=company, status='paid').count()
+                if not options['keep']:
+                    transaction.set_rollback(True)
+        finally:
+            os.remove(path)
+
+        self.stdout.write(f"database:        {connection.vendor}")
+        self.stdout.write(f"invoices:        {invoice_count} ({paid} settled as paid)")
+        self.stdout.write(f"payments:        {result.matched} matched, {result.unmatched_count} unmatched")
+        self.stdout.write(f"status changes:  {result.status_changes}")
+        self.stdout.write(f"elapsed:         {elapsed:.1f} s")
+        self.stdout.write(f"payments/s:      {result.matched / elapsed:,.0f}")
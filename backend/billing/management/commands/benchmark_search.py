@@ -0,0 +1,121 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.test import APIClient
+
+from billing.models import Company, Invoice, InvoiceItem
+from billing.search import refresh_search_documents
+from user.models import User
+
+
+# English letter frequencies, so the words cluster under common prefixes like real ones
+LETTERS = 'etaoinshrdlcumwfgypbvkjxqz'
+LETTER_WEIGHTS = [127, 91, 82, 75, 70, 67, 63, 61, 60, 43, 40, 28, 28, 24, 24, 22, 20, 20, 19, 15, 10, 8, 2, 2, 1, 1]
+
+
+def _vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(LETTERS, LETTER_WEIGHTS, k=rng.randint(4, 10))))
+    return sorted(words)
+
+
+def _typo(rng, word):
+    i = rng.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+class Command(BaseCommand):
+    help = "Measure invoice search latency (prefix, multi-word and typo queries) over many line items"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=100)
+        parser.add_argument('--invoices', type=int, default=1000, help="Per tenant")
+        parser.add_argument('--items', type=int, default=50, help="Per invoice")
+        parser.add_argument('--words', type=int, default=20000, help="Vocabulary of the item descriptions")
+        parser.add_argument('--requests', type=int, default=200, help="Per query kind")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        vocabulary = _vocabulary(rng, options['words'])
+        # Everything is rolled back, so this is safe to point at a dev database
+        with transaction.atomic():
+            started = time.perf_counter()
+            owners = self._seed(rng, vocabulary, options)
+            seeded = time.perf_counter() - started
+            started = time.perf_counter()
+            last = 0
+            while True:
+                ids = list(Invoice.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:5000])
+                if not ids:
+                    break
+                refresh_search_documents(ids)
+                last = ids[-1]
+            indexed = time.perf_counter() - started
+            items = options['tenants'] * options['invoices'] * options['items']
+            self.stdout.write(
+                f"{items:,} items on {options['tenants'] * options['invoices']:,} invoices of {options['tenants']} "
+                f"tenants: seeded in {seeded:.0f} s, indexed in {indexed:.0f} s ({items / indexed:,.0f} items/s)"
+            )
+
+            long_words = [word for word in vocabulary if len(word) >= 6]
+            kinds = (
+                ('prefix', lambda: rng.choice(vocabulary)[:3]),
+                ('word', lambda: rng.choice(vocabulary)),
+                ('two words', lambda: f'{rng.choice(vocabulary)} {rng.choice(vocabulary)[:4]}'),
+                ('number', lambda: f'BS-{rng.randrange(options["invoices"])}'),
+                ('typo', lambda: _typo(rng, rng.choice(long_words))),
+            )
+            self.stdout.write(f"{'query':<10} {'hits':>6} {'p50 ms':>9} {'p99 ms':>9}")
+            for name, make_query in kinds:
+                timings, hits = [], 0
+                for _ in range(options['requests']):
+                    client = APIClient()
+                    client.force_authenticate(rng.choice(owners))
+                    query = make_query()
+                    started = time.perf_counter()
+                    response = client.get('/api/invoices/search/', {'q': query})
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{query!r} failed with {response.status_code}: {response.content[:200]}")
+                    hits += bool(response.json()['results'])
+                timings.sort()
+                self.stdout.write(
+                    f"{name:<10} {hits / len(timings):>6.0%} {timings[len(timings) // 2]:>9.2f} "
+                    f"{timings[min(len(timings) - 1, int(len(timings) * 0.99))]:>9.2f}"
+                )
+
+            transaction.set_rollback(True)
+
+    def _seed(self, rng, vocabulary, options):
+        run = time.strftime('%Y%m%d%H%M%S')
+        owners = User.objects.bulk_create(
+            User(email=f'search-{run}-{n}@example.com', name=f'Search {n}', password='!')
+            for n in range(options['tenants'])
+        )
+        for owner in owners:
+            companies = Company.objects.bulk_create(
+                Company(owner=owner, name=f'{rng.choice(vocabulary).title()} {rng.choice(vocabulary).title()}')
+                for _ in range(20)
+            )
+            invoices = Invoice.objects.bulk_create([
+                Invoice(
+                    owner=owner, company=rng.choice(companies), created_by=owner,
+                    invoice_number=f'BS-{n}-{owner.pk.hex[:8]}',
+                )
+                for n in range(options['invoices'])
+            ])
+            InvoiceItem.objects.bulk_create(
+                (
+                    InvoiceItem(
+                        invoice=invoice, description=' '.join(rng.choices(vocabulary, k=rng.randint(2, 6))),
+                        quantity=1, unit_price=Decimal('10.00'),
+                    )
+                    for invoice in invoices for _ in range(options['items'])
+                ),
+                batch_size=5000,
+            )
+        return owners
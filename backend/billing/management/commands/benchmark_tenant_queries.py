@@ -0,0 +1,105 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from billing.models import Company, Invoice
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = "Measure latency and query plans of tenant-scoped invoice list/detail requests with many tenants"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tenants', type=int, default=1000)
+        parser.add_argument('--invoices', type=int, default=50, help="Per tenant")
+        parser.add_argument('--requests', type=int, default=200, help="Per scenario")
+
+    def handle(self, *args, **options):
+        # Everything is rolled back, so this is safe to point at a dev database
+        with transaction.atomic():
+            started = time.perf_counter()
+            owners = self._seed(options['tenants'], options['invoices'])
+            self.stdout.write(
+                f"{options['tenants']} tenants x {options['invoices']} invoices "
+                f"({options['tenants'] * options['invoices']:,} rows) seeded in {time.perf_counter() - started:.1f} s"
+            )
+
+            rng = random.Random(0)
+            details = dict(Invoice.objects.values_list('owner_id', 'id').order_by('owner_id', 'id'))
+            companies = dict(Company.objects.values_list('owner_id', 'id'))
+            scenarios = (
+                ('list', lambda owner: '/api/invoices/?limit=25'),
+                ('list status', lambda owner: '/api/invoices/?status=sent&limit=25'),
+                ('list company', lambda owner: f'/api/invoices/?company={companies[owner.pk]}&limit=25'),
+                ('detail', lambda owner: f'/api/invoices/{details[owner.pk]}/'),
+            )
+            self.stdout.write(f"{'scenario':<12} {'queries':>8} {'p50 ms':>9} {'p99 ms':>9}")
+            plans = {}
+            for name, url in scenarios:
+                timings, queries = [], 0
+                for _ in range(options['requests']):
+                    owner = rng.choice(owners)
+                    client = APIClient()
+                    # A bearer token, as the async read views authenticate it themselves
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(owner)}')
+                    with CaptureQueriesContext(connection) as captured:
+                        started = time.perf_counter()
+                        response = client.get(url(owner))
+                        timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{name} failed with {response.status_code}: {response.content[:200]}")
+                    queries = len(captured)
+                    plans[name] = next(query['sql'] for query in captured if '"billing_invoice"' in query['sql'])
+                timings.sort()
+                self.stdout.write(
+                    f"{name:<12} {queries:>8} {statistics.median(timings):>9.2f} "
+                    f"{timings[min(len(timings) - 1, int(len(timings) * 0.99))]:>9.2f}"
+                )
+
+            for name, sql in plans.items():
+                self.stdout.write(f"\n{name}: {self._explain(sql)}")
+
+            transaction.set_rollback(True)
+
+    def _seed(self, tenants, per_tenant):
+        run = time.strftime('%Y%m%d%H%M%S')
+        owners = User.objects.bulk_create(
+            User(email=f'tenant-{run}-{n}@example.com', name=f'Tenant {n}', password='!') for n in range(tenants)
+        )
+        companies = Company.objects.bulk_create(
+            Company(owner=owner, name=f'Customer of {owner.name}') for owner in owners
+        )
+        today = timezone.localdate()
+        rng = random.Random(tenants)
+        statuses = [status for status, _ in Invoice.STATUS_CHOICES]
+        for offset in range(0, tenants, 100):
+            Invoice.objects.bulk_create(
+                Invoice(
+                    owner=owner, company=company, created_by=owner, invoice_number=f'TEN-{run}-{owner.pk}-{n}',
+                    status=rng.choice(statuses), issue_date=today - timedelta(days=rng.randrange(365)),
+                    due_date=today + timedelta(days=rng.randrange(-60, 60)),
+                    subtotal_amount=Decimal('100.00'), total_amount=Decimal('100.00'), balance_due=Decimal('100.00'),
+                )
+                for owner, company in zip(owners[offset:offset + 100], companies[offset:offset + 100])
+                for n in range(per_tenant)
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return owners
+
+    def _explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return '; '.join(row[-1] for row in cursor.fetchall())
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
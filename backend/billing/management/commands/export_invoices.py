@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_queryset, iter_export
+from billing.filters import filter_invoices
+
+
+FILTER_OPTIONS = [
+    'company', 'status', 'created_by',
+    'issue_date_from', 'issue_date_to', 'due_date_from', 'due_date_to',
+]
+
+
+class Command(BaseCommand):
+    help = "Stream invoices with items and payment totals to CSV or NDJSON in constant memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', help="File to write to (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        for name in FILTER_OPTIONS:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name)
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in FILTER_OPTIONS if options[name]}
+        try:
+            queryset = filter_invoices(export_queryset(), params)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        rows = iter_export(options['output_format'], queryset, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(rows)
+        else:
+            for row in rows:
+                self.stdout.write(row, ending='')
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from billing.audit import ingest_spool
+
+
+class Command(BaseCommand):
+    help = "Insert audit events left in the spool by crashed or stopped processes"
+
+    def handle(self, *args, **options):
+        inserted = ingest_spool(settings.AUDIT_LOG_SPOOL_DIR)
+        self.stdout.write(self.style.SUCCESS(f"Flushed {inserted} audit events"))
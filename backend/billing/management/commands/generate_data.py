@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.synthetic import (
+    COMPANIES_PER_SCALE, INVOICES_PER_SCALE, SYNTHETIC_PASSWORD, TENANTS_PER_SCALE, delete_synthetic_data, generate,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        f"Generate reproducible synthetic data for load tests: per unit of --scale {TENANTS_PER_SCALE} tenants, "
+        f"{COMPANIES_PER_SCALE} companies and {INVOICES_PER_SCALE} invoices with items, payments and audit logs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--replace', action='store_true', help="Delete the seed's existing data first")
+
+    def handle(self, *args, **options):
+        if options['replace']:
+            deleted = delete_synthetic_data(options['seed'])
+            self.stdout.write(f"Deleted {deleted} rows of seed {options['seed']}")
+
+        started = time.perf_counter()
+
+        def progress(result):
+            counts = result.counts
+            self.stdout.write(
+                f"  {counts['invoices']:,} invoices, {counts['items']:,} items "
+                f"({counts['invoices'] / (time.perf_counter() - started):,.0f} invoices/s)"
+            )
+
+        try:
+            result = generate(options['scale'], options['seed'], progress=progress)
+        except ValueError as e:
+            raise CommandError(f"{e} (--replace)")
+        counts = result.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {', '.join(f'{count:,} {name}' for name, count in counts.items())} "
+            f"in {time.perf_counter() - started:.1f} s; users sign in with {SYNTHETIC_PASSWORD!r}"
+        ))
@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.importer import IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_invoices, read_records
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = "Bulk import invoices with items and payments from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--input-format', choices=IMPORT_FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--user', help="Email of the user who owns and is recorded as creator of the imported invoices")
+
+    def handle(self, *args, **options):
+        import_format = options['input_format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if import_format not in IMPORT_FORMATS:
+            raise CommandError(f"Cannot infer input format from {options['path']}, pass --input-format")
+
+        user = None
+        if options['user']:
+            user = User.objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user with email {options['user']}")
+
+        with open(options['path'], newline='', encoding='utf-8-sig') as f:
+            result = import_invoices(read_records(import_format, f), user=user, batch_size=options['batch_size'])
+
+        for error in result.errors:
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} invoices with {result.error_count} errors"
+        ))
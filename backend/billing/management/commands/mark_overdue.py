@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from billing.overdue import OVERDUE_BATCH_SIZE, mark_overdue
+
+
+class Command(BaseCommand):
+    help = "Mark sent invoices past their due date as overdue, in set-based batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OVERDUE_BATCH_SIZE)
+        parser.add_argument('--today', type=parse_date, help="Sweep as of this date (YYYY-MM-DD)")
+        parser.add_argument('--interval', type=int, default=0, help="Keep running, sweeping every N seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            swept = 0
+            for count in mark_overdue(options['today'], options['batch_size']):
+                swept += count
+                self.stdout.write(f"Marked {swept} invoices overdue")
+            self.stdout.write(self.style.SUCCESS(f"Sweep done, {swept} invoices marked overdue"))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from billing.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the revenue and receivables rollups from scratch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        revenue, receivables = rebuild_rollups(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {revenue} revenue and {receivables} receivable rollup rows"
+        ))
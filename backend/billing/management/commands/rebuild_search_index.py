@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from billing.search import rebuild_search_documents
+
+
+class Command(BaseCommand):
+    help = "Rebuild every invoice's search document, and with it the full-text index"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_search_documents(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} invoice search documents"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from billing.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Backfill or repair stored invoice totals and paid balances using SQL aggregation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--start-id', type=int, default=0, help="Resume from this invoice id")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['start_id'] - 1
+        updated = 0
+
+        while True:
+            # Walk the primary key in ranges so each batch is an index range scan
+            ids = list(
+                Invoice.objects.filter(pk__gt=last_id)
+                .order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                batch = Invoice.objects.filter(pk__gte=ids[0], pk__lte=ids[-1])
+                batch.refresh_payments()
+                updated += batch.refresh_totals()
+
+            last_id = ids[-1]
+            self.stdout.write(f"Recalculated totals up to invoice {last_id}")
+
+        self.stdout.write(self.style.SUCCESS(f"Recalculated totals for {updated} invoices"))
@@ -0,0 +1,32 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.reconciliation import RECONCILE_BATCH_SIZE, read_statement, reconcile_statement
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = "Match a bank statement CSV (reference, amount, paid_at) to invoices and record the payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=RECONCILE_BATCH_SIZE)
+        parser.add_argument('--user', help="Email of the user whose invoices are matched and who is recorded on status changes")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(email=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user with email {options['user']}")
+
+        with open(options['path'], newline='', encoding='utf-8-sig') as f:
+            result = reconcile_statement(read_statement(f), user=user, batch_size=options['batch_size'])
+
+        for line in result.unmatched:
+            self.stderr.write(json.dumps(line))
+        self.stdout.write(self.style.SUCCESS(
+            f"Matched {result.matched} payments, {result.duplicates} duplicates, "
+            f"{result.unmatched_count} unmatched, {result.status_changes} status changes"
+        ))
@@ -0,0 +1,69 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Invoice
+from billing.rendering import (
+    RENDER_FORMATS, init_render_worker, prune_renders, render_context, render_digest, render_to_store, rendered_path,
+)
+
+
+class Command(BaseCommand):
+    help = "Render invoices to PDF or HTML across worker processes, skipping unchanged ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=RENDER_FORMATS, default='pdf')
+        parser.add_argument('--workers', type=int, default=max(settings.INVOICE_RENDER_WORKERS, multiprocessing.cpu_count()))
+        parser.add_argument('--batch-size', type=int, default=500, help="Invoices loaded per query")
+        parser.add_argument('--status', help="Comma separated statuses to render")
+        parser.add_argument(
+            '--prune', action='store_true', help="Afterwards delete stored renders no invoice renders to any more",
+        )
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if options['prune'] and options['status']:
+            raise CommandError("--prune needs the digests of every invoice and cannot be combined with --status")
+        invoices = Invoice.objects.for_detail().select_related('created_by').order_by('id')
+        if options['status']:
+            invoices = invoices.filter(status__in=options['status'].split(','))
+
+        started_at = time.time()
+        started = time.perf_counter()
+        rendered = skipped = 0
+        digests = set()
+        with ProcessPoolExecutor(
+            max_workers=options['workers'], mp_context=multiprocessing.get_context('spawn'), initializer=init_render_worker,
+        ) as pool:
+            last_id = 0
+            while True:
+                batch = list(invoices.filter(id__gt=last_id)[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                # Contexts are built here, so workers never touch the database
+                futures = []
+                for invoice in batch:
+                    context = render_context(invoice)
+                    digest = render_digest(context)
+                    digests.add(digest)
+                    if rendered_path(digest, output).exists():
+                        skipped += 1
+                    else:
+                        futures.append(pool.submit(render_to_store, context, output))
+                for future in as_completed(futures):
+                    future.result()
+                    rendered += 1
+                self.stdout.write(f"Rendered {rendered}, unchanged {skipped}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} invoices ({skipped} unchanged) in {elapsed:.1f} s with {options['workers']} workers"
+        ))
+        if options['prune']:
+            removed = prune_renders(output, digests, before=started_at)
+            self.stdout.write(self.style.SUCCESS(f"Pruned {removed} superseded renders"))
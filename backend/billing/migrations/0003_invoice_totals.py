@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:28
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor, batch_size=1000):
+    # The same aggregation as Invoice.objects.refresh_totals, in primary key ranges
+    Invoice = apps.get_model('billing', 'Invoice')
+    InvoiceItem = apps.get_model('billing', 'InvoiceItem')
+    items = InvoiceItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+    amount = items.annotate(
+        amount=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+    ).values('amount')
+    count = items.annotate(count=Count('pk')).values('count')
+    amount_expr = Coalesce(Subquery(amount), Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+    last_id = 0
+    while True:
+        ids = list(Invoice.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        Invoice.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(
+            subtotal_amount=amount_expr, total_amount=amount_expr, item_count=Coalesce(Subquery(count), 0),
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0002_invoice_tracking_and_audit_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='subtotal_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0005_audit_log_event_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceAuditLogArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the month the rows belong to')),
+                ('row_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='invoiceauditlog',
+            index=models.Index(fields=['invoice', '-timestamp', '-id'], name='auditlog_invoice_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceauditlog',
+            index=models.Index(fields=['timestamp', 'id'], name='auditlog_timestamp_idx'),
+        ),
+        migrations.AddField(
+            model_name='invoiceauditlogarchive',
+            name='invoice',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_audit_logs', to='billing.invoice'),
+        ),
+        migrations.AddIndex(
+            model_name='invoiceauditlogarchive',
+            index=models.Index(fields=['invoice', '-period', '-id'], name='auditarchive_invoice_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:40
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_balances(apps, schema_editor, batch_size=1000):
+    # The same aggregation as Invoice.objects.refresh_payments, in primary key ranges
+    Invoice = apps.get_model('billing', 'Invoice')
+    Payment = apps.get_model('billing', 'Payment')
+    paid = (
+        Payment.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        .annotate(paid=Sum('amount')).values('paid')
+    )
+    paid_expr = Coalesce(Subquery(paid), Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+    last_id = 0
+    while True:
+        ids = list(Invoice.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        Invoice.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(
+            amount_paid=paid_expr, balance_due=F('total_amount') - paid_expr,
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0006_audit_log_pagination_and_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='amount_paid',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='balance_due',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('sent', 'Sent'), ('partially_paid', 'Partially Paid'), ('paid', 'Paid'), ('overdue', 'Overdue'), ('cancelled', 'Cancelled')], default='draft', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='reference',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:45
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    Invoice = apps.get_model('billing', 'Invoice')
+    RevenueRollup = apps.get_model('billing', 'RevenueRollup')
+    ReceivableRollup = apps.get_model('billing', 'ReceivableRollup')
+    revenue = (
+        Invoice.objects.annotate(period=TruncMonth('issue_date')).order_by()
+        .values('company_id', 'period', 'status')
+        .annotate(
+            invoice_count=Count('id'), total_amount=Sum('total_amount'),
+            amount_paid=Sum('amount_paid'), balance_due=Sum('balance_due'),
+        )
+    )
+    RevenueRollup.objects.bulk_create((RevenueRollup(**row) for row in revenue), batch_size=1000)
+    receivables = (
+        Invoice.objects.filter(status__in=('sent', 'partially_paid', 'overdue')).order_by()
+        .values('company_id', 'due_date')
+        .annotate(invoice_count=Count('id'), balance_due=Sum('balance_due'))
+    )
+    ReceivableRollup.objects.bulk_create((ReceivableRollup(**row) for row in receivables), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0008_invoice_status_due_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivableRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField()),
+                ('invoice_count', models.PositiveIntegerField(default=0)),
+                ('balance_due', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='First day of the issue month')),
+                ('status', models.CharField(choices=[('draft', 'Draft'), ('sent', 'Sent'), ('partially_paid', 'Partially Paid'), ('paid', 'Paid'), ('overdue', 'Overdue'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('invoice_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('balance_due', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['company', 'due_date'], name='invoice_company_due_idx'),
+        ),
+        migrations.AddField(
+            model_name='receivablerollup',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='billing.company'),
+        ),
+        migrations.AddField(
+            model_name='revenuerollup',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='billing.company'),
+        ),
+        migrations.AddIndex(
+            model_name='receivablerollup',
+            index=models.Index(fields=['due_date'], name='receivable_rollup_due_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='receivablerollup',
+            constraint=models.UniqueConstraint(fields=('company', 'due_date'), name='receivable_rollup_key'),
+        ),
+        migrations.AddIndex(
+            model_name='revenuerollup',
+            index=models.Index(fields=['period'], name='revenue_rollup_period_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='revenuerollup',
+            constraint=models.UniqueConstraint(fields=('company', 'period', 'status'), name='revenue_rollup_key'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0009_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(blank=True, help_text='Year the sequence restarts in, if it does', max_length=10)),
+                ('next_value', models.PositiveBigIntegerField(default=1)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='billing.company')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('company', 'period'), name='invoice_sequence_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def assign_owners(apps, schema_editor):
+    # Invoices belong to whoever created them; a company to the earliest creator invoicing it
+    Company = apps.get_model('billing', 'Company')
+    Invoice = apps.get_model('billing', 'Invoice')
+    Invoice.objects.filter(created_by__isnull=False).update(owner=models.F('created_by'))
+    first_owner = (
+        Invoice.objects.filter(company=OuterRef('pk'), owner__isnull=False)
+        .order_by('id').values('owner')[:1]
+    )
+    Company.objects.update(owner=Subquery(first_owner))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0010_invoice_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_issue_date_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_status_issue_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_creator_issue_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_due_date_id_idx',
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='companies', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='owned_invoices', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(assign_owners, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['owner', 'tax_id'], name='company_owner_tax_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['owner', 'name'], name='company_owner_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['owner', 'issue_date', 'id'], name='invoice_owner_issue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['owner', 'status', 'issue_date', 'id'], name='invoice_owner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['owner', 'created_by', 'issue_date', 'id'], name='invoice_owner_creator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['owner', 'due_date', 'id'], name='invoice_owner_due_idx'),
+        ),
+    ]
@@ -0,0 +1,130 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:14
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+SQLITE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE billing_invoice_search USING fts5(
+        owner_id, reference, company, items,
+        content='billing_invoicesearchdocument', content_rowid='invoice_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    # Its vocabulary, for correcting misspelled terms
+    "CREATE VIRTUAL TABLE billing_invoice_search_terms USING fts5vocab(billing_invoice_search, 'row')",
+    """
+    CREATE TRIGGER billing_invoice_search_insert AFTER INSERT ON billing_invoicesearchdocument BEGIN
+        INSERT INTO billing_invoice_search(rowid, owner_id, reference, company, items)
+        VALUES (new.invoice_id, new.owner_id, new.reference, new.company, new.items);
+    END
+    """,
+    """
+    CREATE TRIGGER billing_invoice_search_delete AFTER DELETE ON billing_invoicesearchdocument BEGIN
+        INSERT INTO billing_invoice_search(billing_invoice_search, rowid, owner_id, reference, company, items)
+        VALUES ('delete', old.invoice_id, old.owner_id, old.reference, old.company, old.items);
+    END
+    """,
+    """
+    CREATE TRIGGER billing_invoice_search_update AFTER UPDATE ON billing_invoicesearchdocument BEGIN
+        INSERT INTO billing_invoice_search(billing_invoice_search, rowid, owner_id, reference, company, items)
+        VALUES ('delete', old.invoice_id, old.owner_id, old.reference, old.company, old.items);
+        INSERT INTO billing_invoice_search(rowid, owner_id, reference, company, items)
+        VALUES (new.invoice_id, new.owner_id, new.reference, new.company, new.items);
+    END
+    """,
+]
+
+POSTGRES_INDEX = [
+    # btree_gin lets the GIN indexes lead with the tenant column
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    """
+    ALTER TABLE billing_invoicesearchdocument ADD COLUMN vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', reference), 'A')
+        || setweight(to_tsvector('simple', company), 'B')
+        || setweight(to_tsvector('simple', items), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX billing_invoice_search_idx ON billing_invoicesearchdocument USING GIN (owner_id, vector)",
+    """
+    CREATE INDEX billing_invoice_search_trgm_idx ON billing_invoicesearchdocument
+    USING GIN (owner_id, (reference || ' ' || company || ' ' || items) gin_trgm_ops)
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS billing_invoice_search_terms')
+        schema_editor.execute('DROP TABLE IF EXISTS billing_invoice_search')
+    # Everything else goes with the table
+
+
+def populate_documents(apps, schema_editor):
+    Invoice = apps.get_model('billing', 'Invoice')
+    InvoiceItem = apps.get_model('billing', 'InvoiceItem')
+    Payment = apps.get_model('billing', 'Payment')
+    InvoiceSearchDocument = apps.get_model('billing', 'InvoiceSearchDocument')
+    last = 0
+    while True:
+        invoices = list(Invoice.objects.filter(pk__gt=last).order_by('pk').values_list(
+            'pk', 'owner_id', 'invoice_number', 'company__name', 'company__tax_id',
+        )[:1000])
+        if not invoices:
+            return
+        ids = [row[0] for row in invoices]
+        last = ids[-1]
+        items, references = defaultdict(list), defaultdict(dict)
+        for invoice_id, description in (
+            InvoiceItem.objects.filter(invoice_id__in=ids).order_by('invoice_id', 'id')
+            .values_list('invoice_id', 'description')
+        ):
+            items[invoice_id].append(description)
+        for invoice_id, reference in (
+            Payment.objects.filter(invoice_id__in=ids).exclude(reference__isnull=True).exclude(reference='')
+            .order_by('invoice_id', 'id').values_list('invoice_id', 'reference')
+        ):
+            references[invoice_id][reference] = None
+        InvoiceSearchDocument.objects.bulk_create(
+            InvoiceSearchDocument(
+                invoice_id=pk, owner_id=owner_id,
+                reference=' '.join([number, *references[pk]]),
+                company=' '.join(part for part in (name, tax_id) if part),
+                items='\n'.join(items[pk]),
+            )
+            for pk, owner_id, number, name, tax_id in invoices
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0011_tenant_owner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSearchDocument',
+            fields=[
+                ('invoice', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='billing.invoice')),
+                ('reference', models.TextField(blank=True, help_text='Invoice number and payment references')),
+                ('company', models.TextField(blank=True, help_text='Company name and tax id')),
+                ('items', models.TextField(blank=True, help_text='Line item descriptions, one per line')),
+                ('owner', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_documents, migrations.RunPython.noop),
+    ]
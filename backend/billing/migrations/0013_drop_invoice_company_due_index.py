@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:52
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('billing', '0012_invoice_search'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='invoice',
+            name='invoice_company_due_idx',
+        ),
+    ]
@@ -1,33 +1,189 @@
-from django.db import models
+import json
+import zlib
+from decimal import Decimal
+
+from django.db import models, transaction
 
 # Create your models here.
+from django.db.models import Count, DecimalField, F, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.conf import settings
 
 
+def default_due_date():
+    return timezone.now() + timezone.timedelta(days=7)
+
+
+class CompanyQuerySet(models.QuerySet):
+    def owned_by(self, owner):
+        """The tenant's companies; every request-facing lookup goes through this"""
+        return self.filter(owner=owner)
+
+
 class Company(models.Model):
+    # The account (tenant) the company belongs to; null only for rows predating tenancy
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True, related_name='companies',
+        db_index=False,
+    )
     name = models.CharField(max_length=255)
     tax_id = models.CharField(max_length=50, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
 
+    objects = CompanyQuerySet.as_manager()
+
+    class Meta:
+        # The importer matches a tenant's companies by tax id, or by name when there is none
+        indexes = [
+            models.Index(fields=['owner', 'tax_id'], name='company_owner_tax_id_idx'),
+            models.Index(fields=['owner', 'name'], name='company_owner_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # Invoices are found by their company's name and tax id
+        reindex = self.pk is not None and (update_fields is None or {'name', 'tax_id'}.intersection(update_fields))
+        with transaction.atomic(using=kwargs.get('using') or self._state.db):
+            if reindex:
+                stored = type(self)._base_manager.filter(pk=self.pk).values_list('name', 'tax_id').first()
+                reindex = stored != (self.name, self.tax_id)
+            super().save(*args, **kwargs)
+            if reindex:
+                Invoice.objects.filter(company=self).refresh_search()
+
+
+# Invoice values the analytics rollup rows are aggregated from, and the fields that set them
+ROLLUP_VALUES = ('company_id', 'issue_date', 'due_date', 'status', 'total_amount', 'amount_paid', 'balance_due')
+ROLLUP_FIELDS = set(ROLLUP_VALUES) | {'company'}
+
+# Invoice fields the search document is built from (besides items, payments and the company)
+SEARCH_FIELDS = {'invoice_number', 'company', 'company_id', 'owner', 'owner_id'}
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def owned_by(self, owner):
+        """The tenant's invoices; every request-facing lookup goes through this"""
+        return self.filter(owner=owner)
+
+    def rollup_rows(self):
+        """What each invoice contributes to the rollups, for billing.analytics.refresh_rollups"""
+        return list(self.order_by().values('pk', *ROLLUP_VALUES))
+
+    def update(self, **kwargs):
+        """UPDATE the invoices and refresh the analytics rollup rows and search documents they feed"""
+        from billing.analytics import refresh_rollups
+        from billing.search import refresh_search_documents
+
+        rollups = ROLLUP_FIELDS & kwargs.keys()
+        if not (rollups or SEARCH_FIELDS & kwargs.keys()):
+            # updated_at bumps and the like feed neither
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            before = self.rollup_rows() if rollups else []
+            ids = [row['pk'] for row in before] if rollups else list(self.values_list('pk', flat=True))
+            updated = super().update(**kwargs)
+            if rollups:
+                refresh_rollups(before, Invoice.objects.filter(pk__in=ids).rollup_rows())
+            if SEARCH_FIELDS & kwargs.keys():
+                refresh_search_documents(ids)
+        return updated
+
+    def delete(self):
+        from billing.analytics import refresh_rollups
+
+        with transaction.atomic(using=self.db):
+            before = self.rollup_rows()
+            deleted = super().delete()
+            refresh_rollups(before, [])
+        return deleted
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from billing.analytics import refresh_rollups
+        from billing.search import refresh_search_documents
+
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            ids = [obj.pk for obj in objs]
+            refresh_rollups([], Invoice.objects.filter(pk__in=ids).rollup_rows())
+            refresh_search_documents(ids)
+        return objs
+
+    def refresh_search(self):
+        """Rebuild the search documents of the invoices, see billing.search"""
+        from billing.search import refresh_search_documents
+
+        return refresh_search_documents(self.values_list('pk', flat=True))
+
+    def for_list(self):
+        """Everything InvoiceListSerializer reads, in one query"""
+        return self.select_related('company')
+
+    def for_detail(self):
+        """Everything InvoiceSerializer reads: company joined, items in one extra query"""
+        return self.for_list().prefetch_related(
+            Prefetch('items', queryset=InvoiceItem.objects.order_by('id'))
+        )
+
+    def refresh_totals(self):
+        """Recompute stored totals from items with a single UPDATE, marking the invoices changed and reindexing them"""
+        items = InvoiceItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        amount = items.annotate(
+            amount=Sum(F('quantity') * F('unit_price'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        ).values('amount')
+        count = items.annotate(count=Count('pk')).values('count')
+        amount_expr = Coalesce(Subquery(amount), Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        with transaction.atomic(using=self.db):
+            updated = self.update(
+                subtotal_amount=amount_expr,
+                total_amount=amount_expr,
+                balance_due=amount_expr - F('amount_paid'),
+                item_count=Coalesce(Subquery(count), 0),
+                updated_at=timezone.now(),
+            )
+            self.refresh_search()
+        return updated
+
+    def refresh_payments(self):
+        """Recompute stored amount paid and balance from payments with a single UPDATE, reindexing the invoices"""
+        paid = (
+            Payment.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+            .annotate(paid=Sum('amount')).values('paid')
+        )
+        paid_expr = Coalesce(Subquery(paid), Decimal('0.00'), output_field=DecimalField(max_digits=12, decimal_places=2))
+        with transaction.atomic(using=self.db):
+            updated = self.update(
+                amount_paid=paid_expr,
+                balance_due=F('total_amount') - paid_expr,
+                updated_at=timezone.now(),
+            )
+            self.refresh_search()
+        return updated
+
 
 class Invoice(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
         ('sent', 'Sent'),
+        ('partially_paid', 'Partially Paid'),
         ('paid', 'Paid'),
         ('overdue', 'Overdue'),
         ('cancelled', 'Cancelled'),
     ]
 
+    # The tenant, stored on the invoice itself so tenant filters and indexes need no join
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True, related_name='owned_invoices',
+        db_index=False,
+    )
     company = models.ForeignKey(Company, on_delete=models.PROTECT, related_name="invoices")
     invoice_number = models.CharField(max_length=50, unique=True)
     issue_date = models.DateField(default=timezone.now)
-    due_date = models.DateField(default=lambda: timezone.now() + timezone.timedelta(days=7))
+    due_date = models.DateField(default=default_due_date)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="draft")
     
     # Additional fields with null=True for backwards compatibility
@@ -35,18 +191,84 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True, null=True, blank=True)
 
+    # Denormalized from items, kept in sync by InvoiceItem writes and refresh_totals()
+    subtotal_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    item_count = models.PositiveIntegerField(default=0)
+
+    # Denormalized from payments, kept in sync by Payment writes and refresh_payments()
+    amount_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    balance_due = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+
+    objects = InvoiceQuerySet.as_manager()
+
+    class Meta:
+        # Back the list endpoint's filters and its (issue_date, id) keyset ordering. Every
+        # request is scoped to one owner, so its indexes lead with the tenant column and a
+        # tenant's page stays a short range scan however many tenants share the table.
+        indexes = [
+            models.Index(fields=['owner', 'issue_date', 'id'], name='invoice_owner_issue_idx'),
+            models.Index(fields=['owner', 'status', 'issue_date', 'id'], name='invoice_owner_status_idx'),
+            models.Index(fields=['owner', 'created_by', 'issue_date', 'id'], name='invoice_owner_creator_idx'),
+            models.Index(fields=['owner', 'due_date', 'id'], name='invoice_owner_due_idx'),
+            # The company filter (a company has one owner)
+            models.Index(fields=['company', 'issue_date', 'id'], name='invoice_company_issue_idx'),
+            # The overdue sweep: status='sent' AND due_date < today
+            models.Index(fields=['status', 'due_date', 'id'], name='invoice_status_due_idx'),
+        ]
+
     def __str__(self):
         return f"Invoice {self.invoice_number}"
 
-    @property
-    def total_amount(self):
-        return sum(item.total for item in self.items.all())
+    def save(self, *args, **kwargs):
+        from billing.analytics import refresh_rollups
+        from billing.search import refresh_search_documents
+
+        update_fields = kwargs.get('update_fields')
+        rollups = update_fields is None or ROLLUP_FIELDS.intersection(update_fields)
+        search = update_fields is None or SEARCH_FIELDS.intersection(update_fields)
+        if not (rollups or search):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            before = Invoice.objects.filter(pk=self.pk).rollup_rows() if self.pk and rollups else []
+            super().save(*args, **kwargs)
+            if rollups:
+                # Read back rather than taken from self, whose values may be unsaved strings
+                refresh_rollups(before, Invoice.objects.filter(pk=self.pk).rollup_rows())
+            if search:
+                refresh_search_documents([self.pk])
+
+    def delete(self, *args, **kwargs):
+        from billing.analytics import refresh_rollups
+
+        with transaction.atomic():
+            before = Invoice.objects.filter(pk=self.pk).rollup_rows()
+            result = super().delete(*args, **kwargs)
+            refresh_rollups(before, [])
+        return result
+
+    def refresh_totals(self):
+        """Recompute stored totals and reload them onto this instance"""
+        Invoice.objects.filter(pk=self.pk).refresh_totals()
+        self.refresh_from_db(fields=['subtotal_amount', 'total_amount', 'balance_due', 'item_count', 'updated_at'])
     
     def can_edit(self):
         """Only draft invoices can be edited"""
         return self.status == 'draft'
 
 
+class InvoiceSequence(models.Model):
+    """Next invoice number per company and period, handed out by billing.numbering"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='+')
+    period = models.CharField(max_length=10, blank=True, help_text="Year the sequence restarts in, if it does")
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'period'], name='invoice_sequence_key'),
+        ]
+
+
 class InvoiceItem(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="items")
     description = models.CharField(max_length=255)
@@ -57,6 +279,23 @@ class InvoiceItem(models.Model):
     def total(self):
         return self.quantity * self.unit_price
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Invoice.objects.filter(pk=self.invoice_id).refresh_totals()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Invoice.objects.filter(pk=self.invoice_id).refresh_totals()
+        return result
+
+
+class InvoiceAuditLogQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Join the acting user so InvoiceAuditLogSerializer does not query per row"""
+        return self.select_related('user')
+
 
 class InvoiceAuditLog(models.Model):
     """Tracks all changes made to invoices"""
@@ -72,28 +311,125 @@ class InvoiceAuditLog(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='audit_logs')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     action = models.CharField(max_length=20, choices=ACTION_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # When the change happened, which can be earlier than when the row was flushed
+    timestamp = models.DateTimeField(default=timezone.now)
     
-    # Store changes as JSON
+    # Store changes as JSON; new rows only keep the diff in `changes` and
+    # full before/after views are rebuilt on read (see billing.audit)
     changes = models.JSONField(default=dict, blank=True)
     old_values = models.JSONField(default=dict, blank=True)
     new_values = models.JSONField(default=dict, blank=True)
     
+    # Set by the audit pipeline so replaying a spool segment never inserts twice
+    event_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)
+    
     # Optional description
     description = models.TextField(blank=True)
     
+    objects = InvoiceAuditLogQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Per-invoice newest-first pages, and the retention scan by age
+            models.Index(fields=['invoice', '-timestamp', '-id'], name='auditlog_invoice_ts_idx'),
+            models.Index(fields=['timestamp', 'id'], name='auditlog_timestamp_idx'),
+        ]
     
     def __str__(self):
         return f"{self.action} on {self.invoice.invoice_number} by {self.user} at {self.timestamp}"
 
 
+class InvoiceAuditLogArchive(models.Model):
+    """
+    Audit rows past retention, one zlib-compressed JSON chunk per invoice and month.
+
+    Rows are stored in InvoiceAuditLogSerializer's output shape (plus user_id), so they
+    can be served on demand without the users they reference.
+    """
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='archived_audit_logs')
+    period = models.DateField(help_text="First day of the month the rows belong to")
+    row_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['invoice', '-period', '-id'], name='auditarchive_invoice_idx'),
+        ]
+
+    def rows(self):
+        return json.loads(zlib.decompress(self.data))
+
+
+class RevenueRollup(models.Model):
+    """Invoice amounts per company, issue month and status, maintained by billing.analytics"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='+')
+    period = models.DateField(help_text="First day of the issue month")
+    status = models.CharField(max_length=20, choices=Invoice.STATUS_CHOICES)
+    invoice_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    amount_paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    balance_due = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'period', 'status'], name='revenue_rollup_key'),
+        ]
+        indexes = [
+            models.Index(fields=['period'], name='revenue_rollup_period_idx'),
+        ]
+
+
+class ReceivableRollup(models.Model):
+    """Outstanding balance of open invoices per company and due date, maintained by billing.analytics"""
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='+')
+    due_date = models.DateField()
+    invoice_count = models.PositiveIntegerField(default=0)
+    balance_due = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'due_date'], name='receivable_rollup_key'),
+        ]
+        indexes = [
+            models.Index(fields=['due_date'], name='receivable_rollup_due_idx'),
+        ]
+
+
 class Payment(models.Model):
     invoice = models.ForeignKey(Invoice, on_delete=models.PROTECT, related_name="payments")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     paid_at = models.DateTimeField(default=timezone.now)
-    reference = models.CharField(max_length=100, blank=True, null=True)
+    reference = models.CharField(max_length=100, blank=True, null=True, db_index=True)
 
     def __str__(self):
         return f"Payment {self.amount} for {self.invoice.invoice_number}"
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Invoice.objects.filter(pk=self.invoice_id).refresh_payments()
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            Invoice.objects.filter(pk=self.invoice_id).refresh_payments()
+        return result
+
+
+class InvoiceSearchDocument(models.Model):
+    """
+    The searchable text of one invoice, maintained by billing.search.
+
+    The full-text index over it is database specific and created in migration 0012:
+    an FTS5 table kept in sync by triggers on SQLite, a weighted tsvector column with
+    GIN and trigram indexes on PostgreSQL.
+    """
+    invoice = models.OneToOneField(Invoice, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.PROTECT, null=True, blank=True, related_name='+', db_index=False,
+    )
+    reference = models.TextField(blank=True, help_text="Invoice number and payment references")
+    company = models.TextField(blank=True, help_text="Company name and tax id")
+    items = models.TextField(blank=True, help_text="Line item descriptions, one per line")
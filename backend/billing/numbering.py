@@ -0,0 +1,108 @@
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from billing.models import Invoice, InvoiceSequence
+
+
+def reserve_sequence(company_id, period, count=1):
+    """
+    Advance a company's sequence by `count` and return the first reserved value.
+
+    The UPDATE takes the row lock and holds it until the surrounding transaction ends,
+    so when that transaction also inserts the invoices, numbers are gap-free: a
+    rollback returns them to the sequence.
+    """
+    with transaction.atomic():
+        sequences = InvoiceSequence.objects.filter(company_id=company_id, period=period)
+        if not sequences.update(next_value=F('next_value') + count):
+            try:
+                with transaction.atomic():
+                    InvoiceSequence.objects.create(company_id=company_id, period=period, next_value=count + 1)
+                return 1
+            except IntegrityError:
+                # Another worker created the sequence first; it is there to update now
+                sequences.update(next_value=F('next_value') + count)
+        return sequences.values_list('next_value', flat=True).get() - count
+
+
+class SequenceBlocks:
+    """
+    Hands out sequence values from blocks reserved `block_size` at a time.
+
+    Workers only touch the sequence row once per block, so they do not queue on it,
+    but values left in a block when the process exits are never used. A new block
+    is only reused once the transaction that reserved it commits, so a rollback can
+    never hand out its values twice.
+    """
+
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def take(self, company_id, period, count=1):
+        key = (company_id, period)
+        with self._lock:
+            blocks = self._blocks.setdefault(key, [])
+            while blocks:
+                start, end = blocks[0]
+                if end - start >= count:
+                    blocks[0] = (start + count, end)
+                    return start
+                blocks.pop(0)
+
+        size = max(self.block_size, count)
+        start = reserve_sequence(company_id, period, size)
+        if size > count:
+            transaction.on_commit(lambda: self._keep(key, start + count, start + size))
+        return start
+
+    def _keep(self, key, start, end):
+        with self._lock:
+            self._blocks.setdefault(key, []).append((start, end))
+
+
+_blocks = None
+_blocks_lock = threading.Lock()
+
+
+def get_blocks():
+    global _blocks
+    with _blocks_lock:
+        if _blocks is None or _blocks.block_size != settings.INVOICE_NUMBER_BLOCK_SIZE:
+            _blocks = SequenceBlocks(settings.INVOICE_NUMBER_BLOCK_SIZE)
+        return _blocks
+
+
+def allocate_invoice_numbers(company_id, count=1, issue_date=None):
+    """
+    Allocate `count` invoice numbers for a company in INVOICE_NUMBER_FORMAT.
+
+    Sequences restart every year when the format uses {year}. Call this in the
+    transaction that creates the invoices: with INVOICE_NUMBER_BLOCK_SIZE of 1 the
+    numbers are then gap-free, larger block sizes trade gaps for throughput. Numbers
+    an invoice already has (given by a client or imported) are skipped, so the
+    numbers are consecutive unless one was taken that way.
+    """
+    number_format = settings.INVOICE_NUMBER_FORMAT
+    issue_date = Invoice._meta.get_field('issue_date').to_python(issue_date) or timezone.localdate()
+    period = str(issue_date.year) if '{year}' in number_format else ''
+
+    numbers = []
+    while len(numbers) < count:
+        missing = count - len(numbers)
+        if settings.INVOICE_NUMBER_BLOCK_SIZE > 1:
+            start = get_blocks().take(company_id, period, missing)
+        else:
+            start = reserve_sequence(company_id, period, missing)
+        candidates = [
+            number_format.format(company=company_id, year=issue_date.year, seq=seq)
+            for seq in range(start, start + missing)
+        ]
+        taken = set(Invoice.objects.filter(invoice_number__in=candidates).values_list('invoice_number', flat=True))
+        numbers += [number for number in candidates if number not in taken]
+    return numbers
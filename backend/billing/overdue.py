@@ -0,0 +1,72 @@
+import logging
+import threading
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from billing.audit import audit_event, record_audit_events
+from billing.models import Invoice
+
+
+logger = logging.getLogger(__name__)
+
+OVERDUE_BATCH_SIZE = 1000
+
+
+def mark_overdue(today=None, batch_size=OVERDUE_BATCH_SIZE):
+    """
+    Mark 'sent' invoices whose due date is before `today` as 'overdue'.
+
+    Works through the (status, due_date) index one batch at a time, each batch a
+    short transaction of one locking SELECT, one UPDATE and a bulk insert of
+    'status_changed' audit rows. Swept invoices drop out of the predicate, so the
+    sweep is idempotent and an interrupted run resumes where it stopped. Rows locked
+    by a concurrent sweep are skipped. Yields the number of invoices per batch.
+    """
+    today = today or timezone.localdate()
+    while True:
+        with transaction.atomic():
+            ids = list(
+                Invoice.objects.select_for_update(skip_locked=True)
+                .filter(status='sent', due_date__lt=today)
+                .order_by('status', 'due_date', 'id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                return
+            Invoice.objects.filter(id__in=ids).update(status='overdue', updated_at=timezone.now())
+            record_audit_events([
+                audit_event(invoice_id, None, 'status_changed', {'status': {'old': 'sent', 'new': 'overdue'}},
+                            "Marked overdue past due date")
+                for invoice_id in ids
+            ])
+        yield len(ids)
+
+
+class OverdueScheduler:
+    """Background thread that runs mark_overdue every `interval` seconds"""
+
+    def __init__(self, interval, batch_size=OVERDUE_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='overdue-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                swept = sum(mark_overdue(batch_size=self.batch_size))
+                if swept:
+                    logger.info("Marked %d invoices overdue", swept)
+            except Exception:
+                logger.exception("Overdue sweep failed")
+            finally:
+                close_old_connections()
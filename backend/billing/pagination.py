@@ -0,0 +1,114 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(ordering, values):
+    """Pack the sort key of the last row into an opaque url-safe token"""
+    payload = json.dumps({'o': ordering, 'v': values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, ordering):
+    """Unpack a cursor token, rejecting tampered tokens or ones issued for another ordering"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or payload.get('o') != ordering:
+        raise ValueError("Invalid cursor")
+    values = payload.get('v')
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return min(limit, maximum)
+
+
+def _keyset_filter(model, ordering, values):
+    """Build the "rows after this key" predicate for a (possibly mixed direction) ordering"""
+    condition = Q()
+    equal = {}
+    for term, raw in zip(ordering, values):
+        name = term.lstrip('-')
+        try:
+            value = model._meta.get_field(name).to_python(raw)
+        except (ValidationError, TypeError, ValueError):
+            # Tampered values of the wrong type, as well as unparseable strings
+            raise ValueError("Invalid cursor")
+        lookup = 'lt' if term.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def _page_queryset(queryset, ordering, cursor, limit):
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_keyset_filter(queryset.model, ordering, decode_cursor(cursor, ordering)))
+    return queryset[:limit + 1]
+
+
+def _page(model, ordering, rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        values = []
+        for term in ordering:
+            field = model._meta.get_field(term.lstrip('-'))
+            values.append(field.value_to_string(last))
+        next_cursor = encode_cursor(ordering, values)
+    return rows, next_cursor
+
+
+def paginate_keyset(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return one page of `queryset` and the cursor for the next one.
+
+    `ordering` is a list of concrete field names (optionally prefixed with '-')
+    whose last entry must be unique, so every row has a distinct sort key.
+    Seeking from the cursor keeps each page an index range scan no matter how deep it is.
+    """
+    rows = list(_page_queryset(queryset, ordering, cursor, limit))
+    return _page(queryset.model, ordering, rows, limit)
+
+
+async def apaginate_keyset(queryset, ordering, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """paginate_keyset with the async ORM"""
+    rows = [row async for row in _page_queryset(queryset, ordering, cursor, limit)]
+    return _page(queryset.model, ordering, rows, limit)
+
+
+# Ranked results have no stable sort key to seek from, so their cursors hold an offset
+RANK_ORDERING = ['rank']
+
+
+def encode_offset_cursor(offset):
+    return encode_cursor(RANK_ORDERING, [offset])
+
+
+def decode_offset_cursor(token):
+    if not token:
+        return 0
+    offset = decode_cursor(token, RANK_ORDERING)[0]
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
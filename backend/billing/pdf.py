@@ -0,0 +1,80 @@
+import zlib
+
+
+# A4 in points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+# Helvetica advance widths (1/1000 em) for the characters amounts are made of
+_WIDTHS = {**{digit: 556 for digit in '0123456789'}, '.': 278, ',': 278, '-': 333, ' ': 278}
+_DEFAULT_WIDTH = 556
+
+
+def _escape(text):
+    text = str(text).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    return ' '.join(text.splitlines())
+
+
+def text_width(text, size):
+    """Approximate width of `text` in points; exact for digits and separators"""
+    return sum(_WIDTHS.get(char, _DEFAULT_WIDTH) for char in str(text)) * size / 1000
+
+
+class PdfDocument:
+    """
+    Just enough of PDF 1.4 to lay out text and rules on A4 pages.
+
+    Uses the standard Helvetica fonts with WinAnsi encoding, so no font files are
+    embedded and the output stays a few KB; characters outside Windows-1252 print
+    as '?'.
+    """
+
+    def __init__(self):
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        self._ops = []
+        self.pages.append(self._ops)
+
+    def text(self, x, y, text, size=10, bold=False):
+        font = 'F2' if bold else 'F1'
+        self._ops.append(f'BT /{font} {size} Tf {x:.2f} {y:.2f} Td ({_escape(text)}) Tj ET')
+
+    def text_right(self, x, y, text, size=10, bold=False):
+        self.text(x - text_width(text, size), y, text, size, bold)
+
+    def rule(self, x1, y1, x2, y2, width=0.5):
+        self._ops.append(f'{width} w {x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S')
+
+    def render(self):
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            None,  # The page tree, once the page object numbers are known
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+        ]
+        kids = []
+        for ops in self.pages:
+            stream = zlib.compress('\n'.join(ops).encode('cp1252', errors='replace'))
+            objects.append(
+                b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream'
+            )
+            objects.append(
+                b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R '
+                b'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> >>'
+                % (PAGE_WIDTH, PAGE_HEIGHT, len(objects))
+            )
+            kids.append(b'%d 0 R' % len(objects))
+        objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), len(kids))
+
+        output = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(output))
+            output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(output)
+        output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return bytes(output)
@@ -0,0 +1,181 @@
+import csv
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from billing.audit import audit_event, record_audit_events
+from billing.models import Invoice, Payment
+
+
+RECONCILE_BATCH_SIZE = 5000
+
+# Statuses a payment can move an invoice out of; drafts and cancelled invoices are left alone
+PAYABLE_STATUSES = ('sent', 'overdue', 'partially_paid')
+
+# Unmatched lines beyond this are counted but not listed
+MAX_REPORTED_UNMATCHED = 1000
+
+
+def settle_invoices(invoice_ids, user=None):
+    """
+    Refresh paid amounts for the invoices and apply payment status transitions.
+
+    Fully paid invoices become 'paid' and partly paid 'sent'/'overdue' invoices become
+    'partially_paid', each with one set-based UPDATE and a 'status_changed' audit
+    event. Returns the number of invoices whose status changed.
+    """
+    invoices = Invoice.objects.filter(pk__in=invoice_ids)
+    transitions = [
+        ('paid', Q(status__in=PAYABLE_STATUSES, balance_due__lte=0, total_amount__gt=0)),
+        ('partially_paid', Q(status__in=('sent', 'overdue'), amount_paid__gt=0, balance_due__gt=0)),
+    ]
+    events = []
+    with transaction.atomic():
+        invoices.refresh_payments()
+        for status, condition in transitions:
+            changed = list(invoices.filter(condition).values_list('id', 'status'))
+            if not changed:
+                continue
+            invoices.filter(id__in=[invoice_id for invoice_id, _ in changed]).update(
+                status=status, updated_at=timezone.now()
+            )
+            events.extend(
+                audit_event(invoice_id, user, 'status_changed', {'status': {'old': old, 'new': status}},
+                            "Status changed by payment reconciliation")
+                for invoice_id, old in changed
+            )
+        record_audit_events(events)
+    return len(events)
+
+
+class ReconciliationResult:
+    def __init__(self):
+        self.matched = 0
+        self.duplicates = 0
+        self.unmatched_count = 0
+        self.unmatched = []
+        self.status_changes = 0
+
+    def add_unmatched(self, line, reference, message):
+        self.unmatched_count += 1
+        if len(self.unmatched) < MAX_REPORTED_UNMATCHED:
+            self.unmatched.append({'line': line, 'reference': reference, 'error': message})
+
+    def as_dict(self):
+        return {
+            'matched': self.matched,
+            'duplicates': self.duplicates,
+            'unmatched_count': self.unmatched_count,
+            'unmatched': self.unmatched,
+            'status_changes': self.status_changes,
+        }
+
+
+def read_statement(lines):
+    """
+    Yield (line number, reference, amount, paid_at) from a bank statement CSV.
+
+    The statement needs `reference` (the invoice number the payer quoted), `amount`
+    and `paid_at` (an ISO date or datetime) columns; the three identify a line when
+    the statement is imported again. Unparseable lines are yielded with a ValueError
+    in place of the amount.
+    """
+    amount_field = Payment._meta.get_field('amount')
+    amount_limit = 10 ** (amount_field.max_digits - amount_field.decimal_places)
+    reader = csv.DictReader(lines)
+    for row in reader:
+        reference = (row.get('reference') or '').strip()
+        try:
+            amount = Decimal(str(row.get('amount') or '').strip())
+        except InvalidOperation:
+            yield reader.line_num, reference, ValueError("amount must be a number"), None
+            continue
+        if not amount.is_finite() or abs(amount) >= amount_limit:
+            yield reader.line_num, reference, ValueError(f"amount must be a number below {amount_limit}"), None
+            continue
+
+        raw = (row.get('paid_at') or '').strip()
+        if not raw:
+            yield reader.line_num, reference, ValueError("paid_at is required"), None
+            continue
+        paid_at = parse_datetime(raw)
+        if paid_at is None:
+            day = parse_date(raw)
+            if day is None:
+                yield reader.line_num, reference, ValueError("paid_at must be an ISO date"), None
+                continue
+            paid_at = datetime.combine(day, time.min)
+        if timezone.is_naive(paid_at):
+            paid_at = timezone.make_aware(paid_at)
+        yield reader.line_num, reference, amount, paid_at
+
+
+def _reconcile_batch(lines, user, result):
+    references = {reference for _, reference, _, _ in lines if reference}
+    candidates = Invoice.objects.all() if user is None else Invoice.objects.owned_by(user)
+    invoices = {
+        number: (invoice_id, status)
+        for number, invoice_id, status in
+        candidates.filter(invoice_number__in=references).values_list('invoice_number', 'id', 'status')
+    }
+    # Lines already imported by an earlier run of the same statement
+    existing = set(
+        Payment.objects.filter(reference__in=references, invoice_id__in=[pk for pk, _ in invoices.values()])
+        .values_list('reference', 'amount', 'paid_at')
+    )
+
+    payments = []
+    for line, reference, amount, paid_at in lines:
+        if isinstance(amount, ValueError):
+            result.add_unmatched(line, reference, str(amount))
+            continue
+        if amount <= 0:
+            result.add_unmatched(line, reference, "amount must be positive")
+            continue
+        if reference not in invoices:
+            result.add_unmatched(line, reference, "No invoice with this number")
+            continue
+        key = (reference, amount, paid_at)
+        if key in existing:
+            result.duplicates += 1
+            continue
+        invoice_id, status = invoices[reference]
+        if status not in PAYABLE_STATUSES:
+            result.add_unmatched(line, reference, f"Cannot record payments on a {status} invoice")
+            continue
+        existing.add(key)
+        payments.append(Payment(invoice_id=invoice_id, amount=amount, paid_at=paid_at, reference=reference))
+
+    if not payments:
+        return
+    with transaction.atomic():
+        Payment.objects.bulk_create(payments)
+        result.status_changes += settle_invoices({payment.invoice_id for payment in payments}, user=user)
+    result.matched += len(payments)
+
+
+def reconcile_statement(lines, user=None, batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Match statement lines to invoices by reference and record them as payments.
+
+    With a user, only that user's invoices are matched; without one (operator runs
+    from the command line) every invoice is.
+
+    Works in batches: one invoice lookup and one duplicate check per batch, payments
+    written with bulk_create, balances and statuses settled set-based. Re-running the
+    same statement skips lines already recorded.
+    """
+    result = ReconciliationResult()
+    batch = []
+    for entry in lines:
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            _reconcile_batch(batch, user, result)
+            batch = []
+    if batch:
+        _reconcile_batch(batch, user, result)
+    return result
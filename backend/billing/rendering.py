@@ -0,0 +1,254 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import textwrap
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.template.loader import render_to_string
+
+from billing.pdf import PAGE_HEIGHT, PAGE_WIDTH, PdfDocument
+
+
+RENDER_FORMATS = {
+    'pdf': 'application/pdf',
+    'html': 'text/html; charset=utf-8',
+}
+
+# Part of every digest; bump it when the layout or template changes to re-render everything
+RENDER_VERSION = 1
+
+ISSUER_FIELDS = (
+    'business_name', 'vat_number', 'registration_number', 'address', 'city', 'postal_code', 'country', 'phone',
+)
+
+
+def render_context(invoice):
+    """
+    Everything a rendered invoice shows, as plain JSON-serializable data.
+
+    Expects the invoice loaded with for_detail() and created_by joined. The digest of
+    this dict addresses the rendered file, so it must hold exactly what is printed.
+    """
+    issuer = None
+    if invoice.created_by is not None:
+        user = invoice.created_by
+        issuer = {field: getattr(user, field) or '' for field in ISSUER_FIELDS}
+        issuer['business_name'] = issuer['business_name'] or user.name or user.email
+        issuer['email'] = user.email
+
+    return {
+        'version': RENDER_VERSION,
+        'invoice': {
+            'invoice_number': invoice.invoice_number,
+            'issue_date': str(invoice.issue_date),
+            'due_date': str(invoice.due_date),
+            'status': invoice.get_status_display(),
+            'subtotal_amount': str(invoice.subtotal_amount),
+            'total_amount': str(invoice.total_amount),
+            'amount_paid': str(invoice.amount_paid),
+            'balance_due': str(invoice.balance_due),
+        },
+        'company': {
+            'name': invoice.company.name,
+            'tax_id': invoice.company.tax_id or '',
+            'address': invoice.company.address or '',
+        },
+        'issuer': issuer,
+        'items': [
+            {
+                'description': item.description,
+                'quantity': item.quantity,
+                'unit_price': str(item.unit_price),
+                'total': str(item.total),
+            }
+            for item in invoice.items.all()
+        ],
+    }
+
+
+def render_digest(context):
+    return hashlib.sha256(json.dumps(context, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def rendered_path(digest, output):
+    return Path(settings.INVOICE_RENDER_DIR) / digest[:2] / f'{digest}.{output}'
+
+
+def _address_lines(party):
+    lines = [line for line in (party.get('address') or '').splitlines() if line.strip()]
+    city = ' '.join(part for part in (party.get('postal_code'), party.get('city')) if part)
+    return lines + [line for line in (city, party.get('country')) if line]
+
+
+def render_pdf(context):
+    margin = 50
+    right = PAGE_WIDTH - margin
+    columns = (margin, 340, 430, right)  # description, quantity, unit price, total (right aligned)
+    doc = PdfDocument()
+    invoice, company, issuer = context['invoice'], context['company'], context['issuer']
+
+    doc.text(margin, PAGE_HEIGHT - 70, "INVOICE", size=22, bold=True)
+    y = PAGE_HEIGHT - 70
+    for label, value in (
+        ("Invoice number", invoice['invoice_number']), ("Issue date", invoice['issue_date']),
+        ("Due date", invoice['due_date']), ("Status", invoice['status']),
+    ):
+        doc.text(PAGE_WIDTH / 2, y, label)
+        doc.text_right(right, y, value, bold=True)
+        y -= 14
+
+    y = PAGE_HEIGHT - 160
+    parties = []
+    if issuer:
+        parties.append((margin, "From", [issuer['business_name'], *_address_lines(issuer)] + [
+            f"{label}: {issuer[field]}" for label, field in (
+                ("VAT", 'vat_number'), ("Reg. no.", 'registration_number'), ("Phone", 'phone'), ("Email", 'email'),
+            ) if issuer[field]
+        ]))
+    parties.append((PAGE_WIDTH / 2, "Bill to", [company['name'], *_address_lines(company)] + (
+        [f"Tax ID: {company['tax_id']}"] if company['tax_id'] else []
+    )))
+    lowest = y
+    for x, title, lines in parties:
+        doc.text(x, y, title, size=9, bold=True)
+        line_y = y - 14
+        for line in lines:
+            doc.text(x, line_y, line)
+            line_y -= 13
+        lowest = min(lowest, line_y)
+
+    def table_header(y):
+        doc.text(columns[0], y, "Description", bold=True)
+        doc.text_right(columns[1] + 40, y, "Qty", bold=True)
+        doc.text_right(columns[2] + 60, y, "Unit price", bold=True)
+        doc.text_right(columns[3], y, "Total", bold=True)
+        doc.rule(margin, y - 5, right, y - 5)
+        return y - 20
+
+    y = table_header(lowest - 20)
+    for item in context['items']:
+        lines = textwrap.wrap(item['description'], 48) or ['']
+        if y - 13 * len(lines) < margin + 90:
+            doc.new_page()
+            y = table_header(PAGE_HEIGHT - margin)
+        doc.text_right(columns[1] + 40, y, item['quantity'])
+        doc.text_right(columns[2] + 60, y, item['unit_price'])
+        doc.text_right(columns[3], y, item['total'])
+        for line in lines:
+            doc.text(columns[0], y, line)
+            y -= 13
+        y -= 4
+
+    if y < margin + 90:
+        doc.new_page()
+        y = PAGE_HEIGHT - margin
+    doc.rule(columns[2], y + 6, right, y + 6)
+    y -= 10
+    for label, field, bold in (
+        ("Subtotal", 'subtotal_amount', False), ("Total", 'total_amount', True),
+        ("Paid", 'amount_paid', False), ("Balance due", 'balance_due', True),
+    ):
+        doc.text_right(columns[2] + 60, y, label, bold=bold)
+        doc.text_right(right, y, invoice[field], bold=bold)
+        y -= 15
+    return doc.render()
+
+
+def render_html(context):
+    return render_to_string('billing/invoice.html', context).encode()
+
+
+def render_document(context, output):
+    return render_pdf(context) if output == 'pdf' else render_html(context)
+
+
+def render_to_store(context, output):
+    """Render and store the document unless a file with the same digest exists; returns the digest"""
+    digest = render_digest(context)
+    path = rendered_path(digest, output)
+    if path.exists():
+        return digest
+    content = render_document(context, output)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so readers never see a partial file
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.render-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+    return digest
+
+
+def prune_renders(output, keep, before):
+    """
+    Delete stored `output` renders whose digest is not in `keep`, returning the count.
+
+    Every edit of an invoice renders to a new digest and leaves the old file behind.
+    Files modified at or after the `before` timestamp are kept, so documents rendered
+    on demand while the digests were being collected survive.
+    """
+    root = Path(settings.INVOICE_RENDER_DIR)
+    if not root.exists():
+        return 0
+    removed = 0
+    for path in root.glob(f'*/*.{output}'):
+        try:
+            if path.stem in keep or path.stat().st_mtime >= before:
+                continue
+            path.unlink()
+        except FileNotFoundError:
+            continue  # Pruned by a concurrent run
+        removed += 1
+    return removed
+
+
+def init_render_worker():
+    import django
+    django.setup()
+
+
+_pool = None
+_inflight = {}
+_lock = threading.Lock()
+
+
+def get_render_pool(workers=None):
+    global _pool
+    with _lock:
+        if _pool is None:
+            # Spawned rather than forked: forking a threaded server process can deadlock
+            _pool = ProcessPoolExecutor(
+                max_workers=workers or settings.INVOICE_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_render_worker,
+            )
+        return _pool
+
+
+def submit_render(context, output):
+    """
+    Render a document in the worker pool, returning a Future of its digest.
+
+    Concurrent requests for the same document share one render. With
+    INVOICE_RENDER_WORKERS set to 0 the document is rendered inline.
+    """
+    key = (render_digest(context), output)
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        if not settings.INVOICE_RENDER_WORKERS:
+            future = Future()
+            future.set_result(render_to_store(context, output))
+            return future
+
+    future = get_render_pool().submit(render_to_store, context, output)
+    with _lock:
+        future = _inflight.setdefault(key, future)
+    future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return future
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from billing.consumers import InvoiceFeedConsumer
+
+websocket_urlpatterns = [
+    path('ws/invoices/<int:invoice_id>/', InvoiceFeedConsumer.as_asgi(), name='invoice_feed'),
+]
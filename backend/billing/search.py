@@ -0,0 +1,236 @@
+import re
+from collections import defaultdict
+
+from django.db import connections, router
+from django.db.models import Q
+
+from billing.models import Invoice, InvoiceItem, InvoiceSearchDocument, Payment
+
+
+# Invoices per document rebuild query
+SEARCH_BATCH_SIZE = 1000
+
+# Terms beyond this are ignored; autocomplete input is short
+MAX_QUERY_TERMS = 8
+
+# Shorter terms only match as prefixes, they are too ambiguous to correct
+FUZZY_MIN_LENGTH = 4
+
+# Vocabulary terms tried per misspelled term
+FUZZY_CANDIDATES = 5
+
+# Index objects created by migration 0012
+SQLITE_INDEX = 'billing_invoice_search'
+SQLITE_TERMS = 'billing_invoice_search_terms'
+POSTGRES_TEXT = "(reference || ' ' || company || ' ' || items)"
+
+
+def search_terms(query):
+    """Lower-cased word tokens of a search box input, the way both indexes tokenize"""
+    return re.findall(r'\w+', (query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def _documents(ids):
+    items = defaultdict(list)
+    for invoice_id, description in (
+        InvoiceItem.objects.filter(invoice_id__in=ids).order_by('invoice_id', 'id').values_list('invoice_id', 'description')
+    ):
+        items[invoice_id].append(description)
+    references = defaultdict(dict)
+    for invoice_id, reference in (
+        Payment.objects.filter(invoice_id__in=ids).exclude(reference__isnull=True).exclude(reference='')
+        .order_by('invoice_id', 'id').values_list('invoice_id', 'reference')
+    ):
+        references[invoice_id][reference] = None
+
+    invoices = Invoice.objects.filter(pk__in=ids).values_list(
+        'pk', 'owner_id', 'invoice_number', 'company__name', 'company__tax_id',
+    )
+    return [
+        InvoiceSearchDocument(
+            invoice_id=pk, owner_id=owner_id,
+            reference=' '.join([number, *references[pk]]),
+            company=' '.join(part for part in (name, tax_id) if part),
+            items='\n'.join(items[pk]),
+        )
+        for pk, owner_id, number, name, tax_id in invoices
+    ]
+
+
+def refresh_search_documents(invoice_ids):
+    """
+    Rebuild the search documents of the invoices from their number, company, items and payments.
+
+    Documents are upserted, and the database keeps its full-text index in step with them
+    (triggers on SQLite, a generated column on PostgreSQL). Returns the number of invoices.
+    """
+    ids = list(invoice_ids)
+    for start in range(0, len(ids), SEARCH_BATCH_SIZE):
+        InvoiceSearchDocument.objects.bulk_create(
+            _documents(ids[start:start + SEARCH_BATCH_SIZE]),
+            update_conflicts=True, unique_fields=['invoice'], update_fields=['owner', 'reference', 'company', 'items'],
+        )
+    return len(ids)
+
+
+def rebuild_search_documents(batch_size=SEARCH_BATCH_SIZE):
+    """Rebuild every invoice's search document, returning how many there are"""
+    rebuilt = 0
+    last = 0
+    while True:
+        ids = list(Invoice.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return rebuilt
+        rebuilt += refresh_search_documents(ids)
+        last = ids[-1]
+
+
+def _edit_distance(a, b, limit, prefix=False):
+    """
+    Edits (insert, delete, substitute, swap adjacent) turning a into b, or into the
+    closest start of b with prefix=True. Returns limit + 1 once it exceeds limit.
+    """
+    if prefix:
+        b = b[:len(a) + limit]
+    elif abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other))
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == other:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    # The last row holds the distance to every start of b
+    return min(previous) if prefix else previous[-1]
+
+
+def _corrections(term, vocabulary):
+    """
+    The `vocabulary` (term, document count) pairs closest to `term`, best first.
+
+    A term matches a vocabulary word, or the start of a longer one so a misspelled
+    word still completes while typing, within one edit (two from 8 characters).
+    """
+    limit = 1 if len(term) < 8 else 2
+    letters = set(term)
+    scored = []
+    for word, documents in vocabulary:
+        # Each edit removes at most one of the term's letters, a cheap bound that skips most words
+        if len(letters.difference(word[:len(term) + limit])) > limit:
+            continue
+        distance = _edit_distance(term, word, limit, prefix=True)
+        if distance <= limit:
+            scored.append((distance, -documents, word))
+    return [word for _, _, word in sorted(scored)[:FUZZY_CANDIDATES]]
+
+
+def _sqlite_query(cursor, owner, match, limit, offset):
+    # Column weights for bm25: owner_id, reference, company, items
+    cursor.execute(
+        f'SELECT rowid FROM {SQLITE_INDEX} WHERE {SQLITE_INDEX} MATCH %s '
+        f'ORDER BY bm25({SQLITE_INDEX}, 0.0, 10.0, 5.0, 1.0), rowid DESC LIMIT %s OFFSET %s',
+        # The terms only search the text columns; in owner_id a digit would prefix-match the hex
+        [f'owner_id : "{owner.pk.hex}" AND {{reference company items}} : ({match})', limit, offset],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _sqlite_search(cursor, owner, terms, limit, offset):
+    return _sqlite_query(cursor, owner, ' AND '.join(f'"{term}"*' for term in terms), limit, offset)
+
+
+def _sqlite_terms(cursor, start, limit=None):
+    cursor.execute(
+        f'SELECT term, doc FROM {SQLITE_TERMS} WHERE term >= %s AND term < %s' + (f' LIMIT {limit}' if limit else ''),
+        [start, start + '\U0010ffff'],
+    )
+    return cursor.fetchall()
+
+
+def _sqlite_fuzzy(cursor, owner, terms, limit, offset):
+    alternatives = []
+    for term in terms:
+        # Known words only failed to occur together; correcting them would not help
+        if len(term) < FUZZY_MIN_LENGTH or _sqlite_terms(cursor, term, limit=1):
+            alternatives.append(f'"{term}"*')
+            continue
+        # Scanning the vocabulary is the expensive part, so candidates must share the first
+        # two letters, like a fixed prefix length in other engines, give or take one swap or
+        # extra letter among the first three
+        vocabulary = []
+        for start in dict.fromkeys((term[:2], term[1] + term[0], term[0] + term[2])):
+            vocabulary += _sqlite_terms(cursor, start)
+        words = _corrections(term, vocabulary)
+        if not words:
+            return []
+        alternatives.append('(' + ' OR '.join(f'"{word}"' for word in words) + ')')
+    if all(alternative.endswith('*') for alternative in alternatives):
+        return []
+    return _sqlite_query(cursor, owner, ' AND '.join(alternatives), limit, offset)
+
+
+def _postgres_search(cursor, owner, terms, limit, offset):
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    cursor.execute(
+        "SELECT invoice_id FROM billing_invoicesearchdocument "
+        "WHERE owner_id = %s AND vector @@ to_tsquery('simple', %s) "
+        "ORDER BY ts_rank(vector, to_tsquery('simple', %s)) DESC, invoice_id DESC LIMIT %s OFFSET %s",
+        [owner.pk, tsquery, tsquery, limit, offset],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _postgres_fuzzy(cursor, owner, terms, limit, offset):
+    text = ' '.join(terms)
+    cursor.execute(
+        f"SELECT invoice_id FROM billing_invoicesearchdocument WHERE owner_id = %s AND %s <%% {POSTGRES_TEXT} "
+        f"ORDER BY word_similarity(%s, {POSTGRES_TEXT}) DESC, invoice_id DESC LIMIT %s OFFSET %s",
+        [owner.pk, text, text, limit, offset],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _scan_search(cursor, owner, terms, limit, offset):
+    # Other databases have no index; a substring scan of the owner's documents
+    documents = InvoiceSearchDocument.objects.filter(owner=owner)
+    for term in terms:
+        documents = documents.filter(
+            Q(reference__icontains=term) | Q(company__icontains=term) | Q(items__icontains=term)
+        )
+    return list(documents.order_by('-invoice_id').values_list('invoice_id', flat=True)[offset:offset + limit])
+
+
+def _no_fuzzy(cursor, owner, terms, limit, offset):
+    return []
+
+
+SEARCH_BACKENDS = {
+    'sqlite': (_sqlite_search, _sqlite_fuzzy),
+    'postgresql': (_postgres_search, _postgres_fuzzy),
+}
+
+
+def search_invoices(owner, query, limit, offset=0):
+    """
+    Ids of the owner's invoices matching `query`, best match first, and whether typos were corrected.
+
+    Every term must match the start of a word in the invoice number, payment
+    references, company name or tax id, or item descriptions; matches in the first
+    rank highest. Only when nothing matches are the terms matched typo-tolerantly.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return [], False
+    connection = connections[router.db_for_read(InvoiceSearchDocument)]
+    search, fuzzy = SEARCH_BACKENDS.get(connection.vendor, (_scan_search, _no_fuzzy))
+    with connection.cursor() as cursor:
+        ids = search(cursor, owner, terms, limit, offset)
+        # A later page past the exact matches stays empty rather than switching to corrections
+        if ids or (offset and search(cursor, owner, terms, 1, 0)):
+            return ids, False
+        return fuzzy(cursor, owner, terms, limit, offset), True
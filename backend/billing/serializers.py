@@ -1,5 +1,9 @@
+from decimal import Decimal
+
 from rest_framework import serializers
-from billing.models import Invoice, InvoiceItem, InvoiceAuditLog, Company
+
+from backend.instrumentation import TimedRepresentationMixin
+from billing.models import Invoice, InvoiceItem, InvoiceAuditLog, Company, Payment
 
 
 class CompanySerializer(serializers.ModelSerializer):
@@ -16,9 +20,13 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'description', 'quantity', 'unit_price', 'total']
 
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     items = InvoiceItemSerializer(many=True, read_only=True)
-    total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    subtotal_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    total_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    amount_paid = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    balance_due = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
     can_edit = serializers.SerializerMethodField()
     company_name = serializers.CharField(source='company.name', read_only=True)
 
@@ -29,14 +37,67 @@ class InvoiceSerializer(serializers.ModelSerializer):
         model = Invoice
         fields = [
             'id', 'invoice_number', 'issue_date', 'due_date', 'status',
-            'company', 'company_name', 'items', 'total_amount', 'can_edit',
+            'company', 'company_name', 'items', 'subtotal_amount', 'total_amount',
+            'item_count', 'amount_paid', 'balance_due', 'can_edit',
             'created_at', 'updated_at'
         ]
 
 
-class InvoiceAuditLogSerializer(serializers.ModelSerializer):
+class InvoiceCreateSerializer(serializers.ModelSerializer):
+    """Fields a client sets on a new invoice; the number is allocated when left out"""
+    invoice_number = serializers.CharField(max_length=50, required=False)
+
+    class Meta:
+        model = Invoice
+        fields = ['invoice_number', 'issue_date', 'due_date', 'company']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Only the requesting tenant's companies can be billed
+        owner = self.context.get('owner')
+        if owner is not None:
+            self.fields['company'].queryset = Company.objects.owned_by(owner)
+
+
+class InvoiceUpdateSerializer(serializers.ModelSerializer):
+    """Invoice fields a client may edit on a draft; used with partial=True"""
+
+    class Meta:
+        model = Invoice
+        fields = ['invoice_number', 'issue_date', 'due_date']
+
+
+class InvoiceListSerializer(InvoiceSerializer):
+    """Invoice without line items, for list views that must not touch the items table"""
+
+    class Meta(InvoiceSerializer.Meta):
+        fields = [field for field in InvoiceSerializer.Meta.fields if field != 'items']
+
+
+class PaymentSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0.01'))
+
+    class Meta:
+        model = Payment
+        fields = ['id', 'amount', 'paid_at', 'reference']
+
+
+class InvoiceAuditLogSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     user_name = serializers.CharField(source='user.name', read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
+    old_values = serializers.SerializerMethodField()
+    new_values = serializers.SerializerMethodField()
+
+    def _values(self, obj):
+        # Full views rebuilt by billing.audit.reconstruct_values, passed in via context
+        values = self.context.get('values', {})
+        return values.get(obj.id, (obj.old_values, obj.new_values))
+
+    def get_old_values(self, obj):
+        return self._values(obj)[0]
+
+    def get_new_values(self, obj):
+        return self._values(obj)[1]
     
     class Meta:
         model = InvoiceAuditLog
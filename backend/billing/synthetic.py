@@ -0,0 +1,248 @@
+import math
+import random
+from datetime import datetime, time as clock, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from billing.models import Company, Invoice, InvoiceAuditLog, InvoiceItem, Payment
+from billing.search import refresh_search_documents
+from user.models import User
+
+
+# Rows per unit of scale; tenant sizes are skewed, a few tenants own most of the invoices
+TENANTS_PER_SCALE = 10
+COMPANIES_PER_SCALE = 100
+INVOICES_PER_SCALE = 2000
+
+# Every synthetic user signs in with this, so load tests can use the login endpoint
+SYNTHETIC_PASSWORD = 'synthetic-password'
+
+# Invoices per insert round, with their items, payments and audit rows
+GENERATE_BATCH_SIZE = 2000
+
+MAX_ITEMS = 500
+
+STATUS_WEIGHTS = {'draft': 10, 'sent': 25, 'partially_paid': 10, 'paid': 40, 'overdue': 10, 'cancelled': 5}
+STATUSES, STATUS_CUM_WEIGHTS = list(STATUS_WEIGHTS), list(accumulate(STATUS_WEIGHTS.values()))
+
+# Status changes leading to each status, for audit trails that rebuild to the invoice's state
+STATUS_PATHS = {
+    'draft': [],
+    'sent': ['sent'],
+    'partially_paid': ['sent', 'partially_paid'],
+    'paid': ['sent', 'paid'],
+    'overdue': ['sent', 'overdue'],
+    'cancelled': ['sent', 'cancelled'],
+}
+
+PAYMENT_TERMS = (14, 30, 30, 30, 45, 60)
+
+SERVICES = (
+    'Consulting', 'Development', 'Design', 'Hosting', 'Support', 'Maintenance', 'Licence', 'Training',
+    'Audit', 'Migration', 'Integration', 'Translation', 'Photography', 'Copywriting', 'Delivery', 'Storage',
+)
+SUBJECTS = (
+    'website', 'mobile app', 'backend', 'database', 'brand identity', 'marketing campaign', 'newsletter',
+    'analytics dashboard', 'server cluster', 'office network', 'payroll system', 'product catalogue',
+)
+UNITS = ('hours', 'days', 'month', 'seats', 'units', 'sessions')
+COMPANY_WORDS = (
+    'Acme', 'Northwind', 'Globex', 'Initech', 'Umbrella', 'Stark', 'Wayne', 'Tyrell', 'Cyberdyne', 'Hooli',
+    'Vandelay', 'Soylent', 'Oscorp', 'Wonka', 'Gringotts', 'Monarch', 'Aperture', 'Blue Sun', 'Dunder',
+)
+COMPANY_SUFFIXES = ('Ltd', 'GmbH', 'LLC', 'Inc', 'S.A.', 'B.V.', 'Sp. z o.o.')
+
+
+def synthetic_email(seed, n):
+    return f'synthetic-{seed}-{n}@example.com'
+
+
+def synthetic_prefix(seed):
+    """Invoice numbers of a seed's data start with this"""
+    return f'SYN{seed}-'
+
+
+def _skewed_split(total, parts):
+    """Split `total` over `parts` with Zipf weights (1, 1/2, 1/3, ...), every part getting at least one"""
+    weights = [1 / (n + 1) for n in range(parts)]
+    scale = (total - parts) / sum(weights)
+    sizes = [1 + int(weight * scale) for weight in weights]
+    sizes[0] += total - sum(sizes)
+    return sizes
+
+
+def _item_count(rng):
+    # Log-normal: most invoices have a handful of lines, a long tail has hundreds
+    return min(MAX_ITEMS, int(rng.lognormvariate(1.2, 1.0)) + 1)
+
+
+def _item(rng, invoice):
+    quantity = rng.choice((1, 1, 1, 2, 3, 5, 8, 10, 20, 40))
+    return InvoiceItem(
+        invoice=invoice, quantity=quantity,
+        description=f'{rng.choice(SERVICES)} - {rng.choice(SUBJECTS)} ({quantity} {rng.choice(UNITS)})',
+        unit_price=Decimal(rng.randrange(500, 250000)) / 100,
+    )
+
+
+def _moment(rng, day, after=None):
+    moment = timezone.make_aware(datetime.combine(day, clock(8))) + timedelta(minutes=rng.randrange(600))
+    return max(moment, after + timedelta(minutes=1)) if after else moment
+
+
+class GenerateResult:
+    def __init__(self):
+        self.counts = dict.fromkeys(('users', 'companies', 'invoices', 'items', 'payments', 'audit_logs'), 0)
+
+    def as_dict(self):
+        return dict(self.counts)
+
+
+def _users(seed, tenants):
+    emails = [synthetic_email(seed, n) for n in range(tenants)]
+    existing = {user.email: user for user in User.objects.filter(email__in=emails)}
+    # One hash for everyone, hashing is the slow part of creating users
+    password = make_password(SYNTHETIC_PASSWORD)
+    created = User.objects.bulk_create(
+        User(email=email, name=f'Synthetic {n}', business_name=f'Synthetic Tenant {n}', password=password)
+        for n, email in enumerate(emails) if email not in existing
+    )
+    existing.update((user.email, user) for user in created)
+    return [existing[email] for email in emails], len(created)
+
+
+def delete_synthetic_data(seed):
+    """Delete the invoices and companies of a seed's data; the users are kept and reused"""
+    invoices = Invoice.objects.filter(invoice_number__startswith=synthetic_prefix(seed))
+    with transaction.atomic():
+        Payment.objects.filter(invoice__in=invoices).delete()
+        deleted, _ = invoices.delete()
+        Company.objects.filter(owner__email__startswith=f'synthetic-{seed}-').delete()
+    return deleted
+
+
+def generate(scale=1, seed=0, batch_size=GENERATE_BATCH_SIZE, progress=None):
+    """
+    Insert a reproducible data set: tenants, their companies and invoices with items,
+    payments and audit trails, `scale` times the per-scale volumes.
+
+    The same seed always yields the same rows (apart from ids, and dates being relative
+    to today) numbered synthetic_prefix(seed)..., so a seed is generated once; see
+    delete_synthetic_data. Tenant, customer and item counts are skewed like real books.
+    Returns a GenerateResult.
+    """
+    rng = random.Random(seed)
+    result = GenerateResult()
+    today = timezone.localdate()
+    prefix = synthetic_prefix(seed)
+    if Invoice.objects.filter(invoice_number__startswith=prefix).exists():
+        raise ValueError(f"Data for seed {seed} exists, delete it first")
+
+    tenants = max(1, round(TENANTS_PER_SCALE * scale))
+    owners, result.counts['users'] = _users(seed, tenants)
+    company_counts = _skewed_split(max(tenants, round(COMPANIES_PER_SCALE * scale)), tenants)
+    invoice_counts = _skewed_split(max(tenants, round(INVOICES_PER_SCALE * scale)), tenants)
+
+    number = 0
+    for owner, company_count, invoice_count in zip(owners, company_counts, invoice_counts):
+        companies = Company.objects.bulk_create(
+            Company(
+                owner=owner, name=f'{rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_WORDS)} {rng.choice(COMPANY_SUFFIXES)}',
+                tax_id=f'TX{rng.randrange(10 ** 9):09d}' if rng.random() < 0.7 else None,
+                address=f'{rng.randrange(1, 200)} Market Street',
+            )
+            for _ in range(company_count)
+        )
+        result.counts['companies'] += len(companies)
+        # Customers are skewed as well, a tenant bills a few of them most of the time
+        cum_weights = list(accumulate(1 / math.sqrt(n + 1) for n in range(len(companies))))
+        for start in range(0, invoice_count, batch_size):
+            size = min(batch_size, invoice_count - start)
+            plans = []
+            for _ in range(size):
+                issue_date = today - timedelta(days=rng.randrange(730))
+                plans.append({
+                    'invoice': Invoice(
+                        owner=owner, created_by=owner, company=rng.choices(companies, cum_weights=cum_weights)[0],
+                        invoice_number=f'{prefix}{number:08d}', issue_date=issue_date,
+                        due_date=issue_date + timedelta(days=rng.choice(PAYMENT_TERMS)),
+                        status=rng.choices(STATUSES, cum_weights=STATUS_CUM_WEIGHTS)[0],
+                    ),
+                    'items': _item_count(rng),
+                })
+                number += 1
+            _write_batch(rng, owner, plans, result)
+            if progress:
+                progress(result)
+    return result
+
+
+def _write_batch(rng, owner, plans, result):
+    for plan in plans:
+        invoice = plan['invoice']
+        plan['items'] = [_item(rng, invoice) for _ in range(plan['items'])]
+        total = sum((item.quantity * item.unit_price for item in plan['items']), Decimal('0.00'))
+        if invoice.status == 'paid':
+            paid = total
+        elif invoice.status == 'partially_paid':
+            paid = (total * Decimal(rng.randrange(10, 90)) / 100).quantize(Decimal('0.01'))
+        else:
+            paid = Decimal('0.00')
+        invoice.subtotal_amount = invoice.total_amount = total
+        invoice.item_count = len(plan['items'])
+        invoice.amount_paid, invoice.balance_due = paid, total - paid
+        plan['paid'] = paid
+
+    with transaction.atomic():
+        invoices = Invoice.objects.bulk_create([plan['invoice'] for plan in plans])
+        items = InvoiceItem.objects.bulk_create(
+            [item for plan in plans for item in plan['items']], batch_size=GENERATE_BATCH_SIZE,
+        )
+        payments, logs = [], []
+        for plan in plans:
+            invoice = plan['invoice']
+            created = _moment(rng, invoice.issue_date)
+            logs.append(InvoiceAuditLog(
+                invoice=invoice, user=owner, action='created', timestamp=created,
+                description=f'Invoice created by {owner.name}',
+            ))
+            moment = created
+            for _ in range(int(rng.expovariate(0.5))):
+                moment = _moment(rng, invoice.issue_date, after=moment)
+                item = rng.choice(plan['items']) if plan['items'] else None
+                logs.append(InvoiceAuditLog(
+                    invoice=invoice, user=owner, action='item_updated' if item else 'updated', timestamp=moment,
+                    changes={'description': {'new': item.description}} if item else {},
+                ))
+            status = 'draft'
+            for new in STATUS_PATHS[invoice.status]:
+                moment += timedelta(days=rng.randrange(1, 20))
+                logs.append(InvoiceAuditLog(
+                    invoice=invoice, user=owner, action='status_changed', timestamp=moment,
+                    changes={'status': {'old': status, 'new': new}},
+                ))
+                status = new
+            # Paid invoices are often settled in instalments
+            remaining, parts = plan['paid'], rng.choice((1, 1, 1, 2, 3))
+            while remaining > 0:
+                amount = remaining if parts == 1 else (remaining / parts).quantize(Decimal('0.01'))
+                remaining -= amount
+                parts -= 1
+                payments.append(Payment(
+                    invoice=invoice, amount=amount,
+                    paid_at=_moment(rng, invoice.due_date - timedelta(days=rng.randrange(-20, 20))),
+                    reference=invoice.invoice_number if rng.random() < 0.8 else f'TRX{rng.randrange(10 ** 10):010d}',
+                ))
+        Payment.objects.bulk_create(payments, batch_size=GENERATE_BATCH_SIZE)
+        InvoiceAuditLog.objects.bulk_create(logs, batch_size=GENERATE_BATCH_SIZE)
+        # The documents were indexed by bulk_create before the items and payments existed
+        refresh_search_documents([invoice.pk for invoice in invoices])
+
+    result.counts['invoices'] += len(invoices)
+    result.counts['items'] += len(items)
+    result.counts['payments'] += len(payments)
+    result.counts['audit_logs'] += len(logs)
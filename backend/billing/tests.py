@@ -1,3 +1,1431 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.apps import apps as django_apps
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, connections, router, transaction
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+
+from backend.instrumentation import InstrumentationMiddleware, registry
+from backend.replicas import ReplicaMiddleware, _down_until, pin_cache_key
+from billing.analytics import compute_rollups, rebuild_rollups
+from billing.management.commands.benchmark_endpoints import url_names
+from billing.api import invoice_audit_log, invoice_detail
+from backend.asgi import application
+from billing.audit import AuditLogWriter, archive_audit_logs, audit_event, ingest_spool, record_audit_events
+from billing.filters import AUDIT_LOG_ORDERING, INVOICE_ORDERINGS
+from billing.models import Company, Invoice, InvoiceItem, InvoiceAuditLog, Payment, ReceivableRollup, RevenueRollup
+from billing.numbering import SequenceBlocks, allocate_invoice_numbers
+from billing.overdue import mark_overdue
+from billing.pagination import encode_cursor
+from billing.rendering import render_context, render_pdf, render_to_store, rendered_path
+from billing.reconciliation import settle_invoices
+from billing.search import search_invoices
+from billing.synthetic import delete_synthetic_data, generate
+from user.models import User
+
+# Migration modules start with a digit, out of reach of an import statement
+backfill_totals = import_module('billing.migrations.0003_invoice_totals').backfill_totals
+backfill_balances = import_module('billing.migrations.0007_invoice_payment_balance').backfill_balances
+
+
+class BillingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(name='Ana', email='ana@example.com', password='secret')
+        cls.company = Company.objects.create(owner=cls.user, name='Acme', tax_id='SI123')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # The async read views authenticate the bearer token themselves
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def make_invoice(self, number, items=0, logs=0, **kwargs):
+        invoice = Invoice.objects.create(
+            owner=self.user, company=self.company, invoice_number=number, created_by=self.user, **kwargs
+        )
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(invoice=invoice, description=f'Item {n}', quantity=1, unit_price=Decimal('10.00'))
+            for n in range(items)
+        ])
+        invoice.refresh_totals()
+        InvoiceAuditLog.objects.bulk_create([
+            InvoiceAuditLog(invoice=invoice, user=self.user, action='updated')
+            for _ in range(logs)
+        ])
+        return invoice
+
+    def count_queries(self, url):
+        # Measure the uncached path
+        cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(captured)
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class InvoiceTotalsTests(BillingTestCase):
+    def totals(self, invoice):
+        invoice.refresh_from_db()
+        return invoice.item_count, invoice.subtotal_amount, invoice.total_amount, invoice.balance_due
+
+    def corrupt(self):
+        Invoice.objects.update(
+            item_count=0, subtotal_amount=Decimal('0.00'), total_amount=Decimal('0.00'),
+            amount_paid=Decimal('0.00'), balance_due=Decimal('0.00'),
+        )
+
+    def test_item_writes_maintain_totals(self):
+        invoice = self.make_invoice('T-1')
+        item = InvoiceItem.objects.create(invoice=invoice, description='A', quantity=2, unit_price=Decimal('7.50'))
+        self.assertEqual(self.totals(invoice), (1, 15, 15, 15))
+
+        item.quantity = 3
+        item.save()
+        InvoiceItem.objects.create(invoice=invoice, description='B', quantity=1, unit_price=Decimal('0.25'))
+        self.assertEqual(self.totals(invoice), (2, Decimal('22.75'), Decimal('22.75'), Decimal('22.75')))
+
+        item.delete()
+        self.assertEqual(self.totals(invoice), (1, Decimal('0.25'), Decimal('0.25'), Decimal('0.25')))
+
+    def test_command_repairs_totals_and_balances(self):
+        invoices = [self.make_invoice(f'T-{n}', items=n, status='sent') for n in range(4)]
+        Payment.objects.create(invoice=invoices[3], amount=Decimal('5.00'))
+        self.corrupt()
+
+        call_command('recalculate_invoice_totals', batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            [self.totals(invoice) for invoice in invoices],
+            [(0, 0, 0, 0), (1, 10, 10, 10), (2, 20, 20, 20), (3, 30, 30, 25)],
+        )
+
+    def test_migration_backfills_totals(self):
+        invoices = [self.make_invoice(f'T-{n}', items=n) for n in range(3)]
+        self.corrupt()
+
+        backfill_totals(django_apps, None, batch_size=2)
+        self.assertEqual([self.totals(invoice)[:3] for invoice in invoices], [(0, 0, 0), (1, 10, 10), (2, 20, 20)])
+
+
+class InvoiceListTests(BillingTestCase):
+    def numbers(self, **params):
+        response = self.client.get('/api/invoices/', params)
+        self.assertEqual(response.status_code, 200)
+        return [invoice['invoice_number'] for invoice in response.json()['results']]
+
+    def pages(self, **params):
+        pages, cursor = [], ''
+        while True:
+            data = self.client.get('/api/invoices/', {**params, 'cursor': cursor}).json()
+            pages.append([invoice['invoice_number'] for invoice in data['results']])
+            cursor = data['next_cursor']
+            if not cursor:
+                return pages
+
+    def test_filters(self):
+        other = User.objects.create_user(name='Bo', email='bo@example.com', password='secret')
+        globex = Company.objects.create(owner=self.user, name='Globex')
+        self.make_invoice('L-1', status='sent', issue_date='2025-01-10', due_date='2025-02-10')
+        self.make_invoice('L-2', status='paid', issue_date='2025-02-10', due_date='2025-03-10')
+        Invoice.objects.create(
+            owner=self.user, company=globex, invoice_number='L-3', created_by=other, status='draft',
+            issue_date='2025-03-10', due_date='2025-04-10',
+        )
+
+        for params, expected in (
+            ({'company': globex.pk}, ['L-3']),
+            ({'status': 'sent,paid'}, ['L-2', 'L-1']),
+            ({'status': 'draft'}, ['L-3']),
+            ({'created_by': str(other.pk)}, ['L-3']),
+            ({'issue_date_from': '2025-02-10'}, ['L-3', 'L-2']),
+            ({'issue_date_to': '2025-02-09'}, ['L-1']),
+            ({'due_date_from': '2025-03-01', 'due_date_to': '2025-03-31'}, ['L-2']),
+            ({'company': self.company.pk, 'status': 'paid'}, ['L-2']),
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.numbers(**params), expected)
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in (
+            {'status': 'bogus'}, {'company': 'x'}, {'created_by': 'nobody'}, {'issue_date_from': '10/01/2025'},
+            {'ordering': 'total'}, {'limit': '0'}, {'limit': 'many'},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get('/api/invoices/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_bad_cursors_are_rejected(self):
+        for n in range(3):
+            self.make_invoice(f'L-{n}')
+        cursor = self.client.get('/api/invoices/', {'limit': 1}).json()['next_cursor']
+        tampered = encode_cursor(INVOICE_ORDERINGS['-issue_date'], ['not a date', 'x'])
+        for params in (
+            {'cursor': 'garbage!'},
+            {'cursor': cursor, 'ordering': 'id'},
+            {'cursor': encode_cursor(INVOICE_ORDERINGS['-issue_date'], ['2025-01-01'])},
+            {'cursor': tampered},
+            {'cursor': encode_cursor(INVOICE_ORDERINGS['-issue_date'], [123, 1])},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/invoices/', params).status_code, 400)
+
+    def test_pages_are_stable_across_equal_sort_keys(self):
+        for n in range(7):
+            # Issue dates repeat, so the id breaks ties
+            self.make_invoice(f'L-{n}', issue_date=f'2025-01-0{1 + n % 3}')
+
+        for ordering in INVOICE_ORDERINGS:
+            with self.subTest(ordering=ordering):
+                expected = self.numbers(ordering=ordering)
+                pages = self.pages(ordering=ordering, limit=2)
+                self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+                self.assertEqual([number for page in pages for number in page], expected)
+
+        # A row inserted before the cursor does not shift later pages
+        first = self.client.get('/api/invoices/', {'limit': 3}).json()
+        self.make_invoice('L-new', issue_date='2025-12-31')
+        rest = self.client.get('/api/invoices/', {'limit': 10, 'cursor': first['next_cursor']}).json()['results']
+        numbers = [invoice['invoice_number'] for invoice in first['results']] + [invoice['invoice_number'] for invoice in rest]
+        self.assertEqual(sorted(numbers), [f'L-{n}' for n in range(7)])
+
+
+class QueryCountTests(BillingTestCase):
+    def test_detail_query_count_does_not_grow_with_items(self):
+        small = self.make_invoice('Q-1', items=1)
+        large = self.make_invoice('Q-2', items=50)
+
+        # User, version lookup, invoice with company, items
+        with self.assertNumQueries(4):
+            self.client.get(f'/api/invoices/{small.id}/')
+        self.assertEqual(
+            self.count_queries(f'/api/invoices/{small.id}/'),
+            self.count_queries(f'/api/invoices/{large.id}/'),
+        )
+
+    def test_audit_log_query_count_does_not_grow_with_logs(self):
+        small = self.make_invoice('Q-1', logs=1)
+        large = self.make_invoice('Q-2', logs=50)
+
+        # User, version lookup, current invoice values, logs with users
+        with self.assertNumQueries(4):
+            self.client.get(f'/api/invoices/{small.id}/audit-log/')
+        self.assertEqual(
+            self.count_queries(f'/api/invoices/{small.id}/audit-log/'),
+            self.count_queries(f'/api/invoices/{large.id}/audit-log/'),
+        )
+
+    def test_list_query_count_does_not_grow_with_invoices_or_items(self):
+        self.make_invoice('Q-1', items=3)
+        few = self.count_queries('/api/invoices/?include=items')
+
+        for n in range(2, 20):
+            self.make_invoice(f'Q-{n}', items=n)
+        self.assertEqual(self.count_queries('/api/invoices/?include=items'), few)
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/invoices/')
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class InvoiceItemSyncTests(BillingTestCase):
+    def put_items(self, invoice, items):
+        return self.client.put(f'/api/invoices/{invoice.id}/edit/', {'items': items}, format='json')
+
+    def test_items_are_created_updated_and_deleted_with_totals(self):
+        invoice = self.make_invoice('I-1', items=3)
+        kept, changed, removed = invoice.items.order_by('id')
+
+        response = self.put_items(invoice, [
+            {'id': kept.id, 'description': kept.description, 'quantity': 1, 'unit_price': '10.00'},
+            {'id': changed.id, 'description': 'Changed', 'quantity': 3, 'unit_price': '2.50'},
+            {'description': 'New', 'quantity': 2, 'unit_price': '1.25'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(invoice.items.order_by('id').values_list('description', 'quantity', 'unit_price')),
+            [('Item 0', 1, Decimal('10.00')), ('Changed', 3, Decimal('2.50')), ('New', 2, Decimal('1.25'))],
+        )
+        self.assertFalse(InvoiceItem.objects.filter(pk=removed.pk).exists())
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.item_count, invoice.subtotal_amount, invoice.total_amount), (3, 20, 20))
+        self.assertEqual(
+            sorted(invoice.audit_logs.values_list('action', flat=True)), ['item_added', 'item_removed', 'item_updated'],
+        )
+
+        self.assertEqual(self.put_items(invoice, []).status_code, 200)
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.item_count, invoice.total_amount), (0, 0))
+
+    def test_invalid_items_are_rejected_without_writing(self):
+        invoice = self.make_invoice('I-1', items=1)
+        item = invoice.items.get()
+        entry = {'id': item.id, 'description': 'A', 'quantity': 1, 'unit_price': '1.00'}
+        for items in (
+            [entry, dict(entry, description='B')],
+            [{'description': 'x' * 256, 'quantity': 1, 'unit_price': '1.00'}],
+            [{'description': 'A', 'quantity': 1, 'unit_price': 'NaN'}],
+            [{'description': 'A', 'quantity': -1, 'unit_price': '1.00'}],
+            [{'description': 'A', 'quantity': 1.7, 'unit_price': '1.00'}],
+            [{'description': 'A', 'quantity': 1, 'unit_price': '1.234'}],
+            [{'id': 0, 'description': 'A', 'quantity': 1, 'unit_price': '1.00'}],
+            ['oops'],
+            {'description': 'A'},
+        ):
+            with self.subTest(items=items):
+                self.assertEqual(self.put_items(invoice, items).status_code, 400)
+        self.assertEqual(list(invoice.items.values_list('description', flat=True)), ['Item 0'])
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.total_amount, Decimal('10.00'))
+
+    def test_resending_stored_items_changes_nothing(self):
+        invoice = self.make_invoice('I-1')
+        self.assertEqual(self.put_items(invoice, [{'description': 'A', 'quantity': 2.0, 'unit_price': 1.5}]).status_code, 200)
+        item = invoice.items.get()
+        entry = {'id': item.id, 'description': 'A', 'quantity': '2', 'unit_price': '1.5'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.put_items(invoice, [entry]).status_code, 200)
+        self.assertEqual(list(invoice.audit_logs.values_list('action', flat=True)), ['item_added'])
+
+
+class InvoiceCacheTests(BillingTestCase):
+    def test_repeated_detail_is_served_from_cache(self):
+        invoice = self.make_invoice('C-1', items=3)
+        first = self.client.get(f'/api/invoices/{invoice.id}/')
+
+        # Version lookup only, the user comes from the principal cache
+        with self.assertNumQueries(1):
+            second = self.client.get(f'/api/invoices/{invoice.id}/')
+        self.assertEqual(first.content, second.content)
+
+    def test_matching_etag_returns_304(self):
+        invoice = self.make_invoice('C-1', items=3)
+        etag = self.client.get(f'/api/invoices/{invoice.id}/')['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/invoices/{invoice.id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_item_payment_and_audit_writes_invalidate(self):
+        invoice = self.make_invoice('C-1', items=1)
+        url = f'/api/invoices/{invoice.id}/'
+        audit_url = f'/api/invoices/{invoice.id}/audit-log/'
+
+        etag = self.client.get(url)['ETag']
+        InvoiceItem.objects.create(invoice=invoice, description='Extra', quantity=2, unit_price=Decimal('5.00'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_amount'], '20.00')
+
+        etag = response['ETag']
+        invoice.payments.create(amount=Decimal('5.00'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self.assertEqual(self.client.get(audit_url).json()['results'], [])
+        InvoiceAuditLog.objects.create(invoice=invoice, user=self.user, action='updated')
+        self.assertEqual(len(self.client.get(audit_url).json()['results']), 1)
+
+    def test_unknown_invoice_is_404(self):
+        self.assertEqual(self.client.get('/api/invoices/999/').status_code, 404)
+
+
+class ConditionalUpdateTests(BillingTestCase):
+    def test_stale_if_match_is_rejected_before_loading_invoice(self):
+        invoice = self.make_invoice('E-1', items=2)
+        etag = self.client.get(f'/api/invoices/{invoice.id}/')['ETag']
+        self.client.put(f'/api/invoices/{invoice.id}/edit/', {'due_date': '2030-01-01'}, format='json', HTTP_IF_MATCH=etag)
+
+        with self.assertNumQueries(1):
+            response = self.client.put(
+                f'/api/invoices/{invoice.id}/edit/', {'due_date': '2031-01-01'}, format='json', HTTP_IF_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 412)
+        invoice.refresh_from_db()
+        self.assertEqual(str(invoice.due_date), '2030-01-01')
+
+    def test_fresh_if_match_chains_edits(self):
+        invoice = self.make_invoice('E-1')
+        etag = self.client.get(f'/api/invoices/{invoice.id}/')['ETag']
+
+        response = self.client.put(
+            f'/api/invoices/{invoice.id}/edit/', {'due_date': '2030-01-01'}, format='json', HTTP_IF_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(f'/api/invoices/{invoice.id}/')['ETag'], response['ETag'])
+
+        response = self.client.put(
+            f'/api/invoices/{invoice.id}/edit/', {'due_date': '2031-01-01'}, format='json',
+            HTTP_IF_MATCH=response['ETag'],
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class PartialUpdateTests(BillingTestCase):
+    def patch(self, invoice, data):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.patch(f'/api/invoices/{invoice.id}/edit/', data, format='json')
+        writes = [q['sql'] for q in captured if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+        return response, writes
+
+    def test_unchanged_values_write_nothing(self):
+        invoice = self.make_invoice('U-1', items=1, due_date='2030-01-01')
+        item = invoice.items.get()
+        etag = self.client.get(f'/api/invoices/{invoice.id}/')['ETag']
+
+        response, writes = self.patch(invoice, {
+            'invoice_number': 'U-1', 'due_date': '2030-01-01',
+            'items': [{'id': item.id, 'description': item.description, 'quantity': 1, 'unit_price': '10.00'}],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(writes, [])
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(InvoiceAuditLog.objects.filter(invoice=invoice).exists())
+
+    def test_only_dirty_fields_are_written(self):
+        invoice = self.make_invoice('U-1', due_date='2030-01-01')
+        response, writes = self.patch(invoice, {'invoice_number': 'U-2', 'due_date': '2030-01-01'})
+        self.assertEqual(response.status_code, 200)
+        # The invoice row, its search document and the audit row; the number does not feed analytics rollups
+        self.assertEqual(len(writes), 3)
+        self.assertIn('"invoice_number"', writes[0])
+        self.assertNotIn('"due_date"', writes[0])
+        self.assertIn('"billing_invoicesearchdocument"', writes[1])
+        log = InvoiceAuditLog.objects.get(invoice=invoice)
+        self.assertEqual(log.changes, {'invoice_number': {'old': 'U-1', 'new': 'U-2'}})
+
+    def test_supplied_fields_are_validated(self):
+        invoice = self.make_invoice('U-1')
+        self.make_invoice('U-2')
+        for data in ({'due_date': 'soon'}, {'invoice_number': 'U-2'}):
+            response, writes = self.patch(invoice, data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(writes, [])
+
+
+class InvoiceExportTests(BillingTestCase):
+    def test_csv_rows_line_up_with_the_header(self):
+        invoice = self.make_invoice('E-1', items=2, status='sent')
+        self.make_invoice('E-2')
+
+        response = self.client.get('/api/invoices/export/?output=csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        header, rows = rows[0], [dict(zip(rows[0], row)) for row in rows[1:]]
+        self.assertTrue(all(len(row) == len(header) for row in rows))
+        self.assertEqual(len(rows), 3)
+
+        items = list(invoice.items.order_by('id'))
+        first = rows[0]
+        self.assertEqual(first['invoice_number'], 'E-1')
+        self.assertEqual(first['balance_due'], '20.00')
+        self.assertEqual(first['item_id'], str(items[0].id))
+        self.assertEqual(first['item_description'], items[0].description)
+        self.assertEqual(first['item_total'], '10.00')
+        self.assertEqual((rows[2]['invoice_number'], rows[2]['item_id']), ('E-2', ''))
+
+    def test_ndjson_nests_items(self):
+        self.make_invoice('E-1', items=2)
+        response = self.client.get('/api/invoices/export/?output=ndjson')
+        documents = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([len(document['items']) for document in documents], [2])
+        self.assertEqual(documents[0]['total_amount'], '20.00')
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class InvoiceImportTests(BillingTestCase):
+    def upload(self, name, content):
+        return self.client.post('/api/invoices/import/', {'file': SimpleUploadedFile(name, content.encode())})
+
+    def test_csv_rows_are_grouped_into_invoices(self):
+        response = self.upload('invoices.csv', (
+            'invoice_number,company_name,company_tax_id,status,item_description,item_quantity,item_unit_price,'
+            'payment_amount,payment_paid_at\n'
+            'I-1,Acme,SI123,sent,Design,2,50.00,40.00,2025-03-01T10:00:00Z\n'
+            'I-1,Acme,SI123,sent,Hosting,1,20.00,,\n'
+            'I-2,Globex,,draft,,,,,\n'
+        ))
+        self.assertEqual(response.json(), {'created': 2, 'error_count': 0, 'errors': []})
+
+        invoice = Invoice.objects.get(invoice_number='I-1')
+        self.assertEqual(invoice.company, self.company)
+        self.assertEqual((invoice.item_count, invoice.total_amount, invoice.balance_due), (2, 120, 80))
+        self.assertEqual(invoice.payments.get().amount, Decimal('40.00'))
+        self.assertEqual(Invoice.objects.get(invoice_number='I-2').company.owner, self.user)
+
+    def test_invalid_records_are_reported_per_line(self):
+        records = [
+            {'invoice_number': 'I-1', 'company': {'name': 'Acme'}, 'items': [{'description': 'A', 'unit_price': 5}]},
+            {'invoice_number': 'I-2', 'company': {'name': 'Acme'}, 'items': ['oops']},
+            {'invoice_number': 'I-3', 'company': {'name': 'Acme'}, 'payments': 'oops'},
+            {'invoice_number': 'I-4', 'company': {'name': 'x' * 256}},
+            {'invoice_number': 'I-5', 'company': {'name': 'Acme', 'tax_id': 'x' * 51}},
+            {'invoice_number': 'I-6', 'company': {'name': 'Acme'}, 'items': [{'description': 'A', 'unit_price': 'NaN'}]},
+            {'invoice_number': 'I-7', 'company': {'name': 'Acme'}, 'payments': [{'amount': 'Infinity'}]},
+            {'invoice_number': 'I-8', 'company': {'name': 'Acme'}, 'items': [{'description': 'A', 'unit_price': 1e12}]},
+            {'invoice_number': 'I-9', 'company': {'name': 'Acme'}, 'items': [{'description': 'x' * 256, 'unit_price': 1}]},
+            {'invoice_number': 'I-11', 'company': {'name': 'Acme'}, 'items': [{'description': 'A', 'quantity': 1.7, 'unit_price': 1}]},
+            {'invoice_number': 'I-12', 'company': {'name': 'Acme'}, 'items': [{'description': 'A', 'unit_price': '1.234'}]},
+            {'invoice_number': 'I-1', 'company': {'name': 'Acme'}},
+            {'invoice_number': 'I-10', 'company': {'name': 'Acme'}},
+        ]
+        content = '\n'.join(json.dumps(record) for record in records) + '\n{not json\n'
+        result = self.upload('invoices.ndjson', content).json()
+
+        self.assertEqual(result['created'], 2)
+        self.assertEqual([error['line'] for error in result['errors']], [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 14])
+        self.assertEqual(
+            sorted(Invoice.objects.values_list('invoice_number', flat=True)), ['I-1', 'I-10'],
+        )
+
+
+    def test_numbers_of_other_tenants_are_reported_as_unavailable(self):
+        other = User.objects.create_user(name='Bo', email='bo@example.com', password='secret')
+        company = Company.objects.create(owner=other, name='Globex')
+        Invoice.objects.create(owner=other, company=company, invoice_number='X-1', created_by=other)
+        self.make_invoice('I-1')
+        records = [{'invoice_number': number, 'company': {'name': 'Acme'}} for number in ('I-1', 'X-1')]
+        result = self.upload('invoices.ndjson', '\n'.join(json.dumps(record) for record in records)).json()
+        self.assertEqual(
+            [(error['invoice_number'], error['error']) for error in result['errors']],
+            [('I-1', 'Invoice number already exists'), ('X-1', 'Invoice number is not available')],
+        )
+
+
+class AuditPipelineTests(BillingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spool = tempfile.TemporaryDirectory()
+        self.addCleanup(self.spool.cleanup)
+
+    @override_settings(AUDIT_LOG_ASYNC=False)
+    def test_diff_only_rows_are_reconstructed_on_read(self):
+        invoice = self.make_invoice('A-1', issue_date='2025-01-01', due_date='2025-01-10')
+        url = f'/api/invoices/{invoice.id}/edit/'
+        self.client.put(url, {'due_date': '2025-02-01'}, format='json')
+        self.client.put(url, {'invoice_number': 'A-2'}, format='json')
+
+        stored = list(invoice.audit_logs.values_list('old_values', 'new_values'))
+        self.assertEqual(stored, [({}, {}), ({}, {})])
+
+        newest, oldest = self.client.get(f'/api/invoices/{invoice.id}/audit-log/').json()['results']
+        self.assertEqual(oldest['old_values']['due_date'], '2025-01-10')
+        self.assertEqual(oldest['new_values']['due_date'], '2025-02-01')
+        self.assertEqual(oldest['new_values']['invoice_number'], 'A-1')
+        self.assertEqual(newest['old_values'], oldest['new_values'])
+        self.assertEqual(newest['new_values']['invoice_number'], 'A-2')
+
+    @override_settings(AUDIT_LOG_ASYNC=True)
+    def test_pending_events_are_flushed_before_reading(self):
+        invoice = self.make_invoice('A-1', due_date='2025-01-10')
+        url = f'/api/invoices/{invoice.id}/edit/'
+        writer = AuditLogWriter(self.spool.name, batch_size=100, flush_interval=60, autostart=False)
+        with override_settings(AUDIT_LOG_SPOOL_DIR=self.spool.name), patch('billing.audit._writer', writer):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(url, {'due_date': '2025-02-01'}, format='json')
+            writer.flush()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(url, {'invoice_number': 'A-2'}, format='json')
+            self.assertEqual(invoice.audit_logs.count(), 1)
+            # Another live process's rotated segment is left to its own writer
+            other = os.path.join(self.spool.name, f'{os.getppid()}-other.ready')
+            with open(other, 'w') as f:
+                f.write(json.dumps(audit_event(invoice.id, self.user, 'updated', {}), cls=DjangoJSONEncoder) + '\n')
+
+            newest, oldest = self.client.get(f'/api/invoices/{invoice.id}/audit-log/').json()['results']
+        self.assertEqual(oldest['new_values']['due_date'], '2025-02-01')
+        self.assertEqual(oldest['new_values']['invoice_number'], 'A-1')
+        self.assertEqual(newest['new_values']['invoice_number'], 'A-2')
+        self.assertTrue(os.path.exists(other))
+
+    @override_settings(AUDIT_LOG_ASYNC=True, DATABASE_REPLICA_ALIASES=['stale'])
+    @patch('backend.replicas._available', return_value=True)
+    def test_events_of_invoices_a_replica_lags_behind_on_are_kept(self, available):
+        # A replica that has yet to see any invoice
+        replica = tempfile.NamedTemporaryFile(suffix='.sqlite3')
+        self.addCleanup(replica.close)
+        with connection.cursor() as cursor, sqlite3.connect(replica.name) as target:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [Invoice._meta.db_table])
+            target.execute(cursor.fetchone()[0])
+        connections.settings['stale'] = {**connection.settings_dict, 'NAME': replica.name}
+        self.addCleanup(connections.settings.pop, 'stale')
+        self.addCleanup(lambda: connections['stale'].close())
+
+        invoice = self.make_invoice('A-1')
+        writer = AuditLogWriter(self.spool.name, batch_size=100, flush_interval=60, autostart=False)
+        writer.submit([audit_event(invoice.id, self.user, 'updated', {})])
+
+        def view(request):
+            request.user = self.user
+            self.assertEqual(router.db_for_read(Invoice), 'stale')
+            writer.flush(own_only=True)
+            return HttpResponse()
+
+        ReplicaMiddleware(view)(APIRequestFactory().get('/'))
+        self.assertEqual(invoice.audit_logs.count(), 1)
+        self.assertFalse(os.listdir(self.spool.name))
+
+    def test_spooled_events_are_flushed_once(self):
+        invoice = self.make_invoice('A-1')
+        with override_settings(AUDIT_LOG_SPOOL_DIR=self.spool.name):
+            writer = AuditLogWriter(self.spool.name, batch_size=100, flush_interval=60, autostart=False)
+            events = [audit_event(invoice.id, self.user, 'updated', {'status': {'old': 'draft', 'new': 'sent'}})]
+            writer.submit(events)
+            self.assertEqual(invoice.audit_logs.count(), 0)
+            writer.flush()
+            self.assertEqual(invoice.audit_logs.count(), 1)
+
+            # Replaying the same segment, as after a crash before it was removed, inserts nothing new
+            segment = os.path.join(self.spool.name, '1-replay.ready')
+            with open(segment, 'w') as f:
+                f.write(json.dumps(events[0], cls=DjangoJSONEncoder) + '\n')
+            ingest_spool(self.spool.name)
+        self.assertEqual(invoice.audit_logs.count(), 1)
+        self.assertFalse(os.listdir(self.spool.name))
+
+    def test_segment_of_dead_process_is_recovered(self):
+        invoice = self.make_invoice('A-1')
+        event = audit_event(invoice.id, self.user, 'updated', {})
+        # Far above any real pid, so the writer counts as dead
+        with open(os.path.join(self.spool.name, '99999999-crashed.log'), 'w') as f:
+            f.write(json.dumps(event, cls=DjangoJSONEncoder) + '\n{"torn')
+
+        self.assertEqual(ingest_spool(self.spool.name), 1)
+        self.assertEqual(invoice.audit_logs.count(), 1)
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class AuditLogPaginationTests(BillingTestCase):
+    def edit(self, invoice, **data):
+        response = self.client.put(f'/api/invoices/{invoice.id}/edit/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_pages_rebuild_values_across_page_boundaries(self):
+        invoice = self.make_invoice('P-1', due_date='2025-01-01')
+        for day in range(2, 7):
+            self.edit(invoice, due_date=f'2025-01-0{day}')
+
+        url = f'/api/invoices/{invoice.id}/audit-log/'
+        pages, cursor = [], ''
+        while True:
+            data = self.client.get(url, {'limit': 2, 'cursor': cursor}).json()
+            pages.append(data['results'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        logs = [log for page in pages for log in page]
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(
+            [(log['old_values']['due_date'], log['new_values']['due_date']) for log in logs],
+            [(f'2025-01-0{day - 1}', f'2025-01-0{day}') for day in range(6, 1, -1)],
+        )
+
+    def test_bad_cursors_are_rejected(self):
+        invoice = self.make_invoice('P-1')
+        url = f'/api/invoices/{invoice.id}/audit-log/'
+        for values in (['not a time', 1], [123, 1], [[], 1]):
+            with self.subTest(values=values):
+                cursor = encode_cursor(AUDIT_LOG_ORDERING, values)
+                self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 400)
+
+    def test_filters_by_action_and_user(self):
+        other = User.objects.create_user(name='Bo', email='bo@example.com', password='secret')
+        invoice = self.make_invoice('P-1')
+        self.edit(invoice, due_date='2030-01-01', items=[{'description': 'A', 'quantity': 1, 'unit_price': '1'}])
+        InvoiceAuditLog.objects.create(invoice=invoice, user=other, action='status_changed')
+
+        url = f'/api/invoices/{invoice.id}/audit-log/'
+        actions = [log['action'] for log in self.client.get(url, {'action': 'item_added,updated'}).json()['results']]
+        self.assertEqual(sorted(actions), ['item_added', 'updated'])
+        by_other = self.client.get(url, {'user': str(other.id)}).json()['results']
+        self.assertEqual([log['user_email'] for log in by_other], ['bo@example.com'])
+        self.assertEqual(self.client.get(url, {'action': 'bogus'}).status_code, 400)
+
+    def test_archived_rows_leave_the_live_table_and_stay_readable(self):
+        invoice = self.make_invoice('P-1')
+        invoice.refresh_from_db()
+        self.edit(invoice, due_date='2030-01-01')
+        InvoiceAuditLog.objects.update(timestamp=timezone.now() - timedelta(days=400))
+        self.edit(invoice, due_date='2031-01-01')
+        url = f'/api/invoices/{invoice.id}/audit-log/'
+        # Cached before archiving
+        self.assertEqual(len(self.client.get(url).json()['results']), 2)
+
+        archived = sum(archive_audit_logs(timezone.now() - timedelta(days=365), batch_size=1))
+        self.assertEqual(archived, 1)
+
+        live = self.client.get(url).json()['results']
+        self.assertEqual([log['changes']['due_date']['new'] for log in live], ['2031-01-01'])
+        self.assertEqual(live[0]['old_values']['due_date'], '2030-01-01')
+        cold = self.client.get(url, {'archived': 'true'}).json()['results']
+        self.assertEqual([log['changes']['due_date']['new'] for log in cold], ['2030-01-01'])
+        self.assertEqual(cold[0]['user_email'], 'ana@example.com')
+        # The full values are archived, not the empty diff-only columns
+        self.assertEqual(cold[0]['old_values']['due_date'], str(invoice.due_date))
+        self.assertEqual(cold[0]['new_values']['due_date'], '2030-01-01')
+        self.assertEqual(cold[0]['new_values']['invoice_number'], 'P-1')
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class ReconciliationTests(BillingTestCase):
+    def test_payments_maintain_balance_and_status(self):
+        invoice = self.make_invoice('R-1', items=3, status='sent')
+        url = f'/api/invoices/{invoice.id}/payments/'
+
+        response = self.client.post(url, {'amount': '10.00', 'reference': 'R-1'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['status'], 'partially_paid')
+        self.assertEqual(response.json()['balance_due'], '20.00')
+
+        self.client.post(url, {'amount': '20.00'}, format='json')
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.status, invoice.amount_paid, invoice.balance_due), ('paid', Decimal('30.00'), 0))
+        self.assertEqual(len(self.client.get(url).json()['results']), 2)
+        self.assertEqual(
+            list(invoice.audit_logs.filter(action='status_changed').values_list('changes__status__new', flat=True)
+                 .order_by('id')),
+            ['partially_paid', 'paid'],
+        )
+
+    def test_drafts_do_not_take_payments(self):
+        invoice = self.make_invoice('R-1', items=1)
+        response = self.client.post(f'/api/invoices/{invoice.id}/payments/', {'amount': '10.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_migration_backfills_balances(self):
+        invoices = [self.make_invoice(f'R-{n}', items=2, status='sent') for n in range(3)]
+        Payment.objects.create(invoice=invoices[1], amount=Decimal('5.00'))
+        Payment.objects.create(invoice=invoices[2], amount=Decimal('20.00'))
+        Invoice.objects.update(amount_paid=Decimal('0.00'), balance_due=Decimal('0.00'))
+
+        backfill_balances(django_apps, None, batch_size=2)
+        self.assertEqual(
+            list(Invoice.objects.order_by('id').values_list('amount_paid', 'balance_due')),
+            [(0, 20), (5, 15), (20, 0)],
+        )
+
+    def test_statement_is_matched_by_reference_and_idempotent(self):
+        paid = self.make_invoice('R-1', items=2, status='sent')
+        partial = self.make_invoice('R-2', items=2, status='overdue')
+        self.make_invoice('R-3', items=1)
+        self.make_invoice('R-4', items=1, status='cancelled')
+        statement = (
+            'reference,amount,paid_at\n'
+            'R-1,20.00,2025-03-01\n'
+            'R-2,5.00,2025-03-01T10:00:00Z\n'
+            'R-3,10.00,2025-03-01\n'
+            'NOPE,1.00,2025-03-01\n'
+            'R-2,abc,2025-03-01\n'
+            'R-4,10.00,2025-03-01\n'
+            'R-2,5.00,\n'
+            'R-2,NaN,2025-03-01\n'
+            'R-2,Infinity,2025-03-01\n'
+        )
+
+        def upload():
+            return self.client.post('/api/invoices/reconcile/', {
+                'file': SimpleUploadedFile('statement.csv', statement.encode()),
+            })
+
+        result = upload().json()
+        self.assertEqual((result['matched'], result['unmatched_count'], result['status_changes']), (2, 7, 2))
+        self.assertEqual([line['line'] for line in result['unmatched']], [4, 5, 6, 7, 8, 9, 10])
+        self.assertEqual(result['unmatched'][0]['error'], 'Cannot record payments on a draft invoice')
+
+        statuses = dict(Invoice.objects.values_list('invoice_number', 'status'))
+        self.assertEqual(statuses, {'R-1': 'paid', 'R-2': 'partially_paid', 'R-3': 'draft', 'R-4': 'cancelled'})
+        self.assertFalse(Payment.objects.filter(invoice__status__in=('draft', 'cancelled')).exists())
+
+        result = upload().json()
+        self.assertEqual((result['matched'], result['duplicates'], result['unmatched_count']), (0, 2, 7))
+        self.assertEqual(partial.payments.count(), 1)
+        self.assertEqual(paid.payments.get().reference, 'R-1')
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class OverdueSweepTests(BillingTestCase):
+    def test_sweep_marks_past_due_sent_invoices_in_batches(self):
+        today = timezone.localdate()
+        for n in range(5):
+            self.make_invoice(f'O-{n}', status='sent', due_date=today - timedelta(days=n + 1))
+        self.make_invoice('O-due-today', status='sent', due_date=today)
+        self.make_invoice('O-draft', due_date=today - timedelta(days=3))
+        self.make_invoice('O-paid', status='paid', due_date=today - timedelta(days=3))
+
+        self.assertEqual(list(mark_overdue(today, batch_size=2)), [2, 2, 1])
+        self.assertEqual(
+            sorted(Invoice.objects.filter(status='overdue').values_list('invoice_number', flat=True)),
+            [f'O-{n}' for n in range(5)],
+        )
+        self.assertEqual(InvoiceAuditLog.objects.filter(action='status_changed', user=None).count(), 5)
+
+        # A second run finds nothing left to do
+        self.assertEqual(list(mark_overdue(today)), [])
+        self.assertEqual(InvoiceAuditLog.objects.count(), 5)
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class AnalyticsRollupTests(BillingTestCase):
+    def assertRollupsMatchRebuild(self):
+        def normalize(rows):
+            return sorted(tuple(sorted(row.items())) for row in rows)
+
+        revenue, receivables = compute_rollups()
+        self.assertEqual(
+            normalize(RevenueRollup.objects.values(
+                'company_id', 'period', 'status', 'invoice_count', 'total_amount', 'amount_paid', 'balance_due',
+            )),
+            normalize(revenue),
+        )
+        self.assertEqual(
+            normalize(ReceivableRollup.objects.values('company_id', 'due_date', 'invoice_count', 'balance_due')),
+            normalize(receivables),
+        )
+
+    def test_rollups_equal_full_aggregation_after_random_edits(self):
+        other = Company.objects.create(owner=self.user, name='Globex')
+        today = timezone.localdate()
+        for seed in range(3):
+            rng = random.Random(seed)
+            invoices = []
+            for step in range(40):
+                op = rng.choice(['create', 'item', 'delete_item', 'pay', 'edit', 'status', 'sweep', 'delete'])
+                invoice = rng.choice(invoices) if invoices else None
+                if op == 'create' or invoice is None:
+                    invoices.append(Invoice.objects.create(
+                        owner=self.user, company=rng.choice([self.company, other]), invoice_number=f'AN-{seed}-{step}',
+                        status=rng.choice(['draft', 'sent']),
+                        issue_date=today - timedelta(days=rng.randrange(120)),
+                        due_date=today + timedelta(days=rng.randrange(-150, 30)),
+                    ))
+                elif op == 'item':
+                    invoice.items.create(description='Work', quantity=rng.randint(1, 5), unit_price=Decimal(rng.randint(1, 99)))
+                elif op == 'delete_item' and invoice.items.exists():
+                    invoice.items.first().delete()
+                elif op == 'pay' and invoice.status != 'draft':
+                    Payment.objects.create(invoice=invoice, amount=Decimal(rng.randint(1, 50)))
+                    settle_invoices([invoice.pk])
+                elif op == 'edit':
+                    invoice.refresh_from_db()
+                    invoice.company = rng.choice([self.company, other])
+                    invoice.issue_date = str(today - timedelta(days=rng.randrange(120)))
+                    invoice.due_date = today + timedelta(days=rng.randrange(-150, 30))
+                    invoice.save()
+                elif op == 'status':
+                    Invoice.objects.filter(pk=invoice.pk).update(status=rng.choice(['sent', 'cancelled', 'draft']))
+                elif op == 'sweep':
+                    list(mark_overdue(today))
+                elif op == 'delete' and not invoice.payments.exists():
+                    invoice.delete()
+                    invoices.remove(invoice)
+            self.assertRollupsMatchRebuild()
+
+        rebuild_rollups()
+        self.assertRollupsMatchRebuild()
+
+    def test_updates_of_other_fields_leave_rollups_alone(self):
+        invoice = self.make_invoice('AR-1', items=1)
+        with self.assertNumQueries(1):
+            Invoice.objects.filter(pk=invoice.pk).update(updated_at=timezone.now())
+        self.assertRollupsMatchRebuild()
+
+    def test_concurrent_refresh_of_one_month_does_not_conflict(self):
+        self.make_invoice('AR-1', items=1, issue_date='2025-03-05', due_date='2025-04-05')
+        rollups = RevenueRollup.objects.filter
+        interleaved = []
+
+        def concurrent_writer(*args, **kwargs):
+            if interleaved:
+                return rollups(*args, **kwargs)
+            # This write's UPDATE finds no row, then a second writer creates it before the INSERT
+            interleaved.append(True)
+            self.make_invoice('AR-3', items=2, status='sent', issue_date='2025-03-20', due_date='2025-04-05')
+            return rollups(pk__in=[])
+
+        with patch.object(RevenueRollup.objects, 'filter', side_effect=concurrent_writer):
+            self.make_invoice('AR-2', items=1, status='sent', issue_date='2025-03-10', due_date='2025-04-05')
+        self.assertTrue(interleaved)
+        self.assertRollupsMatchRebuild()
+        self.assertEqual(RevenueRollup.objects.get(status='sent').invoice_count, 2)
+
+    def test_writes_apply_deltas_instead_of_reaggregating(self):
+        invoice = self.make_invoice('AR-1', items=1, status='sent', issue_date='2025-03-05', due_date='2025-04-05')
+        self.make_invoice('AR-2', items=2, status='sent', issue_date='2025-03-20', due_date='2025-04-05')
+        with CaptureQueriesContext(connection) as queries:
+            Invoice.objects.filter(pk=invoice.pk).update(status='paid')
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertFalse([q for q in sql if 'SUM(' in q or 'billing_company' in q])
+        self.assertRollupsMatchRebuild()
+
+        Invoice.objects.filter(pk=invoice.pk).update(status='sent')
+        invoice.delete()
+        self.assertRollupsMatchRebuild()
+        self.assertEqual(RevenueRollup.objects.get().invoice_count, 1)
+
+    def test_reports_answer_from_rollups(self):
+        today = date(2025, 6, 30)
+        self.make_invoice('AN-1', items=2, status='sent', issue_date='2025-05-10', due_date='2025-05-20')
+        self.make_invoice('AN-2', items=1, status='overdue', issue_date='2025-03-01', due_date='2025-03-15')
+        self.make_invoice('AN-3', items=3, status='paid', issue_date='2025-05-02', due_date='2025-07-01')
+        self.make_invoice('AN-4', items=1, status='sent', issue_date='2025-06-01', due_date='2025-07-15')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/invoices/analytics/revenue/?group_by=period,status&issue_date_from=2025-05-01')
+        self.assertEqual(response.json()['results'], [
+            {'period': '2025-05-01', 'status': 'paid', 'invoice_count': 1, 'total_amount': '30.00',
+             'amount_paid': '0.00', 'balance_due': '30.00'},
+            {'period': '2025-05-01', 'status': 'sent', 'invoice_count': 1, 'total_amount': '20.00',
+             'amount_paid': '0.00', 'balance_due': '20.00'},
+            {'period': '2025-06-01', 'status': 'sent', 'invoice_count': 1, 'total_amount': '10.00',
+             'amount_paid': '0.00', 'balance_due': '10.00'},
+        ])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/invoices/analytics/receivables/?as_of={today}')
+        totals = response.json()['results'][0]
+        self.assertEqual((totals['invoice_count'], totals['balance_due']), (3, '40.00'))
+        self.assertEqual(
+            {name: bucket['balance_due'] for name, bucket in totals['aging'].items()},
+            {'current': '10.00', '0_30': '0.00', '31_60': '20.00', '61_90': '0.00', '90_plus': '10.00'},
+        )
+        self.assertEqual(self.client.get('/api/invoices/analytics/revenue/?group_by=month').status_code, 400)
+
+
+@override_settings(AUDIT_LOG_ASYNC=False, INVOICE_NUMBER_FORMAT='INV-{company}-{year}-{seq:06}', INVOICE_NUMBER_BLOCK_SIZE=1)
+class InvoiceNumberingTests(BillingTestCase):
+    def test_sequences_are_per_company_and_year(self):
+        other = Company.objects.create(name='Globex')
+        c, o = self.company.pk, other.pk
+        self.assertEqual(allocate_invoice_numbers(c, 2, '2025-03-01'), [f'INV-{c}-2025-000001', f'INV-{c}-2025-000002'])
+        self.assertEqual(allocate_invoice_numbers(o, issue_date='2025-03-01'), [f'INV-{o}-2025-000001'])
+        self.assertEqual(allocate_invoice_numbers(c, issue_date='2026-01-02'), [f'INV-{c}-2026-000001'])
+        self.assertEqual(allocate_invoice_numbers(c, issue_date='2025-12-31'), [f'INV-{c}-2025-000003'])
+
+    def test_rolled_back_numbers_are_reused(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            allocate_invoice_numbers(self.company.pk, issue_date='2025-03-01')
+            raise RuntimeError
+        self.assertEqual(allocate_invoice_numbers(self.company.pk, issue_date='2025-03-01')[0][-6:], '000001')
+
+    def test_blocks_reserve_the_row_once_per_block(self):
+        blocks = SequenceBlocks(block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(blocks.take(self.company.pk, '2025'), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual([blocks.take(self.company.pk, '2025') for _ in range(9)], list(range(2, 11)))
+        self.assertEqual(blocks.take(self.company.pk, '2025', count=3), 11)
+
+    def test_create_allocates_a_number(self):
+        response = self.client.post('/api/invoices/', {
+            'company': self.company.pk, 'issue_date': '2025-04-01', 'due_date': '2025-05-01',
+            'items': [{'description': 'Work', 'quantity': 2, 'unit_price': '15.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['invoice_number'], f'INV-{self.company.pk}-2025-000001')
+        self.assertEqual(response.json()['total_amount'], '30.00')
+
+        response = self.client.post('/api/invoices/', {
+            'company': self.company.pk, 'invoice_number': f'INV-{self.company.pk}-2025-000001',
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+
+    def test_numbers_taken_by_clients_are_skipped(self):
+        c = self.company.pk
+        for number in (f'INV-{c}-2025-000001', f'INV-{c}-2025-000003'):
+            response = self.client.post('/api/invoices/', {
+                'company': c, 'invoice_number': number, 'issue_date': '2025-04-01',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        numbers = []
+        for _ in range(2):
+            response = self.client.post('/api/invoices/', {'company': c, 'issue_date': '2025-04-01'}, format='json')
+            self.assertEqual(response.status_code, 201)
+            numbers.append(response.json()['invoice_number'])
+        self.assertEqual(numbers, [f'INV-{c}-2025-000002', f'INV-{c}-2025-000004'])
+        self.assertEqual(
+            allocate_invoice_numbers(c, 2, '2025-04-01'), [f'INV-{c}-2025-000005', f'INV-{c}-2025-000006'],
+        )
+
+
+class InvoiceDocumentTests(BillingTestCase):
+    def setUp(self):
+        super().setUp()
+        renders = tempfile.TemporaryDirectory()
+        self.addCleanup(renders.cleanup)
+        settings_override = override_settings(INVOICE_RENDER_DIR=renders.name, INVOICE_RENDER_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_pdf_cross_reference_table_points_at_objects(self):
+        invoice = self.make_invoice('D-1', items=120)
+        pdf = render_pdf(render_context(Invoice.objects.for_detail().select_related('created_by').get(pk=invoice.pk)))
+
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        xref = int(pdf.rsplit(b'startxref\n', 1)[1].split(b'\n')[0])
+        entries = pdf[xref:].split(b'\n')[3:]
+        number = 1
+        for entry in entries:
+            if not entry.endswith(b' n '):
+                break
+            self.assertTrue(pdf[int(entry[:10]):].startswith(b'%d 0 obj' % number))
+            number += 1
+        self.assertEqual(number - 1, int(pdf.split(b'/Size ')[1].split(b' ')[0]) - 1)
+        # 120 items do not fit on one page
+        self.assertGreater(int(pdf.split(b'/Count ')[1].split(b' ')[0]), 1)
+
+    def test_documents_are_rendered_once_per_content(self):
+        self.user.business_name = 'Ana Consulting'
+        self.user.save()
+        invoice = self.make_invoice('D-1', items=2)
+        url = f'/api/invoices/{invoice.id}/document/'
+
+        with patch('billing.rendering.render_pdf', wraps=render_pdf) as render:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertIn('no-cache', response['Cache-Control'])
+            etag = response['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(render.call_count, 1)
+
+            # New content, new digest
+            InvoiceItem.objects.create(invoice=invoice, description='Extra', quantity=1, unit_price=Decimal('1.00'))
+            response = self.client.get(url)
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(render.call_count, 2)
+
+        html = b''.join(self.client.get(f'{url}?output=html').streaming_content).decode()
+        self.assertIn('Ana Consulting', html)
+        self.assertIn('21.00', html)
+        self.assertEqual(self.client.get(f'{url}?output=docx').status_code, 400)
+
+    def test_superseded_renders_are_pruned(self):
+        invoice = self.make_invoice('D-1', items=1)
+
+        def store():
+            context = render_context(Invoice.objects.for_detail().select_related('created_by').get(pk=invoice.pk))
+            return rendered_path(render_to_store(context, 'pdf'), 'pdf')
+
+        old = store()
+        os.utime(old, (0, 0))
+        InvoiceItem.objects.create(invoice=invoice, description='Extra', quantity=1, unit_price=Decimal('1.00'))
+        current = store()
+        os.utime(current, (0, 0))
+        # Rendered on demand while the command ran
+        fresh = old.with_name(f'{"0" * 64}.pdf')
+        fresh.write_bytes(b'%PDF')
+        os.utime(fresh, (time.time() + 60, time.time() + 60))
+
+        out = StringIO()
+        call_command('render_invoices', prune=True, workers=1, stdout=out)
+        self.assertIn('Pruned 1 superseded renders', out.getvalue())
+        self.assertEqual((old.exists(), current.exists(), fresh.exists()), (False, True, True))
+        with self.assertRaises(CommandError):
+            call_command('render_invoices', prune=True, status='sent', stdout=StringIO())
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class AsyncReadViewTests(BillingTestCase):
+    def test_bearer_token_is_required(self):
+        invoice = self.make_invoice('AS-1')
+        url = f'/api/invoices/{invoice.id}/'
+        anonymous = APIClient()
+        response = anonymous.get(url)
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+        anonymous.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(anonymous.get(url).json()['code'], 'token_not_valid')
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.get(f'{url}audit-log/').status_code, 401)
+
+    def test_payloads_match_sync_views(self):
+        invoice = self.make_invoice('AS-1', items=3)
+        self.client.put(f'/api/invoices/{invoice.id}/edit/', {'due_date': '2030-01-01'}, format='json')
+        factory = APIRequestFactory()
+
+        for path, sync_view in (('', invoice_detail), ('audit-log/', invoice_audit_log)):
+            url = f'/api/invoices/{invoice.id}/{path}'
+            request = factory.get(url)
+            force_authenticate(request, self.user)
+            cache.clear()
+            expected = sync_view(request, invoice_id=invoice.id)
+            cache.clear()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), json.loads(expected.content))
+            self.assertEqual(response['ETag'], expected['ETag'])
+
+        response = self.client.get('/api/invoices/999/audit-log/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('detail', response.json())
+
+
+@override_settings(AUDIT_LOG_ASYNC=False, INVOICE_FEED_COALESCE=0.05)
+class InvoiceFeedTests(BillingTestCase):
+    def connect(self, invoice_id, subprotocols=None):
+        if subprotocols is None:
+            subprotocols = ['bearer', str(AccessToken.for_user(self.user))]
+        return WebsocketCommunicator(application, f'/ws/invoices/{invoice_id}/', subprotocols=subprotocols)
+
+    async def test_rejects_missing_token_and_unknown_invoice(self):
+        invoice = await sync_to_async(self.make_invoice)('F-1')
+        for communicator, code in (
+            (self.connect(invoice.id, subprotocols=[]), 4401),
+            (self.connect(invoice.id, subprotocols=['bearer', 'not-a-token']), 4401),
+            (self.connect(999), 4404),
+        ):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await communicator.receive_output())['code'], code)
+
+    async def test_rapid_audit_writes_coalesce_into_one_message(self):
+        invoice = await sync_to_async(self.make_invoice)('F-1')
+        other = await sync_to_async(self.make_invoice)('F-2')
+        communicator = self.connect(invoice.id)
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual((connected, subprotocol), (True, 'bearer'))
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscribed', 'invoice': invoice.id})
+
+        def write():
+            with self.captureOnCommitCallbacks(execute=True):
+                record_audit_events([
+                    audit_event(invoice.id, self.user, 'updated', {}),
+                    audit_event(other.id, self.user, 'updated', {}),
+                ])
+            with self.captureOnCommitCallbacks(execute=True):
+                record_audit_events([
+                    audit_event(invoice.id, self.user, 'item_added', {}),
+                    audit_event(invoice.id, self.user, 'updated', {}),
+                ])
+
+        await sync_to_async(write)()
+        self.assertEqual(await communicator.receive_json_from(), {
+            'type': 'invoice.changed', 'invoice': invoice.id, 'actions': ['item_added', 'updated'], 'events': 3,
+        })
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+        await communicator.send_json_to({'type': 'ping'})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'pong'})
+        await communicator.disconnect()
+
+
+@override_settings(AUDIT_LOG_ASYNC=False, INVOICE_RENDER_WORKERS=0)
+class TenantIsolationTests(BillingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_user = User.objects.create_user(name='Bo', email='bo@example.com', password='secret')
+        cls.other_company = Company.objects.create(owner=cls.other_user, name='Initech', tax_id='SI999')
+
+    def setUp(self):
+        super().setUp()
+        renders = tempfile.TemporaryDirectory()
+        self.addCleanup(renders.cleanup)
+        settings_override = override_settings(INVOICE_RENDER_DIR=renders.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_foreign_invoice(self, number, **kwargs):
+        return Invoice.objects.create(
+            owner=self.other_user, company=self.other_company, invoice_number=number, created_by=self.other_user,
+            **kwargs
+        )
+
+    def test_list_and_analytics_only_show_own_invoices(self):
+        own = self.make_invoice('T-1', items=1, status='sent')
+        self.make_foreign_invoice('T-2', status='sent')
+        response = self.client.get('/api/invoices/')
+        self.assertEqual([row['id'] for row in response.json()['results']], [own.id])
+        export = self.client.get('/api/invoices/export/?output=csv')
+        self.assertNotIn('T-2', b''.join(export.streaming_content).decode())
+        companies = {row['company'] for row in self.client.get(
+            '/api/invoices/analytics/receivables/?group_by=company'
+        ).json()['results']}
+        self.assertEqual(companies, {self.company.id})
+
+    def test_foreign_invoices_are_not_found(self):
+        foreign = self.make_foreign_invoice('T-2', status='sent')
+        base = f'/api/invoices/{foreign.id}'
+        for method, url, data in (
+            ('get', f'{base}/', None),
+            ('get', f'{base}/audit-log/', None),
+            ('get', f'{base}/audit-log/?archived=true', None),
+            ('get', f'{base}/payments/', None),
+            ('post', f'{base}/payments/', {'amount': '1.00'}),
+            ('patch', f'{base}/edit/', {'due_date': '2030-01-01'}),
+            ('get', f'{base}/document/?output=html', None),
+        ):
+            with self.subTest(method=method, url=url):
+                response = getattr(self.client, method)(url, data, format='json')
+                self.assertEqual(response.status_code, 404)
+        # A guessed version is not confirmed with a 304
+        response = self.client.get(
+            f'{base}/', HTTP_IF_NONE_MATCH=f'"detail-{foreign.id}-{foreign.updated_at.timestamp():.6f}"'
+        )
+        self.assertEqual(response.status_code, 404)
+        foreign.refresh_from_db()
+        self.assertEqual((foreign.amount_paid, foreign.payments.count()), (0, 0))
+
+    def test_new_invoices_belong_to_the_creator(self):
+        response = self.client.post('/api/invoices/', {'company': self.other_company.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/invoices/', {'company': self.company.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Invoice.objects.get(pk=response.json()['id']).owner, self.user)
+
+    def test_import_and_reconcile_stay_within_the_tenant(self):
+        self.make_foreign_invoice('T-2', status='sent', total_amount=Decimal('10.00'), balance_due=Decimal('10.00'))
+        record = {'invoice_number': 'T-3', 'company': {'name': 'Initech', 'tax_id': 'SI999'}}
+        result = self.client.post('/api/invoices/import/', {
+            'file': SimpleUploadedFile('invoices.ndjson', json.dumps(record).encode()),
+        }).json()
+        self.assertEqual(result['created'], 1)
+        imported = Invoice.objects.select_related('company').get(invoice_number='T-3')
+        self.assertEqual((imported.owner, imported.company.owner), (self.user, self.user))
+        self.assertNotEqual(imported.company, self.other_company)
+
+        result = self.client.post('/api/invoices/reconcile/', {
+            'file': SimpleUploadedFile('statement.csv', b'reference,amount,paid_at\nT-2,10.00,2025-03-01\n'),
+        }).json()
+        self.assertEqual((result['matched'], result['unmatched_count']), (0, 1))
+        self.assertFalse(Payment.objects.exists())
+
+
+@override_settings(AUDIT_LOG_ASYNC=False)
+class InvoiceSearchTests(BillingTestCase):
+    def search(self, query, **params):
+        response = self.client.get('/api/invoices/search/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def numbers(self, query, **params):
+        return [row['invoice_number'] for row in self.search(query, **params)['results']]
+
+    def test_prefixes_match_across_fields_ranked_by_field(self):
+        globex = Company.objects.create(owner=self.user, name='Globex', tax_id='SI777')
+        website = self.make_invoice('S-100')
+        website.items.create(description='Website redesign', quantity=1, unit_price=Decimal('10.00'))
+        hosting = self.make_invoice('S-200')
+        hosting.company = globex
+        hosting.save()
+        hosting.items.create(description='Hosting for the Acme website', quantity=1, unit_price=Decimal('10.00'))
+        Payment.objects.create(invoice=hosting, amount=Decimal('5.00'), reference='TRX-42')
+
+        self.assertEqual(self.numbers('acme'), ['S-100', 'S-200'])
+        self.assertEqual(self.numbers('webs red'), ['S-100'])
+        self.assertEqual(self.numbers('S-2'), ['S-200'])
+        self.assertEqual(self.numbers('trx-42'), ['S-200'])
+        self.assertEqual(self.numbers('si77'), ['S-200'])
+        self.assertEqual(self.numbers('nothing'), [])
+
+    def test_index_follows_writes(self):
+        invoice = self.make_invoice('S-1', items=1)
+        item = invoice.items.get()
+        item.description = 'Consulting'
+        item.save()
+        self.assertEqual(self.numbers('consult'), ['S-1'])
+
+        invoice.invoice_number = 'RENAMED-1'
+        invoice.save(update_fields=['invoice_number'])
+        self.company.name = 'Initech'
+        self.company.save()
+        self.assertEqual(self.numbers('renamed initech'), ['RENAMED-1'])
+        self.assertEqual(self.numbers('acme'), [])
+
+        item.delete()
+        invoice.delete()
+        self.assertEqual(self.numbers('renamed'), [])
+
+    def test_company_is_reindexed_only_when_its_name_or_tax_id_changes(self):
+        self.make_invoice('S-1')
+        self.company.address = 'Main street 1'
+        with CaptureQueriesContext(connection) as queries:
+            self.company.save()
+        self.assertFalse([q for q in queries.captured_queries if 'billing_invoicesearchdocument' in q['sql']])
+
+        self.company.tax_id = 'SI999'
+        with CaptureQueriesContext(connection) as queries:
+            self.company.save()
+        self.assertTrue([q for q in queries.captured_queries if 'billing_invoicesearchdocument' in q['sql']])
+        self.assertEqual(self.numbers('si999'), ['S-1'])
+
+    def test_typos_are_corrected_when_nothing_matches(self):
+        invoice = self.make_invoice('S-1')
+        invoice.items.create(description='Consulting hours', quantity=1, unit_price=Decimal('10.00'))
+        self.assertFalse(self.search('consult')['corrected'])
+        for query in ('consutling', 'conslt', 'cosulting hours'):
+            with self.subTest(query=query):
+                result = self.search(query)
+                self.assertEqual(([row['id'] for row in result['results']], result['corrected']), ([invoice.id], True))
+
+    def test_only_own_invoices_are_found(self):
+        other = User.objects.create_user(name='Bo', email='bo@example.com', password='secret')
+        company = Company.objects.create(owner=other, name='Acme')
+        Invoice.objects.create(owner=other, company=company, invoice_number='S-9', created_by=other)
+        self.make_invoice('S-1')
+        self.assertEqual(self.numbers('acme'), ['S-1'])
+        self.assertEqual(search_invoices(other, 'acme', 10), ([Invoice.objects.get(invoice_number='S-9').id], False))
+        # The owner column only scopes the search, it is not searched itself
+        self.assertEqual(self.numbers(self.user.pk.hex[:6]), [])
+
+    def test_results_are_paginated(self):
+        for n in range(5):
+            self.make_invoice(f'S-{n}')
+        first = self.search('acme', limit=3)
+        self.assertEqual(len(first['results']), 3)
+        second = self.search('acme', limit=3, cursor=first['next_cursor'])
+        self.assertEqual((len(second['results']), second['next_cursor']), (2, None))
+        self.assertEqual(
+            {row['id'] for row in first['results'] + second['results']},
+            set(Invoice.objects.values_list('id', flat=True)),
+        )
+        self.assertEqual(self.client.get('/api/invoices/search/', {'q': ' - '}).status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/search/', {'q': 'acme', 'cursor': 'nope'}).status_code, 400)
+
+
+class SyntheticDataTests(BillingTestCase):
+    def snapshot(self):
+        return sorted(
+            Invoice.objects.filter(invoice_number__startswith='SYN3-')
+            .values_list('invoice_number', 'company__name', 'status', 'item_count', 'total_amount', 'amount_paid')
+        )
+
+    def test_generated_data_is_reproducible_and_consistent(self):
+        counts = generate(0.1, seed=3).as_dict()
+        self.assertEqual((counts['users'], counts['invoices']), (1, 200))
+        self.assertEqual(counts['items'], InvoiceItem.objects.filter(invoice__invoice_number__startswith='SYN3-').count())
+        for invoice in Invoice.objects.filter(invoice_number__startswith='SYN3-').annotate(
+            items_total=Sum(F('items__quantity') * F('items__unit_price')),
+        ):
+            self.assertEqual(invoice.total_amount, invoice.items_total or Decimal('0.00'))
+            self.assertEqual(invoice.amount_paid, sum(payment.amount for payment in invoice.payments.all()))
+            self.assertEqual(invoice.balance_due == 0, invoice.status == 'paid' or not invoice.total_amount)
+        revenue = RevenueRollup.objects.filter(company__owner__email='synthetic-3-0@example.com')
+        self.assertEqual(revenue.aggregate(count=Sum('invoice_count'))['count'], 200)
+
+        snapshot = self.snapshot()
+        delete_synthetic_data(3)
+        self.assertEqual(self.snapshot(), [])
+        self.assertEqual(generate(0.1, seed=3).as_dict(), {**counts, 'users': 0})
+        self.assertEqual(self.snapshot(), snapshot)
+
+    @override_settings(INVOICE_RENDER_WORKERS=0)
+    def test_benchmark_covers_every_endpoint(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(INVOICE_RENDER_DIR=directory):
+            output = os.path.join(directory, 'result.json')
+            call_command('benchmark_endpoints', seed=4, scale=0.2, requests=2, no_http=True, output=output, stdout=StringIO())
+            with open(output) as result:
+                results = json.load(result)
+        self.assertEqual(set(results['client']), set(url_names()))
+        self.assertEqual(results['client']['invoice_list']['queries'], 1)
+
+
+class InstrumentationTests(BillingTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_requests_report_server_timing_and_metrics(self):
+        invoice = self.make_invoice('M-1', items=3)
+        timing = self.client.get(f'/api/invoices/{invoice.id}/')['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="\d+ queries", auth;dur=[\d.]+, serialize;dur=[\d.]+, total;dur=')
+
+        scraper = APIClient()
+        # Not public by default
+        self.assertEqual(scraper.get('/metrics/').status_code, 403)
+        with override_settings(DEBUG=True):
+            metrics = scraper.get('/metrics/').content.decode()
+        self.assertIn('http_request_duration_seconds_count{endpoint="invoice_detail",method="GET"} 1', metrics)
+        self.assertIn('http_responses_total{endpoint="invoice_detail",method="GET",status="200"} 1', metrics)
+        with override_settings(METRICS_TOKEN='scrape'):
+            self.assertEqual(scraper.get('/metrics/').status_code, 401)
+            self.assertEqual(scraper.get('/metrics/', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+
+    def test_repeated_query_shapes_are_flagged(self):
+        invoices = [self.make_invoice(f'M-{n}') for n in range(12)]
+
+        def view(request):
+            # A lookup per row, the N+1 pattern
+            for invoice in invoices:
+                Invoice.objects.filter(pk=invoice.pk).exists()
+            return HttpResponse()
+
+        with self.assertLogs('backend.requests', 'WARNING') as logs:
+            InstrumentationMiddleware(view)(APIRequestFactory().get('/n-plus-one/'))
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['endpoint'], line['queries']), ('unmatched', 12))
+        self.assertEqual([repeat['count'] for repeat in line['n_plus_one']], [12])
+        self.assertIn('http_request_n_plus_one_total{endpoint="unmatched",method="GET"} 1', registry.render())
+
+
+@override_settings(DATABASE_REPLICA_ALIASES=['replica_test'])
+class ReplicaRoutingTests(BillingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(_down_until.clear)
+
+    def route(self, method, user=None, write=False):
+        """The database a request's reads go to after authentication (and a write, with `write`)"""
+        routed = []
+
+        def view(request):
+            if user is not None:
+                request.user = user
+            if write:
+                router.db_for_write(Invoice)
+            routed.append(router.db_for_read(Invoice))
+            return HttpResponse()
+
+        ReplicaMiddleware(view)(getattr(APIRequestFactory(), method)('/'))
+        return routed[0]
+
+    @patch('backend.replicas._available', return_value=True)
+    def test_reads_leave_the_replica_after_a_write(self, available):
+        self.assertEqual((self.route('get'), self.route('get', self.user)), ('replica_test', 'replica_test'))
+        self.assertEqual(router.db_for_read(Invoice), 'default')
+        self.assertEqual(self.route('get', self.user, write=True), 'default')
+        self.assertEqual(self.route('get', self.user), 'default')
+        cache.delete(pin_cache_key(self.user.pk))
+        self.assertEqual(self.route('post', self.user), 'default')
+        self.assertEqual(self.route('get', self.user), 'default')
+
+        cache.delete(pin_cache_key(self.user.pk))
+        invoice = self.make_invoice('R-1')
+        self.assertEqual(self.client.patch(f'/api/invoices/{invoice.id}/edit/', {'due_date': '2030-01-01'}).status_code, 200)
+        self.assertEqual(self.route('get', self.user), 'default')
+
+    def test_unavailable_replica_falls_back_to_the_primary(self):
+        with self.assertLogs('backend.replicas', 'WARNING'):
+            self.assertEqual(self.route('get', self.user), 'default')
+        # Not retried until DATABASE_REPLICA_RETRY_SECONDS passed
+        with self.assertNoLogs('backend.replicas', 'WARNING'):
+            self.assertEqual(self.route('get', self.user), 'default')
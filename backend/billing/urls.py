@@ -1,8 +1,25 @@
+from django.conf import settings
 from django.urls import path
-from billing.api import invoice_detail, invoice_update, invoice_audit_log
+from billing.api import (
+    invoice_list, invoice_export, invoice_import, invoice_search, invoice_detail, invoice_update,
+    invoice_audit_log, invoice_payments, payment_reconcile, revenue_analytics, receivables_analytics, invoice_document,
+    invoice_detail_async, invoice_audit_log_async,
+)
+
+if settings.ASYNC_READ_VIEWS:
+    invoice_detail, invoice_audit_log = invoice_detail_async, invoice_audit_log_async
 
 urlpatterns = [
+    path('', invoice_list, name='invoice_list'),
+    path('export/', invoice_export, name='invoice_export'),
+    path('search/', invoice_search, name='invoice_search'),
+    path('import/', invoice_import, name='invoice_import'),
+    path('reconcile/', payment_reconcile, name='payment_reconcile'),
+    path('analytics/revenue/', revenue_analytics, name='revenue_analytics'),
+    path('analytics/receivables/', receivables_analytics, name='receivables_analytics'),
     path('<int:invoice_id>/', invoice_detail, name='invoice_detail'),
     path('<int:invoice_id>/edit/', invoice_update, name='invoice_update'),
     path('<int:invoice_id>/audit-log/', invoice_audit_log, name='invoice_audit_log'),
+    path('<int:invoice_id>/payments/', invoice_payments, name='invoice_payments'),
+    path('<int:invoice_id>/document/', invoice_document, name='invoice_document'),
 ]
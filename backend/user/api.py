@@ -1,10 +1,14 @@
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from django.http import JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
 
+from user.auth import CachedJWTAuthentication, async_api_view
+from user.avatars import check_avatar, stage_avatar
 from user.models import User
-from user.serializers import UserDetailSerializer
+from user.serializers import UserDetailSerializer, UserUpdateSerializer
 
 
 @api_view(['GET'])
@@ -16,29 +20,44 @@ def user_detail(request, pk):
   return JsonResponse(serializer.data,safe=False)
 
 
-@api_view(['POST'])
-@authentication_classes([JWTAuthentication])
+@require_GET
+@async_api_view(authenticated=False)
+async def user_detail_async(request, pk):
+  user = await aget_object_or_404(User, pk=pk)
+  serializer = UserDetailSerializer(user,many=False)
+  return JsonResponse(serializer.data,safe=False)
+
+
+@api_view(['POST', 'PATCH'])
+@authentication_classes([CachedJWTAuthentication])
 @permission_classes([IsAuthenticated])
 def edit_account(request):
-  user = request.user
+  """Partially update the account: only supplied fields are validated, only changed ones written"""
+  # Spool uploads to a temporary file rather than memory; set before request.data is read
+  request.upload_handlers = [TemporaryFileUploadHandler(request._request)]
+
+  # request.user is the cached principal; edit the full row
+  user = User.objects.get(pk=request.user.pk)
   
-  # Update user fields
-  user.name = request.data.get('name', user.name)
-  user.description = request.data.get('description', user.description)
-  user.business_name = request.data.get('business_name', user.business_name)
-  user.vat_number = request.data.get('vat_number', user.vat_number)
-  user.registration_number = request.data.get('registration_number', user.registration_number)
-  user.address = request.data.get('address', user.address)
-  user.city = request.data.get('city', user.city)
-  user.postal_code = request.data.get('postal_code', user.postal_code)
-  user.country = request.data.get('country', user.country)
-  user.phone = request.data.get('phone', user.phone)
+  serializer = UserUpdateSerializer(user, data=request.data, partial=True)
+  if not serializer.is_valid():
+    return JsonResponse({'error': serializer.errors}, status=400)
+  dirty = [field for field, value in serializer.validated_data.items() if getattr(user, field) != value]
   
-  # Handle avatar upload
-  if 'avatar' in request.FILES:
-    user.avatar = request.FILES['avatar']
+  avatar = request.FILES.get('avatar')
+  if avatar is not None:
+    try:
+      check_avatar(avatar)
+    except ValueError as e:
+      return JsonResponse({'error': str(e)}, status=400)
   
-  user.save()
+  # The avatar worker writes the avatar columns, so they are never part of this save
+  if dirty:
+    for field in dirty:
+      setattr(user, field, serializer.validated_data[field])
+    user.save(update_fields=dirty)
+  if avatar is not None:
+    stage_avatar(user, avatar)
   
   serializer = UserDetailSerializer(user, many=False)
-  return JsonResponse(serializer.data, safe=False)
\ No newline at end of file
+  return JsonResponse(serializer.data, safe=False)
@@ -0,0 +1,149 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404, JsonResponse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from backend.instrumentation import timer
+from user.models import PRINCIPAL_FIELDS, User, principal_cache_key
+
+
+def _cache():
+  return caches[settings.AUTH_PRINCIPAL_CACHE_ALIAS]
+
+
+def _principal_user(values):
+  # A real User with only the principal columns loaded: it can be assigned to foreign
+  # keys and audited as is, and any other field is fetched on first access
+  return User.from_db(DEFAULT_DB_ALIAS, PRINCIPAL_FIELDS, [values[field] for field in PRINCIPAL_FIELDS])
+
+
+def _principal_query(user_id):
+  # From the primary: the row is cached for everyone, and a lagging replica's copy would outlive the lag
+  return User.objects.using(DEFAULT_DB_ALIAS).filter(**{api_settings.USER_ID_FIELD: user_id}).values(*PRINCIPAL_FIELDS)
+
+
+def get_principal(user_id):
+  """
+  The user behind a token, holding only PRINCIPAL_FIELDS, from a short-lived cache.
+
+  Saves and updates of those fields drop the cached copy, so within one cache the
+  principal is never stale; across processes with a local-memory cache it can lag by
+  up to AUTH_PRINCIPAL_CACHE_TIMEOUT. None for unknown users.
+  """
+  key = principal_cache_key(user_id)
+  values = _cache().get(key)
+  if values is None:
+    values = _principal_query(user_id).first()
+    if values is None:
+      return None
+    _cache().set(key, values, settings.AUTH_PRINCIPAL_CACHE_TIMEOUT)
+  return _principal_user(values)
+
+
+async def aget_principal(user_id):
+  key = principal_cache_key(user_id)
+  values = await _cache().aget(key)
+  if values is None:
+    values = await _principal_query(user_id).afirst()
+    if values is None:
+      return None
+    await _cache().aset(key, values, settings.AUTH_PRINCIPAL_CACHE_TIMEOUT)
+  return _principal_user(values)
+
+
+def _token_user_id(validated_token):
+  try:
+    return validated_token[api_settings.USER_ID_CLAIM]
+  except KeyError:
+    raise InvalidToken("Token contained no recognizable user identification")
+
+
+def _check_principal(user):
+  if user is None:
+    raise AuthenticationFailed("User not found", code='user_not_found')
+  if not user.is_active:
+    raise AuthenticationFailed("User is inactive", code='user_inactive')
+  return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+  """
+  JWTAuthentication that trusts the signed token and takes the user from the
+  principal cache instead of loading the full row on every request. With
+  CHECK_REVOKE_TOKEN on, the password hash is needed, so it falls back to the database.
+  """
+
+  def authenticate(self, request):
+    with timer('auth'):
+      return super().authenticate(request)
+
+  def get_user(self, validated_token):
+    if api_settings.CHECK_REVOKE_TOKEN:
+      return super().get_user(validated_token)
+    return _check_principal(get_principal(_token_user_id(validated_token)))
+
+
+_jwt = CachedJWTAuthentication()
+
+
+async def aauthenticate_token(raw_token):
+  """
+  Validate a raw access token and return its active user, as CachedJWTAuthentication does.
+  Raises InvalidToken/AuthenticationFailed for a bad token or unknown user.
+  """
+  token = _jwt.get_validated_token(raw_token)
+  if api_settings.CHECK_REVOKE_TOKEN:
+    return await sync_to_async(_jwt.get_user)(token)
+  return _check_principal(await aget_principal(_token_user_id(token)))
+
+
+async def aauthenticate_jwt(request):
+  """
+  Authenticate a bearer access token the way JWTAuthentication does, with the user
+  loaded through the async ORM. Returns the active user or None when no token was sent.
+  """
+  with timer('auth'):
+    header = _jwt.get_header(request)
+    if header is None:
+      return None
+    raw_token = _jwt.get_raw_token(header)
+    if raw_token is None:
+      return None
+    return await aauthenticate_token(raw_token)
+
+
+def _unauthorized(detail):
+  # Same body DRF would send for the exception
+  response = JsonResponse(detail if isinstance(detail, dict) else {'detail': str(detail)}, status=401)
+  response['WWW-Authenticate'] = _jwt.authenticate_header(None)
+  return response
+
+
+def async_api_view(authenticated=True):
+  """
+  What api_view + JWTAuthentication/IsAuthenticated give the sync views, for plain
+  async views: bearer token auth (when `authenticated`) and DRF-shaped 401/404 bodies.
+  """
+  def decorator(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+      if authenticated:
+        try:
+          user = await aauthenticate_jwt(request)
+        except (AuthenticationFailed, InvalidToken) as e:
+          return _unauthorized(e.detail)
+        if user is None:
+          return _unauthorized("Authentication credentials were not provided.")
+        request.user = user
+      try:
+        return await view(request, *args, **kwargs)
+      except Http404 as e:
+        return JsonResponse({'detail': str(e) or "Not found."}, status=404)
+    return wrapper
+  return decorator
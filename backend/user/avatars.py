@@ -0,0 +1,172 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from user.models import User
+
+
+logger = logging.getLogger(__name__)
+
+# Formats accepted on upload, as Pillow names them
+AVATAR_INPUT_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF')
+
+# Every variant is written in each of these, so clients can pick WebP with a JPEG fallback
+AVATAR_OUTPUT_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def check_avatar(upload):
+  """
+  Reject uploads that are not a supported, reasonably sized image.
+
+  Only reads the header, so it is cheap enough to run in the request; raises ValueError.
+  """
+  if upload.size > settings.AVATAR_MAX_UPLOAD_SIZE:
+    raise ValueError(f"Avatar must be at most {settings.AVATAR_MAX_UPLOAD_SIZE // (1024 * 1024)} MB")
+  try:
+    with Image.open(upload) as image:
+      image_format, (width, height) = image.format, image.size
+  except (UnidentifiedImageError, Image.DecompressionBombError):
+    raise ValueError("Avatar must be a JPEG, PNG, WebP or GIF image")
+  finally:
+    upload.seek(0)
+  if image_format not in AVATAR_INPUT_FORMATS:
+    raise ValueError("Avatar must be a JPEG, PNG, WebP or GIF image")
+  if width * height > settings.AVATAR_MAX_PIXELS:
+    raise ValueError("Avatar dimensions are too large")
+
+
+def stage_avatar(user, upload):
+  """
+  Store the raw upload and queue it for processing once the transaction commits.
+
+  The upload is copied to storage chunk by chunk. The user keeps the current avatar
+  until the new one is processed.
+  """
+  staged = default_storage.save(f'uploads/avatars/incoming/{user.pk}-{uuid.uuid4().hex}', upload)
+  now = timezone.now()
+  User.objects.filter(pk=user.pk).update(avatar_pending=staged, avatar_pending_at=now)
+  user.avatar_pending, user.avatar_pending_at = staged, now
+  transaction.on_commit(lambda: submit_avatar(user.pk, staged))
+  return staged
+
+
+def _encode(image, image_format):
+  buffer = BytesIO()
+  if image_format == 'JPEG':
+    if image.mode == 'RGBA':
+      # JPEG has no alpha; flatten onto white rather than black
+      background = Image.new('RGB', image.size, 'white')
+      background.paste(image, mask=image.getchannel('A'))
+      image = background
+    image.save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+  else:
+    image.save(buffer, image_format, quality=80, method=4)
+  return buffer.getvalue()
+
+
+def render_avatar(source):
+  """
+  Decode an uploaded image and return {size name: {extension: bytes}}.
+
+  'full' fits within AVATAR_MAX_DIMENSION keeping the aspect ratio, the
+  AVATAR_THUMBNAIL_SIZES are square center crops. Orientation is applied and no
+  metadata (EXIF, ICC, comments) is carried over.
+  """
+  largest = settings.AVATAR_MAX_DIMENSION
+  with Image.open(source) as image:
+    # JPEGs can decode at a fraction of their size, which is most of the work saved
+    image.draft('RGB', (largest, largest))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+  image.info = {}
+
+  full = image.copy()
+  full.thumbnail((largest, largest), Image.LANCZOS)
+  images = {'full': full}
+  for size in settings.AVATAR_THUMBNAIL_SIZES:
+    images[str(size)] = ImageOps.fit(full, (size, size), Image.LANCZOS)
+  return {
+    name: {extension: _encode(variant, image_format) for extension, image_format in AVATAR_OUTPUT_FORMATS.items()}
+    for name, variant in images.items()
+  }
+
+
+def process_avatar(user_id, staged):
+  """
+  Turn a staged upload into the user's avatar and its variants, then remove the upload
+  and the files of the avatar it replaces.
+
+  Does nothing if another upload replaced this one in the meantime. Any failure
+  clears the pending flag, so the user is not left waiting on it.
+  """
+  try:
+    with default_storage.open(staged) as source:
+      rendered = render_avatar(source)
+    folder = f'uploads/avatars/{user_id}/{uuid.uuid4().hex[:12]}'
+    variants = {
+      name: {extension: default_storage.save(f'{folder}/{name}.{extension}', ContentFile(content))
+             for extension, content in formats.items()}
+      for name, formats in rendered.items()
+    }
+
+    previous_avatar, previous = User.objects.filter(pk=user_id).values_list('avatar', 'avatar_variants').first()
+    updated = User.objects.filter(pk=user_id, avatar_pending=staged).update(
+      avatar=variants['full']['webp'], avatar_variants=variants, avatar_pending='', avatar_pending_at=None,
+    )
+    if not updated:
+      _delete_variants(variants)
+      return
+    _delete_variants(previous)
+    # An avatar uploaded before variants existed is the original file itself
+    if previous_avatar and previous_avatar not in _variant_names(previous):
+      default_storage.delete(previous_avatar)
+  except Exception:
+    logger.exception("Could not process avatar %s", staged)
+    User.objects.filter(pk=user_id, avatar_pending=staged).update(avatar_pending='', avatar_pending_at=None)
+  finally:
+    default_storage.delete(staged)
+
+
+def _variant_names(variants):
+  return {name for formats in (variants or {}).values() for name in formats.values()}
+
+
+def _delete_variants(variants):
+  for name in _variant_names(variants):
+    default_storage.delete(name)
+
+
+def _run(user_id, staged):
+  try:
+    process_avatar(user_id, staged)
+  finally:
+    close_old_connections()
+
+
+_pool = None
+_lock = threading.Lock()
+
+
+def submit_avatar(user_id, staged):
+  """
+  Process an avatar on the background threads (Pillow releases the GIL while it
+  resizes and encodes), or inline with AVATAR_WORKERS set to 0.
+  """
+  global _pool
+  if not settings.AVATAR_WORKERS:
+    future = Future()
+    future.set_result(process_avatar(user_id, staged))
+    return future
+  with _lock:
+    if _pool is None:
+      _pool = ThreadPoolExecutor(max_workers=settings.AVATAR_WORKERS, thread_name_prefix='avatar')
+  return _pool.submit(_run, user_id, staged)
@@ -0,0 +1,41 @@
+import time
+
+from django.core.cache import caches
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user.auth import CachedJWTAuthentication
+from user.models import User
+
+
+class Command(BaseCommand):
+  help = "Measure per-request JWT authentication overhead with and without the principal cache"
+
+  def add_arguments(self, parser):
+    parser.add_argument('--requests', type=int, default=5000)
+
+  def handle(self, *args, **options):
+    # Kept between runs, deleting users cascades into tables not every deployment has
+    user = User.objects.filter(email='auth-benchmark@example.com').first() or User.objects.create_user(
+      name='Auth benchmark', email='auth-benchmark@example.com',
+    )
+    caches[settings.AUTH_PRINCIPAL_CACHE_ALIAS].clear()
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    self.stdout.write(f"database:  {connection.vendor}, cache: {settings.CACHES[settings.AUTH_PRINCIPAL_CACHE_ALIAS]['BACKEND']}")
+    for name, authentication in (('full user', JWTAuthentication()), ('principal', CachedJWTAuthentication())):
+      authentication.authenticate(request)  # Warm up
+      with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(options['requests']):
+          authentication.authenticate(request)
+        elapsed = time.perf_counter() - started
+      self.stdout.write(
+        f"{name:10} {elapsed / options['requests'] * 1e6:8.1f} us/request   "
+        f"{len(queries) / options['requests']:.2f} queries/request"
+      )
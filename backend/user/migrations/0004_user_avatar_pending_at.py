@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_user_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_pending_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,51 @@
 import uuid
+from datetime import timedelta
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser,PermissionsMixin,UserManager
-from django.db import models
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.utils import timezone
 
-class CustomUserManager(UserManager):
+# Columns the cached auth principal carries (see user.auth.CachedJWTAuthentication)
+PRINCIPAL_FIELDS = ('id','email','name','is_active','is_staff')
+
+
+def principal_cache_key(user_id):
+  return f'user:principal:{user_id}'
+
+
+def invalidate_principals(user_ids, using=DEFAULT_DB_ALIAS):
+  """
+  Drop the users' cached principals now and again once the transaction commits: a
+  concurrent request can cache the old row in between, which would otherwise outlive
+  the change for AUTH_PRINCIPAL_CACHE_TIMEOUT.
+  """
+  keys = [principal_cache_key(user_id) for user_id in user_ids]
+  if not keys:
+    return
+  cache = caches[settings.AUTH_PRINCIPAL_CACHE_ALIAS]
+  cache.delete_many(keys)
+  transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+class UserQuerySet(models.QuerySet):
+  def update(self, **kwargs):
+    if not any(field in kwargs for field in PRINCIPAL_FIELDS):
+      return super().update(**kwargs)
+    user_ids = list(self.values_list('pk',flat=True))
+    updated = super().update(**kwargs)
+    invalidate_principals(user_ids, self.db)
+    return updated
+
+  def delete(self):
+    user_ids = list(self.values_list('pk',flat=True))
+    result = super().delete()
+    invalidate_principals(user_ids, self.db)
+    return result
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
   def _create_user(self,name,email,password, **extra_fields):
     if not email:
       raise ValueError("You have not specified a valid email address")
@@ -35,6 +77,11 @@ class User(AbstractBaseUser,PermissionsMixin):
   name = models.CharField(max_length=255,blank=True,null=True)
   description = models.CharField(max_length=255,blank=True,null=True)
   avatar = models.ImageField(upload_to='uploads/avatars',null=True,blank=True)
+  # Storage names of the processed sizes, {'full'|'64'|...: {'webp': name, 'jpeg': name}}
+  avatar_variants = models.JSONField(default=dict,blank=True)
+  # Staged upload waiting for the avatar worker (user.avatars)
+  avatar_pending = models.CharField(max_length=255,blank=True,default='')
+  avatar_pending_at = models.DateTimeField(blank=True,null=True)
   
   # Business details
   business_name = models.CharField(max_length=255,blank=True,null=True)
@@ -58,8 +105,33 @@ class User(AbstractBaseUser,PermissionsMixin):
   EMAIL_FIELD = 'email'
   REQUIRED_FIELDS = ['name']
 
+  def save(self, *args, **kwargs):
+    super().save(*args, **kwargs)
+    update_fields = kwargs.get('update_fields')
+    if update_fields is None or any(field in update_fields for field in PRINCIPAL_FIELDS):
+      invalidate_principals([self.pk], self._state.db)
+
+  def delete(self, *args, **kwargs):
+    user_id, using = self.pk, self._state.db
+    result = super().delete(*args, **kwargs)
+    invalidate_principals([user_id], using)
+    return result
+
   def avatar_url(self):
     if self.avatar:
       return f'{settings.WEBSITE_URL}{self.avatar.url}'
     else:
-      return ''
\ No newline at end of file
+      return ''
+
+  def avatar_thumbnails(self):
+    """URLs of the square thumbnails, {'64': {'webp': url, 'jpeg': url}, ...}"""
+    return {
+      size: {extension: f'{settings.WEBSITE_URL}{default_storage.url(name)}' for extension, name in formats.items()}
+      for size, formats in self.avatar_variants.items() if size != 'full'
+    }
+
+  def avatar_processing(self):
+    # A worker that died mid-upload never clears the flag, so it lapses after AVATAR_PENDING_TIMEOUT
+    if not self.avatar_pending or self.avatar_pending_at is None:
+      return False
+    return timezone.now() - self.avatar_pending_at < timedelta(seconds=settings.AVATAR_PENDING_TIMEOUT)
\ No newline at end of file
@@ -2,19 +2,31 @@ from rest_framework import serializers
 from dj_rest_auth.registration.serializers import RegisterSerializer
 from dj_rest_auth.serializers import LoginSerializer
 
+from backend.instrumentation import TimedRepresentationMixin
+
 from user.models import User
 
 
-class UserDetailSerializer(serializers.ModelSerializer):
+class UserDetailSerializer(TimedRepresentationMixin,serializers.ModelSerializer):
   class Meta:
     model = User
     fields = (
-      'id','name','email','avatar_url','description',
+      'id','name','email','avatar_url','avatar_thumbnails','avatar_processing','description',
       'business_name','vat_number','registration_number',
       'address','city','postal_code','country','phone'
     )
 
 
+class UserUpdateSerializer(serializers.ModelSerializer):
+  """Profile fields a user edits on their account; used with partial=True"""
+  class Meta:
+    model = User
+    fields = (
+      'name','description','business_name','vat_number','registration_number',
+      'address','city','postal_code','country','phone'
+    )
+
+
 class CustomRegisterSerializer(RegisterSerializer):
     name = serializers.CharField(required=True, max_length=255)
 
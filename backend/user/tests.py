@@ -1,3 +1,176 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user.auth import CachedJWTAuthentication
+from user.avatars import process_avatar, stage_avatar
+from user.models import User, principal_cache_key
+
+
+class UserDetailTests(TestCase):
+  def test_detail_is_public_and_404s_on_unknown_users(self):
+    user = User.objects.create_user(name='Ana', email='ana@example.com', password='secret')
+
+    with self.assertNumQueries(1):
+      response = self.client.get(f'/api/auth/{user.pk}/')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()['email'], 'ana@example.com')
+
+    response = self.client.get('/api/auth/00000000-0000-0000-0000-000000000000/')
+    self.assertEqual(response.status_code, 404)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+  def setUp(self):
+    cache.clear()
+    self.user = User.objects.create_user(name='Ana', email='ana@example.com', password='secret', business_name='Ana Ltd')
+    self.token = str(AccessToken.for_user(self.user))
+    self.client = APIClient()
+    self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+  def authenticate(self):
+    request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+    return CachedJWTAuthentication().authenticate(request)[0]
+
+  def test_principal_is_cached_and_loads_other_fields_lazily(self):
+    with self.assertNumQueries(1):
+      self.authenticate()
+    with self.assertNumQueries(0):
+      user = self.authenticate()
+    self.assertEqual((user.pk, user.email, user.name), (self.user.pk, 'ana@example.com', 'Ana'))
+    with self.assertNumQueries(1):
+      self.assertEqual(user.business_name, 'Ana Ltd')
+
+  def test_edit_account_invalidates_and_keeps_other_fields(self):
+    self.authenticate()
+    response = self.client.post('/api/auth/edit/', {'name': 'Ana B'}, format='json')
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response.json()['business_name'], 'Ana Ltd')
+    self.assertEqual(self.authenticate().name, 'Ana B')
+
+  def test_unchanged_patch_writes_nothing(self):
+    self.authenticate()
+    with CaptureQueriesContext(connection) as captured:
+      response = self.client.patch('/api/auth/edit/', {'name': 'Ana', 'business_name': 'Ana Ltd'}, format='json')
+    self.assertEqual(response.status_code, 200)
+    self.assertFalse([q for q in captured if q['sql'].startswith('UPDATE')])
+    with self.assertNumQueries(0):
+      self.authenticate()
+
+    response = self.client.patch('/api/auth/edit/', {'phone': '123'}, format='json')
+    self.assertEqual(response.json()['phone'], '123')
+    # Not a principal field, so the cached principal stays
+    with self.assertNumQueries(0):
+      self.authenticate()
+
+  def test_deactivated_users_are_rejected(self):
+    self.authenticate()
+    User.objects.filter(pk=self.user.pk).update(is_active=False)
+    self.assertEqual(self.client.post('/api/auth/edit/', {}, format='json').status_code, 401)
+
+  def test_principal_cached_before_commit_is_dropped_on_commit(self):
+    self.authenticate()
+    key = principal_cache_key(self.user.pk)
+    with self.captureOnCommitCallbacks(execute=True):
+      stale = cache.get(key)
+      self.user.is_active = False
+      self.user.save()
+      # A concurrent request reads the row before the deactivation commits
+      cache.set(key, stale)
+    with self.assertRaises(AuthenticationFailed):
+      self.authenticate()
+
+
+@override_settings(AVATAR_WORKERS=0)
+class AvatarTests(TestCase):
+  def setUp(self):
+    media = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, media)
+    self.enterContext(override_settings(MEDIA_ROOT=media))
+    self.user = User.objects.create_user(name='Ana', email='ana@example.com', password='secret')
+    self.client = APIClient()
+    self.client.force_authenticate(self.user)
+
+  def upload(self, size=(1200, 800), image_format='JPEG'):
+    buffer = BytesIO()
+    exif = Image.Exif()
+    exif[0x0110] = 'Secret Camera'
+    Image.new('RGB', size, 'red').save(buffer, image_format, exif=exif)
+    return SimpleUploadedFile(f'avatar.{image_format.lower()}', buffer.getvalue())
+
+  def test_upload_is_resized_stripped_and_thumbnailed(self):
+    with self.captureOnCommitCallbacks(execute=True):
+      response = self.client.post('/api/auth/edit/', {'avatar': self.upload()}, format='multipart')
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response.json()['avatar_processing'])
+
+    data = self.client.get(f'/api/auth/{self.user.pk}/').json()
+    self.assertFalse(data['avatar_processing'])
+    self.assertEqual(sorted(data['avatar_thumbnails'], key=int), ['64', '128', '256'])
+    self.assertTrue(data['avatar_thumbnails']['64']['webp'].endswith('/64.webp'))
+
+    self.user.refresh_from_db()
+    with default_storage.open(self.user.avatar.name) as f, Image.open(f) as full:
+      self.assertEqual((full.format, full.size), ('WEBP', (512, 341)))
+      self.assertNotIn('exif', full.info)
+    with default_storage.open(self.user.avatar_variants['128']['jpeg']) as f, Image.open(f) as thumbnail:
+      self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (128, 128)))
+      self.assertFalse(thumbnail.getexif())
+    self.assertEqual(default_storage.listdir('uploads/avatars/incoming')[1], [])
+
+  def test_rejects_non_images(self):
+    response = self.client.post(
+      '/api/auth/edit/', {'avatar': SimpleUploadedFile('avatar.png', b'not an image')}, format='multipart'
+    )
+    self.assertEqual(response.status_code, 400)
+    self.assertFalse(User.objects.get(pk=self.user.pk).avatar_pending)
+
+  def test_superseded_upload_is_discarded(self):
+    first = stage_avatar(self.user, self.upload())
+    second = stage_avatar(self.user, self.upload(size=(300, 300), image_format='PNG'))
+    process_avatar(self.user.pk, first)
+    self.user.refresh_from_db()
+    self.assertEqual((self.user.avatar_variants, self.user.avatar_pending), ({}, second))
+
+    process_avatar(self.user.pk, second)
+    self.user.refresh_from_db()
+    self.assertEqual(self.user.avatar_pending, '')
+    root = f'uploads/avatars/{self.user.pk}'
+    files = [name for folder in default_storage.listdir(root)[0] for name in default_storage.listdir(f'{root}/{folder}')[1]]
+    # Only the second upload's four sizes in two formats remain
+    self.assertEqual(len(files), 8)
+
+  def test_original_of_replaced_avatar_is_deleted(self):
+    # An avatar from before variants, stored as the uploaded file itself
+    self.user.avatar = default_storage.save('uploads/avatars/original.jpg', self.upload())
+    self.user.save(update_fields=['avatar'])
+    process_avatar(self.user.pk, stage_avatar(self.user, self.upload()))
+    self.assertFalse(default_storage.exists('uploads/avatars/original.jpg'))
+
+  def test_failed_processing_clears_pending(self):
+    staged = stage_avatar(self.user, self.upload())
+    self.assertTrue(self.user.avatar_processing())
+    with patch('user.avatars.render_avatar', side_effect=RuntimeError('worker crashed')), self.assertLogs('user.avatars'):
+      process_avatar(self.user.pk, staged)
+    self.user.refresh_from_db()
+    self.assertEqual((self.user.avatar_pending, self.user.avatar_processing()), ('', False))
+    self.assertFalse(default_storage.exists(staged))
+
+  def test_pending_flag_lapses_when_worker_never_finishes(self):
+    stage_avatar(self.user, self.upload())
+    User.objects.filter(pk=self.user.pk).update(avatar_pending_at=timezone.now() - timedelta(hours=1))
+    self.assertFalse(self.client.get(f'/api/auth/{self.user.pk}/').json()['avatar_processing'])
@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.urls import path
 from dj_rest_auth.jwt_auth import get_refresh_view
 from dj_rest_auth.registration.views import RegisterView
 from dj_rest_auth.views import LoginView,LogoutView
 
-from user.api import user_detail, edit_account
+from user.api import user_detail, user_detail_async, edit_account
+
+if settings.ASYNC_READ_VIEWS:
+  user_detail = user_detail_async
 
 urlpatterns = [
   path('register/',RegisterView.as_view(),name='rest_register'),
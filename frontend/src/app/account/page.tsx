@@ -66,7 +66,7 @@ const AccountPage = () => {
         country: userData.country || '',
         phone: userData.phone || '',
       });
-      setAvatarUrl(userData.avatar_url ? userData.avatar_url : '/no_pfp.png');
+      setAvatarUrl(userData.avatar_thumbnails?.['256']?.webp || userData.avatar_url || '/no_pfp.png');
     };
     fetchUser();
   }, [router]);
@@ -130,7 +130,7 @@ const AccountPage = () => {
       phone: user?.phone || '',
     });
     // Reset avatar to original
-    setAvatarUrl(user?.avatar_url ? user.avatar_url : '/no_pfp.png');
+    setAvatarUrl(user?.avatar_thumbnails?.['256']?.webp || user?.avatar_url || '/no_pfp.png');
     setAvatar(null);
   };
 
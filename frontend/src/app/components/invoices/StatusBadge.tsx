@@ -10,6 +10,8 @@ const StatusBadge: React.FC<StatusBadgeProps> = ({ status }) => {
     switch (status) {
       case 'paid':
         return 'bg-green-100 text-green-800 border-green-200';
+      case 'partially_paid':
+        return 'bg-yellow-100 text-yellow-800 border-yellow-200';
       case 'sent':
         return 'bg-blue-100 text-blue-800 border-blue-200';
       case 'overdue':
@@ -22,7 +24,8 @@ const StatusBadge: React.FC<StatusBadgeProps> = ({ status }) => {
   };
 
   const getStatusText = () => {
-    return status.charAt(0).toUpperCase() + status.slice(1);
+    const text = status.replace('_', ' ');
+    return text.charAt(0).toUpperCase() + text.slice(1);
   };
 
   return (
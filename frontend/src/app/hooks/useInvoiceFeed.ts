@@ -0,0 +1,53 @@
+import { useEffect, useRef } from 'react';
+
+export interface InvoiceChange {
+  type: 'invoice.changed';
+  invoice: number;
+  actions: string[];
+  events: number;
+}
+
+const feedUrl = (invoiceId: string) =>
+  `${(process.env.NEXT_PUBLIC_API_HOST || '').replace(/^http/, 'ws')}/ws/invoices/${invoiceId}/`;
+
+// Calls onChange whenever the invoice or its audit log changes on the server,
+// reconnecting with backoff; replaces polling on open invoice screens
+const useInvoiceFeed = (invoiceId: string, onChange: (change: InvoiceChange) => void) => {
+  const handler = useRef(onChange);
+  handler.current = onChange;
+
+  useEffect(() => {
+    const token = typeof window !== 'undefined' ? localStorage.getItem('access_token') : null;
+    if (!invoiceId || !token) return;
+
+    let socket: WebSocket | null = null;
+    let retry: ReturnType<typeof setTimeout>;
+    let attempts = 0;
+    let closed = false;
+
+    const connect = () => {
+      socket = new WebSocket(feedUrl(invoiceId), ['bearer', token]);
+      socket.onopen = () => {
+        attempts = 0;
+      };
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'invoice.changed') handler.current(message);
+      };
+      socket.onclose = (event) => {
+        // 4401/4404: bad token or unknown invoice, retrying will not help
+        if (closed || event.code === 4401 || event.code === 4404) return;
+        retry = setTimeout(connect, Math.min(30000, 1000 * 2 ** attempts++));
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      socket?.close();
+    };
+  }, [invoiceId]);
+};
+
+export default useInvoiceFeed;
@@ -0,0 +1,48 @@
+import { useEffect, useState } from 'react';
+import apiService from '@/app/services/apiServices';
+
+export interface InvoiceSuggestion {
+  id: number;
+  invoice_number: string;
+  company_name: string;
+  status: string;
+  total_amount: string;
+  issue_date: string;
+}
+
+// Suggestions from the server-side invoice search, asked for once typing pauses;
+// answers to queries that were typed over are dropped
+const useInvoiceSearch = (query: string, delay = 150) => {
+  const [results, setResults] = useState<InvoiceSuggestion[]>([]);
+  const [corrected, setCorrected] = useState(false);
+
+  useEffect(() => {
+    const q = query.trim();
+    if (q.length < 2) {
+      setResults([]);
+      setCorrected(false);
+      return;
+    }
+
+    let stale = false;
+    const timer = setTimeout(async () => {
+      try {
+        const data = await apiService.get(`/api/invoices/search/?q=${encodeURIComponent(q)}`);
+        if (stale) return;
+        setResults(data.results);
+        setCorrected(data.corrected);
+      } catch {
+        if (!stale) setResults([]);
+      }
+    }, delay);
+
+    return () => {
+      stale = true;
+      clearTimeout(timer);
+    };
+  }, [query, delay]);
+
+  return { results, corrected };
+};
+
+export default useInvoiceSearch;
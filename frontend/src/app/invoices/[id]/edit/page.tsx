@@ -3,6 +3,7 @@
 import { useState, useEffect } from 'react';
 import { useRouter, useParams } from 'next/navigation';
 import apiService from '@/app/services/apiServices';
+import useInvoiceFeed from '@/app/hooks/useInvoiceFeed';
 
 interface InvoiceItem {
   id?: number;
@@ -56,6 +57,20 @@ export default function EditInvoicePage() {
     fetchAuditLogs();
   }, [invoiceId]);
 
+  // Changes made elsewhere: refresh status and history, but keep the form as typed
+  useInvoiceFeed(invoiceId, () => {
+    refreshInvoice();
+    fetchAuditLogs();
+  });
+
+  const refreshInvoice = async () => {
+    try {
+      setInvoice(await apiService.get(`/api/invoices/${invoiceId}/`));
+    } catch (err) {
+      console.error('Failed to refresh invoice:', err);
+    }
+  };
+
   const fetchInvoice = async () => {
     try {
       const data = await apiService.get(`/api/invoices/${invoiceId}/`);
@@ -81,7 +96,7 @@ export default function EditInvoicePage() {
   const fetchAuditLogs = async () => {
     try {
       const data = await apiService.get(`/api/invoices/${invoiceId}/audit-log/`);
-      setAuditLogs(data);
+      setAuditLogs(data.results);
     } catch (err) {
       console.error('Failed to load audit logs:', err);
     }
@@ -99,7 +114,8 @@ export default function EditInvoicePage() {
     setSuccess('');
 
     try {
-      await apiService.put(`/api/invoices/${invoiceId}/edit/`, formData);
+      // Unchanged fields are not written, so saving an untouched form is free
+      await apiService.patch(`/api/invoices/${invoiceId}/edit/`, formData);
       setSuccess('Invoice updated successfully');
       fetchInvoice(); // Refresh invoice data
       fetchAuditLogs(); // Refresh audit logs
@@ -5,10 +5,12 @@ import Link from 'next/link';
 import { mockInvoices } from '../lib/mockData';
 import InvoiceTable from '../components/invoices/InvoiceTable';
 import { InvoiceStatus } from '../lib/types';
+import useInvoiceSearch from '../hooks/useInvoiceSearch';
 
 export default function InvoicesPage() {
   const [statusFilter, setStatusFilter] = useState<InvoiceStatus | 'all'>('all');
   const [searchQuery, setSearchQuery] = useState('');
+  const { results: suggestions, corrected } = useInvoiceSearch(searchQuery);
 
   const filteredInvoices = mockInvoices.filter((invoice) => {
     const matchesStatus = statusFilter === 'all' || invoice.status === statusFilter;
@@ -42,15 +44,36 @@ export default function InvoicesPage() {
         <div className="bg-white p-6 rounded-lg shadow mb-6">
           <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
             {/* Search */}
-            <div>
+            <div className="relative">
               <label className="block text-sm font-medium text-gray-700 mb-2">Search</label>
               <input
                 type="text"
-                placeholder="Search by invoice number, client name, or email..."
+                placeholder="Search by invoice number, client, item or payment reference..."
                 value={searchQuery}
                 onChange={(e) => setSearchQuery(e.target.value)}
                 className="w-full px-4 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent"
               />
+              {suggestions.length > 0 && (
+                <ul className="absolute z-10 mt-1 w-full bg-white border border-gray-200 rounded-lg shadow-lg overflow-hidden">
+                  {corrected && (
+                    <li className="px-4 py-2 text-xs text-gray-500">No exact matches, showing close ones</li>
+                  )}
+                  {suggestions.map((suggestion) => (
+                    <li key={suggestion.id}>
+                      <Link
+                        href={`/invoices/${suggestion.id}`}
+                        className="flex justify-between px-4 py-2 hover:bg-gray-50"
+                      >
+                        <span>
+                          <span className="font-medium text-gray-900">{suggestion.invoice_number}</span>
+                          <span className="ml-2 text-gray-600">{suggestion.company_name}</span>
+                        </span>
+                        <span className="text-gray-500">{suggestion.total_amount}</span>
+                      </Link>
+                    </li>
+                  ))}
+                </ul>
+              )}
             </div>
 
             {/* Status Filter */}
@@ -64,6 +87,7 @@ export default function InvoicesPage() {
                 <option value="all">All Statuses</option>
                 <option value="draft">Draft</option>
                 <option value="sent">Sent</option>
+                <option value="partially_paid">Partially Paid</option>
                 <option value="paid">Paid</option>
                 <option value="overdue">Overdue</option>
               </select>
@@ -3,6 +3,9 @@ export type UserType = {
   name: string;
   email?: string;
   avatar_url: string;
+  // Square sizes ('64', '128', '256') in WebP and JPEG; prefer these over the full avatar
+  avatar_thumbnails?: Record<string, {webp: string; jpeg: string}>;
+  avatar_processing?: boolean;
   description: string;
   company_name?: string;
   vat_number?: string;
@@ -14,7 +17,7 @@ export type UserType = {
   phone?: string;
 }
 
-export type InvoiceStatus = 'draft' | 'sent' | 'paid' | 'overdue';
+export type InvoiceStatus = 'draft' | 'sent' | 'partially_paid' | 'paid' | 'overdue';
 
 export type LineItem = {
   id: string;
@@ -108,6 +108,17 @@ const apiService = {
     }
   },
 
+  patch: async function (url: string, data: any): Promise<any> {
+    console.log('patch', url, data);
+    try {
+      const response = await axiosInstance.patch(url, data);
+      console.log('Response', response.data);
+      return response.data;
+    } catch (error) {
+      throw error;
+    }
+  },
+
   delete: async function (url: string): Promise<any> {
     console.log('delete', url);
     try {